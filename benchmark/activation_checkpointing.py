@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+import torch
+import torch.multiprocessing as mp
+
+# GETS calibrator fitting without and with activation checkpointing (calibration.activation_checkpointing),
+# each mode in its own process: time per calibration epoch and the peak memory of the fit above the
+# memory in use before it (CUDA allocations on a GPU, resident set size otherwise), next to the test
+# NLL of the calibrated logits, which does not change: the recomputation replays the same dropout masks.
+#   python -m benchmark.activation_checkpointing --dataset synthetic-sbm-1000000 --modes none expert layer
+#   python -m benchmark.activation_checkpointing --override 'calibration.backbone="gat"'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PeakRSS:
+    """
+    Highest resident set size of this process while the context is open, sampled every `interval` s
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.page = os.sysconf("SC_PAGE_SIZE")
+
+    def current(self):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self.page
+
+    def _sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.start = self.peak = self.current()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.current())
+        return False
+
+
+def worker(mode, args, queue):
+    from utils.utils import load_conf, set_seed, parse_overrides
+    from dataset.dataset import Dataset
+    from model.gnns import GCN
+    from model.calibrator import CaGCN_GETS
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    set_seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = Dataset(args.dataset, n_runs=1, device=device)
+        overrides = {"calibration.calibrator_name": "GETS", "calibration.epochs": args.epochs, "calibration.patience": args.epochs}
+        overrides.update(parse_overrides(args.override))
+        overrides["calibration.activation_checkpointing"] = None if mode == "none" else mode
+        conf = load_conf(dataset=args.dataset, overrides=overrides)
+        # the calibrator's cost does not depend on how well the frozen base model is trained
+        base = GCN(dataset.features.shape[1], conf.gnn["hid_dim"], dataset.num_classes, 2, 0.5, None).to(device).eval()
+        calibrator = CaGCN_GETS(base, dataset.features.shape[1], dataset.num_classes, device, conf)
+        masks = [dataset.train_idxs[0], dataset.val_idxs[0], dataset.test_idxs[0]]
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            before = torch.cuda.memory_allocated(device)
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            calibrator.fit(dataset.g, dataset.features, dataset.labels, masks)
+            elapsed = time.perf_counter() - start
+        peak = torch.cuda.max_memory_allocated(device) - before if device.type == "cuda" else rss.peak - rss.start
+        with torch.no_grad():
+            calibrated, _, _ = calibrator(dataset.g, dataset.features)
+        nll = torch.nn.functional.cross_entropy(calibrated[masks[2]].float(), dataset.labels[masks[2]])
+    queue.put({"mode": mode, "epoch_time": elapsed / args.epochs, "peak_mb": peak / 1024 ** 2, "test_nll": float(nll)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="synthetic-sbm-200000")
+    parser.add_argument("--modes", type=str, nargs="+", default=["none", "expert", "layer"])
+    parser.add_argument("--epochs", type=int, default=5, help="Calibration epochs, early stopping is off")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--override", type=str, action="append", default=[])
+    parser.add_argument("--output", type=str, default="benchmark_output/activation_checkpointing")
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    print(f"{'checkpointing':<14s} {'epoch (s)':>10s} {'slowdown':>9s} {'peak (MB)':>10s} {'saving':>7s} {'test NLL':>9s}")
+    for mode in args.modes:
+        queue = ctx.Queue()
+        process = ctx.Process(target=worker, args=(mode, args, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        results[mode] = result
+        base = results[args.modes[0]]
+        print(f"{mode:<14s} {result['epoch_time']:>10.3f} {result['epoch_time'] / base['epoch_time']:>9.2f} "
+              f"{result['peak_mb']:>10.0f} {base['peak_mb'] / max(result['peak_mb'], 1e-9):>6.2f}x {result['test_nll']:>9.5f}")
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,99 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import torch
+import torch.multiprocessing as mp
+
+# Data-parallel GETS calibration (utils/distributed.py) on one machine: for every world size, that
+# many local processes join a gloo group and run one experiment on a synthetic graph. Reports the
+# calibration time, the test ECE and whether all ranks ended with the same calibrator weights.
+#   python -m benchmark.distributed_calibration --world_sizes 1 2 4 --dataset synthetic-sbm-100000
+# Multi-machine runs use main.py directly: torchrun --nnodes=... --nproc_per_node=... main.py --distributed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def checksum(module):
+    return float(sum(p.detach().double().sum() for name, p in module.named_parameters() if not name.startswith("model.")))
+
+
+def worker(rank, world_size, port, args, queue):
+    from utils.utils import load_conf, set_seed, parse_overrides
+    from utils.distributed import init_distributed
+    from dataset.dataset import Dataset
+    from exp.solver import Solver
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(world_size))
+    torch.set_num_threads(args.threads)
+    if world_size > 1:
+        init_distributed()
+    # every rank trains the same base model on the same split
+    set_seed(0)
+    overrides = parse_overrides(args.override)
+    overrides["calibration.calibrator_name"] = "GETS"
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = Dataset(args.dataset, n_runs=1, device=torch.device("cpu"))
+        conf = load_conf(dataset=args.dataset, overrides=overrides)
+        solver = Solver(conf, dataset, output_root=os.path.join(args.output, str(world_size)))
+        result = solver.run_exp(split=0)
+    queue.put({"rank": rank, "calibration_time": result["calibration_time"], "fit_time": result["fit_time"],
+               "uncalibrated_ece": float(result["uncalibrated"]["diff"]), "calibrated_ece": float(result["calibrated"]["diff"]),
+               "checksum": checksum(solver.calibrated_model)})
+    if world_size > 1:
+        torch.distributed.destroy_process_group()
+
+
+def run(world_size, args, target=worker):
+    """
+    target(rank, world_size, port, args, queue) on world_size local processes, returns the reports
+    they put on the queue, ordered by rank
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    port = free_port()
+    processes = [ctx.Process(target=target, args=(rank, world_size, port, args, queue)) for rank in range(world_size)]
+    for p in processes:
+        p.start()
+    reports = sorted((queue.get() for _ in processes), key=lambda r: r["rank"])
+    for p in processes:
+        p.join()
+    if any(p.exitcode != 0 for p in processes):
+        raise RuntimeError(f"A rank failed at world size {world_size}")
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="synthetic-sbm-100000-s0.3")
+    parser.add_argument("--world_sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=None, help="Threads per rank, defaults to the cores divided by the largest world size")
+    parser.add_argument("--override", type=str, action="append", default=[])
+    parser.add_argument("--output", type=str, default="benchmark_output/distributed_calibration")
+    args = parser.parse_args()
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.world_sizes))
+    os.chdir(ROOT)
+
+    results = {}
+    print(f"{'ranks':>5s} {'calib. (s)':>10s} {'speedup':>8s} {'ECE':>6s} {'-> calib.':>9s} {'ranks agree':>12s}")
+    for world_size in args.world_sizes:
+        reports = run(world_size, args)
+        first = reports[0]
+        agree = all(abs(r["checksum"] - first["checksum"]) <= 1e-6 * max(1.0, abs(first["checksum"])) for r in reports)
+        # the slowest rank bounds the step time
+        calibration_time = max(r["calibration_time"] for r in reports)
+        results[world_size] = {"calibration_time": calibration_time, "uncalibrated_ece": first["uncalibrated_ece"],
+                               "calibrated_ece": first["calibrated_ece"], "ranks_agree": agree, "ranks": reports}
+        base = results[args.world_sizes[0]]["calibration_time"]
+        print(f"{world_size:>5d} {calibration_time:>10.2f} {base / calibration_time:>8.2f} {first['uncalibrated_ece']:>6.2f} "
+              f"{first['calibrated_ece']:>9.2f} {str(agree):>12s}")
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,68 @@
+import argparse
+import contextlib
+import io
+import sys
+import numpy as np
+import torch
+from utils.utils import load_conf, set_seed, parse_overrides, inference_latency
+from dataset.dataset import Dataset
+from exp.solver import Solver
+from model.quantize import quantize_gets
+
+# Fits GETS on a few splits on the CPU, quantizes the calibrator to dynamic int8 and compares it to
+# the fp32 calibrator: calibrated degree-binned ECE and accuracy on the test nodes (regression check,
+# fails when the mean ECE moves by more than --tolerance points) and calibrated-inference latency.
+#   python -m benchmark.gets_quantization --dataset cora --n_runs 3
+
+
+def evaluate(solver, model):
+    solver.calibrated_model = model
+    acc, diff = solver._evaluate(mode='calibration')[:2]
+    return acc * 100, diff * 100
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="cora")
+    parser.add_argument("--n_runs", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calibrated forward passes per model")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Maximum mean |ECE delta| in percentage points")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--override", type=str, action="append", default=[])
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    overrides = parse_overrides(args.override)
+    overrides["calibration.calibrator_name"] = "GETS"
+    overrides["calibration.quantize"] = False
+    conf = load_conf(dataset=args.dataset, overrides=overrides)
+    dataset = Dataset(ds_name=args.dataset, n_runs=args.n_runs, device='cpu')
+    solver = Solver(conf, dataset)
+    split_seeds = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+    rows = []
+    for run in range(args.n_runs):
+        set_seed(split_seeds[run])
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver.run_exp(split=run)
+        fp32 = solver.calibrated_model
+        int8 = quantize_gets(fp32)
+        rows.append(evaluate(solver, fp32) + evaluate(solver, int8) + (
+            inference_latency(fp32, dataset.g, dataset.features, args.repeat),
+            inference_latency(int8, dataset.g, dataset.features, args.repeat),
+        ))
+        acc32, ece32, acc8, ece8, ms32, ms8 = rows[-1]
+        print(f"split {run}: ECE {ece32:.2f} -> {ece8:.2f} | Acc {acc32:.2f} -> {acc8:.2f} | "
+              f"latency {ms32:.1f}ms -> {ms8:.1f}ms")
+
+    acc32, ece32, acc8, ece8, ms32, ms8 = np.array(rows).T
+    delta = ece8 - ece32
+    print(f"{args.dataset}, backbone {conf.calibration['backbone']}, {args.n_runs} runs, {torch.get_num_threads()} threads")
+    print(f"{'':<6s} {'ECE':>14s} {'Acc':>14s} {'latency (ms)':>14s}")
+    print(f"{'fp32':<6s} {ece32.mean():>7.2f} ± {ece32.std():<4.2f} {acc32.mean():>7.2f} ± {acc32.std():<4.2f} {np.median(ms32):>14.1f}")
+    print(f"{'int8':<6s} {ece8.mean():>7.2f} ± {ece8.std():<4.2f} {acc8.mean():>7.2f} ± {acc8.std():<4.2f} {np.median(ms8):>14.1f}")
+    print(f"ECE delta {delta.mean():+.3f} (max |delta| {np.abs(delta).max():.3f}) | speedup {np.median(ms32) / np.median(ms8):.2f}x")
+    if abs(delta.mean()) > args.tolerance:
+        print(f"FAIL: mean ECE delta exceeds {args.tolerance} points")
+        sys.exit(1)
@@ -0,0 +1,83 @@
+import argparse
+import os
+import time
+import torch
+
+# Flat against two-level GETS gating (calibration.expert_groups) as the number of experts grows:
+# time of the gating alone, gate logits computed per node, and the time of a training step of the
+# mixture (forward and backward) with the experts evaluated on the whole graph or, with
+# --expert_subgraphs, on the receptive field of their routed nodes when that is smaller.
+#   python -m benchmark.hierarchical_gating --nodes 1e5 --experts 8 16 32 64
+#   python -m benchmark.hierarchical_gating --nodes 1e5 --experts 64 --groups 4 8 16 --group_select 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUTS = [["logits"], ["features"], ["degrees"], ["logits", "features"], ["features", "degrees"],
+          ["logits", "degrees"], ["logits", "features", "degrees"]]
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def build(args, num_experts, groups):
+    from model.GETS import GETS
+    torch.manual_seed(0)
+    model = GETS(args.num_classes, 16, 0.5, 2, 2, [INPUTS[i % len(INPUTS)] for i in range(num_experts)],
+                 args.feature_dim, 16, 16, True, 0.01, "cpu", expert_groups=groups,
+                 group_select=args.group_select, expert_subgraphs=args.expert_subgraphs)
+    # random routing weights, zero-initialized gates route every node to the same experts
+    with torch.no_grad():
+        for p in (model.w_gate, getattr(model, "w_group", None)):
+            if p is not None:
+                p.normal_()
+    return model.train()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=str, default="1e5")
+    parser.add_argument("--experts", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--groups", type=int, nargs="*", default=None, help="Group counts to compare, defaults to about sqrt(experts)")
+    parser.add_argument("--group_select", type=int, default=2)
+    parser.add_argument("--expert_subgraphs", action="store_true")
+    parser.add_argument("--feature_dim", type=int, default=32)
+    parser.add_argument("--num_classes", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    os.chdir(ROOT)
+    from dataset.synthetic import generate_graph
+    from dataset.features import project
+
+    g = generate_graph(int(float(args.nodes)), num_classes=args.num_classes, feature_dim=args.feature_dim)
+    features = g.ndata.pop("feat")
+    g.ndata.pop("label")
+    logits = torch.randn(g.num_nodes(), args.num_classes)
+    print(f"{g.num_nodes()} nodes, {g.num_edges()} edges")
+    print(f"{'experts':>7s} {'groups':>6s} {'gate logits/node':>17s} {'gating (ms)':>12s} {'experts run':>12s} {'step (ms)':>10s}")
+    for num_experts in args.experts:
+        for groups in [None] + (args.groups or [max(2, round(num_experts ** 0.5))]):
+            if groups is not None and groups >= num_experts:
+                continue
+            model = build(args, num_experts, groups)
+            gating_input = torch.cat([project(model.proj_feature, features), logits], dim=1).detach()
+            if groups is None:
+                gating = lambda: model.noisy_top_k_gating(gating_input, True)
+                per_node = num_experts
+            else:
+                gating = lambda: model.hierarchical_gating(gating_input, True)
+                per_node = groups + model.group_select * num_experts / groups
+            with torch.no_grad():
+                gating_ms = timed(gating, args.repeat)
+                top_k_indices = gating()[0]
+            run = len(torch.unique(top_k_indices))
+
+            def step():
+                model.zero_grad()
+                calibrated, loss, _ = model(g, logits, features)
+                (calibrated.sum() + loss).backward()
+            step_ms = timed(step, args.repeat)
+            print(f"{num_experts:>7d} {groups or '-':>6} {per_node:>17.1f} {gating_ms:>12.2f} {run:>12d} {step_ms:>10.1f}")
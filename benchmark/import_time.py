@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Packages that must only be imported on demand (by a calibrator, dataset loader or plotting call).
+# dgl itself pulls in scipy, networkx and pandas, so those cannot be kept off the startup path.
+LAZY_MODULES = ["torch_geometric", "ogb", "sklearn", "matplotlib", "seaborn", "nni"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def loaded_modules(module):
+    out = subprocess.run(
+        [sys.executable, "-c", f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))"],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    )
+    return set(json.loads(out.stdout.strip().splitlines()[-1]))
+
+
+def import_profile(module, top):
+    """
+    Import time per top-level package (sum of self times), parsed from `python -X importtime`
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    )
+    packages = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_time) / 1e6
+    return sorted(packages.items(), key=lambda x: -x[1])[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default="main", help="Module to import, relative to the repository root")
+    parser.add_argument("--budget", type=float, default=4.0, help="Maximum allowed import time in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest packages to report")
+    args = parser.parse_args()
+
+    timings = time_import(args.module, args.repeat)
+    best = min(timings)
+    print(f"import {args.module}: best {best:.3f}s | median {sorted(timings)[len(timings) // 2]:.3f}s | budget {args.budget:.3f}s")
+    for package, seconds in import_profile(args.module, args.top):
+        print(f"  {package:<24s} {seconds:.3f}s")
+
+    eager = [m for m in LAZY_MODULES if m in loaded_modules(args.module)]
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if best > args.budget:
+        print(f"FAIL: import time {best:.3f}s exceeds budget {args.budget:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
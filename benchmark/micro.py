@@ -0,0 +1,277 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import dgl
+
+# CPU micro-benchmarks of the hot functions on synthetic graphs of several sizes, compared with the
+# stored baselines (benchmark/baselines.json). A case fails when its time (fastest of the repeated
+# calls) exceeds the baseline by more than --threshold; the exit code is 1 if any case regressed.
+#   python -m benchmark.micro                      # compare against the baselines
+#   python -m benchmark.micro --cases gets_forward --sizes 1e4
+#   python -m benchmark.micro --save               # record new baselines (same machine and --threads)
+# Baselines are only comparable on the machine they were recorded on; the file keeps its description.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, "benchmark", "baselines.json")
+SIZES = [1000, 10000, 100000]
+CPU = torch.device("cpu")
+
+
+class Fixture:
+    """
+    Untrained base model and a GETS calibrator on synthetic-sbm-<num_nodes>, built once per size
+    """
+    def __init__(self, num_nodes, output):
+        from utils.utils import load_conf, set_seed
+        from dataset.dataset import Dataset
+        from exp.solver import Solver
+        # same split, weights and logits on every invocation
+        set_seed(0)
+        self.num_nodes = num_nodes
+        self.name = f"synthetic-sbm-{num_nodes}"
+        self.dataset = Dataset(self.name, n_runs=1, device=CPU)
+        self.conf = load_conf(dataset=self.name, overrides={"calibration.calibrator_name": "GETS"})
+        self.solver = Solver(self.conf, self.dataset, output_root=output)
+        self.solver._set(0)
+        self.model = self.solver.model.eval()
+        with torch.no_grad():
+            self.logits = self.model(self.dataset.g, self.dataset.features)
+        self.calibrator = self.solver._build_calibrator()
+
+    def conf_for(self, calibrator_name, **overrides):
+        from utils.utils import load_conf
+        overrides = {f"calibration.{key}": value for key, value in overrides.items()}
+        overrides["calibration.calibrator_name"] = calibrator_name
+        conf = load_conf(dataset=self.name, overrides=overrides)
+        conf.gnn.update(in_dim=self.conf.gnn["in_dim"], out_dim=self.conf.gnn["out_dim"])
+        return conf
+
+
+# Every case takes a fixture and returns the function to time
+
+def gets_forward(f):
+    learner = f.calibrator.learner.eval()
+    g, logits, features = f.dataset.g, f.logits, f.dataset.features
+    def run():
+        with torch.no_grad():
+            learner(g, logits, features)
+    return run
+
+
+def _gating_input(f):
+    learner = f.calibrator.learner
+    with torch.no_grad():
+        return torch.cat([learner.proj_feature(f.dataset.features), f.logits], dim=1)
+
+
+def noisy_top_k_gating(f):
+    learner = f.calibrator.learner
+    x = _gating_input(f)
+    torch.nn.init.normal_(learner.w_gate)
+    torch.nn.init.normal_(learner.w_noise)
+    def run():
+        with torch.no_grad():
+            learner.noisy_top_k_gating(x, train=True)
+    return run
+
+
+def prob_in_top_k(f):
+    learner = f.calibrator.learner
+    x = _gating_input(f)
+    with torch.no_grad():
+        clean = x @ torch.randn_like(learner.w_gate)
+        stddev = torch.nn.functional.softplus(x @ torch.randn_like(learner.w_noise)) + 1e-2
+        noisy = clean + torch.randn_like(clean) * stddev
+        top = noisy.topk(min(learner.k + 1, learner.num_experts), dim=1).values
+    def run():
+        with torch.no_grad():
+            learner._prob_in_top_k(clean, noisy, stddev, top)
+    return run
+
+
+def calib_attention_forward(f):
+    from model.gats import CalibAttentionLayer
+    conf = f.conf_for("GATS")
+    # random distances, shortest_path_length is benchmarked on its own
+    dist_to_train = torch.randint(0, 4, (f.num_nodes,))
+    layer = CalibAttentionLayer(in_channels=f.dataset.num_classes, out_channels=1, g=f.dataset.g,
+                                train_mask=f.dataset.train_idxs[0], dist_to_train=dist_to_train,
+                                heads=conf.calibration["heads"], bias=conf.calibration["bias"])
+    def run():
+        with torch.no_grad():
+            layer(f.logits)
+    return run
+
+
+def shortest_path_length(f):
+    from model.gats import shortest_path_length
+    src, dst = f.dataset.g.edges()
+    edge_index = torch.stack([src, dst])
+    mask = torch.zeros(f.num_nodes, dtype=torch.bool)
+    mask[f.dataset.train_idxs[0]] = True
+    return lambda: shortest_path_length(edge_index, mask, 2, CPU)
+
+
+def _fit_epoch(calibrator_name, epochs=5):
+    def case(f):
+        from model.calibrator import CaGCN_GETS, TS
+        conf = f.conf_for(calibrator_name, epochs=epochs, patience=epochs)
+        masks = [f.solver.train_idx, f.solver.val_idx, f.solver.test_idx]
+        def run():
+            if calibrator_name == "GETS":
+                calibrator = CaGCN_GETS(f.model, f.dataset.features.shape[1], f.dataset.num_classes, CPU, conf)
+            else:
+                calibrator = TS(f.model, CPU, conf)
+            calibrator.fit(f.dataset.g, f.dataset.features, f.dataset.labels, masks)
+        # reported per epoch, building the calibrator and the base logits is amortized over the epochs
+        run.calls = epochs
+        return run
+    return case
+
+
+def get_diff(f):
+    labels = f.dataset.labels[f.solver.test_idx]
+    logits = f.logits[f.solver.test_idx]
+    return lambda: f.solver._get_diff(logits, labels)
+
+
+def ensemble_scaling(f):
+    from model.calibrator import ETS
+    ets = ETS(f.model, f.dataset.num_classes, CPU, f.conf_for("ETS"))
+    logits = f.logits[f.solver.train_idx].numpy().astype(np.float64)
+    one_hot = np.eye(f.dataset.num_classes)[f.dataset.labels[f.solver.train_idx].numpy()]
+    return lambda: ets.ensemble_scaling(logits, one_hot, np.array([1.5]))
+
+
+def _prepare_data(branch):
+    def case(f):
+        from dataset.dataset import Dataset
+        g = f.dataset.g.cpu()
+        # DGL's loaders return int64 graphs, so the int32 conversion of _prepare_data copies the
+        # graph on every call and the fixture is never modified (add_edges works on the copy)
+        src, dst = g.edges()
+        if branch == "ogbn-arxiv":
+            # ogbn-arxiv comes as a directed graph with [N, 1] labels
+            keep = src < dst
+            graph = dgl.graph((src[keep].long(), dst[keep].long()), num_nodes=g.num_nodes(), idtype=torch.int64)
+            graph.ndata["feat"] = g.ndata["feat"]
+            data = _Data((graph, g.ndata["label"].unsqueeze(1)), f.dataset.num_classes)
+        else:
+            graph = dgl.graph((src.long(), dst.long()), num_nodes=g.num_nodes(), idtype=torch.int64)
+            graph.ndata.update(g.ndata)
+            data = _Data(graph, f.dataset.num_classes)
+        dataset = Dataset.__new__(Dataset)
+        dataset.ds_name, dataset.device = branch, CPU
+        return lambda: dataset._prepare_data(data)
+    return case
+
+
+class _Data:
+    def __init__(self, item, num_classes):
+        self.item = item
+        self.num_classes = num_classes
+
+    def __getitem__(self, idx):
+        return self.item
+
+
+# name: (case, sizes it runs at, None for all)
+CASES = {
+    "gets_forward": (gets_forward, None),
+    "noisy_top_k_gating": (noisy_top_k_gating, None),
+    "prob_in_top_k": (prob_in_top_k, None),
+    "calib_attention_forward": (calib_attention_forward, None),
+    # one loop iteration per training node, quadratic in the graph size
+    "shortest_path_length": (shortest_path_length, [1000, 10000]),
+    "fit_calibration_epoch[GETS]": (_fit_epoch("GETS"), None),
+    "fit_calibration_epoch[TS]": (_fit_epoch("TS"), None),
+    "get_diff": (get_diff, None),
+    "ensemble_scaling": (ensemble_scaling, None),
+    "prepare_data[cora]": (_prepare_data("cora"), None),
+    "prepare_data[ogbn-arxiv]": (_prepare_data("ogbn-arxiv"), None),
+    # largest connected component through networkx
+    "prepare_data[cora-full]": (_prepare_data("cora-full"), [1000, 10000]),
+}
+
+
+def measure(run, min_time, max_repeat):
+    """
+    Fastest seconds per call after one warm-up call, repeating until min_time has passed. The
+    minimum is the least sensitive to other load on the machine.
+    """
+    run()
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < max_repeat and (len(timings) < 3 or time.perf_counter() - start < min_time):
+        t = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - t) / getattr(run, "calls", 1))
+    return float(np.min(timings))
+
+
+def machine():
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "torch": torch.__version__, "threads": torch.get_num_threads()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=str, nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--sizes", type=str, nargs="+", default=[str(s) for s in SIZES])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown over the baseline, 0.25 = 25%%")
+    parser.add_argument("--min_time", type=float, default=0.5, help="Seconds of timed calls per case and size")
+    parser.add_argument("--max_repeat", type=int, default=50)
+    parser.add_argument("--baselines", type=str, default=BASELINES)
+    parser.add_argument("--save", action="store_true", help="Store the timings as the new baselines")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    os.chdir(ROOT)
+
+    baselines = {"machine": None, "timings": {}}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if not args.save and baselines["machine"] is not None and baselines["machine"] != machine():
+        print(f"Warning: baselines were recorded on {baselines['machine']}, this is {machine()}")
+
+    timings, regressions = {}, []
+    print(f"{'case':<30s} {'nodes':>8s} {'time (ms)':>11s} {'baseline':>10s} {'ratio':>7s}")
+    with tempfile.TemporaryDirectory() as output:
+        for size in sorted(int(float(s)) for s in args.sizes):
+            cases = [name for name in args.cases if CASES[name][1] is None or size in CASES[name][1]]
+            if not cases:
+                continue
+            # keep the dataset and training logs of the measured code out of the table
+            with contextlib.redirect_stdout(io.StringIO()):
+                fixture = Fixture(size, output)
+            for name in cases:
+                key = f"{name}/{size}"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    timings[key] = measure(CASES[name][0](fixture), args.min_time, args.max_repeat)
+                baseline = baselines["timings"].get(key)
+                ratio = timings[key] / baseline if baseline else None
+                status = ""
+                if ratio is not None and ratio > 1 + args.threshold:
+                    regressions.append(key)
+                    status = "REGRESSION"
+                print(f"{name:<30s} {size:>8d} {timings[key] * 1000:>11.3f} "
+                      f"{baseline * 1000 if baseline else float('nan'):>10.3f} {ratio or float('nan'):>7.2f} {status}")
+
+    if args.save:
+        baselines["machine"] = machine()
+        baselines["timings"].update(timings)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved {len(timings)} baselines to {args.baselines}")
+    elif regressions:
+        print(f"FAIL: {len(regressions)} case(s) slower than {1 + args.threshold:.2f}x their baseline: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,80 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Runs main.py once per precision and reports accuracy / degree-binned ECE parity next to the
+# wall time and the peak resident memory of each run, e.g. on a CPU host:
+#   python -m benchmark.mixed_precision --dataset cora --precisions fp32 bf16 --n_runs 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS = ["uncalibrated_acc", "uncalibrated_diff", "calibrated_acc", "calibrated_diff"]
+
+
+def run_child(argv, report):
+    """
+    Run main.py in this process and write its wall time and peak RSS to `report`
+    """
+    sys.argv = ["main.py"] + argv
+    start = time.perf_counter()
+    runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with open(report, "w") as f:
+        json.dump({"elapsed": elapsed, "peak_rss_mb": peak}, f)
+
+
+def run_precision(args, precision):
+    output = os.path.join(args.output, precision)
+    report = os.path.join(output, "report.json")
+    os.makedirs(output, exist_ok=True)
+    argv = [f"--dataset={args.dataset}", f"--n_runs={args.n_runs}", f"--output={output}", f"--precision={precision}"]
+    for item in args.override:
+        argv.append(f"--override={item}")
+    command = [sys.executable, "-m", "benchmark.mixed_precision", "--child", report, "--"] + argv
+    with open(os.path.join(output, "log.txt"), "w") as log:
+        subprocess.run(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT, check=True)
+    with open(report) as f:
+        result = json.load(f)
+    with open(glob.glob(os.path.join(output, "*", "*", "*metrics.json"))[0]) as f:
+        runs = json.load(f)["runs"]
+    for metric in METRICS:
+        values = np.array([run[metric] for run in runs])
+        # sample std, as print_statistics and ResultStore.aggregate report it
+        std = values.std(ddof=1) if len(values) > 1 else float("nan")
+        result[metric] = (float(values.mean()), float(std))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="cora")
+    parser.add_argument("--precisions", type=str, nargs="+", default=["fp32", "bf16"])
+    parser.add_argument("--n_runs", type=int, default=3)
+    parser.add_argument("--override", type=str, action="append", default=[])
+    parser.add_argument("--output", type=str, default="benchmark_output")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+
+    if args.child is not None:
+        run_child([a for a in rest if a != "--"], args.child)
+        sys.exit(0)
+
+    results = {precision: run_precision(args, precision) for precision in args.precisions}
+    base = results[args.precisions[0]]
+    print(f"{args.dataset}, {args.n_runs} runs")
+    print(f"{'precision':<10s} " + " ".join(f"{m:>20s}" for m in METRICS) + f" {'time (s)':>14s} {'peak RSS (MB)':>16s}")
+    for precision, result in results.items():
+        cells = [f"{result[m][0]:>12.2f} ± {result[m][1]:>5.2f}" for m in METRICS]
+        time_cell = f"{result['elapsed']:.1f} ({result['elapsed'] / base['elapsed']:.2f}x)"
+        mem_cell = f"{result['peak_rss_mb']:.0f} ({result['peak_rss_mb'] / base['peak_rss_mb']:.2f}x)"
+        print(f"{precision:<10s} " + " ".join(cells) + f" {time_cell:>14s} {mem_cell:>16s}")
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(results, f, indent=2)
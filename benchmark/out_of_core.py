@@ -0,0 +1,59 @@
+import argparse
+import os
+import tempfile
+import time
+import torch
+
+# Training epochs of the base GCN with in-memory features against memory-mapped features
+# (dataset/features.py) behind page caches of several sizes: time per epoch, page-cache hit rate
+# and read bandwidth. With a cache at least the size of the features every epoch after the first
+# is served from memory; smaller caches re-read the file on every pass.
+#   python -m benchmark.out_of_core --nodes 1e6 --feature_dim 256 --cache_mb 16 256 4096
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_epochs(model, g, features, labels, epochs):
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    start = time.perf_counter()
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(model(g, features), labels)
+        loss.backward()
+        optimizer.step()
+    return (time.perf_counter() - start) / epochs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=str, default="2e5")
+    parser.add_argument("--feature_dim", type=int, default=256)
+    parser.add_argument("--cache_mb", type=int, nargs="+", default=[16, 64, 1024])
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--dir", type=str, default=None, help="Directory of the feature file, defaults to a temporary one")
+    args = parser.parse_args()
+    os.chdir(ROOT)
+    from dataset.synthetic import generate_graph
+    from dataset.features import MemmapFeatures
+    from model.gnns import GCN
+
+    g = generate_graph(int(float(args.nodes)), feature_dim=args.feature_dim)
+    features, labels = g.ndata.pop("feat"), g.ndata.pop("label")
+    print(f"{g.num_nodes()} nodes, features {features.nbytes / 1024 ** 2:.0f} MB")
+    print(f"{'features':<16s} {'epoch (s)':>10s} {'slowdown':>9s} {'hit rate':>9s} {'read (MB)':>10s} {'MB/s':>8s}")
+    torch.manual_seed(0)
+    model = GCN(args.feature_dim, 64, 5, 2, 0.0, None)
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    base = run_epochs(model, g, features, labels, args.epochs)
+    print(f"{'in memory':<16s} {base:>10.3f} {1:>9.2f}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        path = os.path.join(directory, "features.npy")
+        MemmapFeatures.create(path, features)
+        for cache_mb in args.cache_mb:
+            mapped = MemmapFeatures(path, cache_mb=cache_mb)
+            model.load_state_dict(state)
+            epoch = run_epochs(model, g, mapped, labels, args.epochs)
+            stats = mapped.stats()
+            bandwidth = f"{stats['read_mb_per_s']:.0f}" if stats["read_mb_per_s"] else "-"
+            print(f"{f'cache {cache_mb} MB':<16s} {epoch:>10.3f} {epoch / base:>9.2f} {stats['hit_rate'] * 100:>8.1f}% "
+                  f"{stats['read_mb']:>10.1f} {bandwidth:>8s}")
@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import torch
+from benchmark.distributed_calibration import run
+
+# Partition-parallel base-model training (model/partition.py) on one machine: for every world size,
+# that many local processes train the base GNN on one partition each of a synthetic graph. Reports
+# the training time per epoch and its speedup over one process, the halo sizes, the test accuracy
+# and ECE, and the largest difference between the gathered logits and a full-graph forward of the
+# trained model (0 up to float rounding when the partitioned forward is exact).
+#   python -m benchmark.partitioned_training --world_sizes 1 2 4 --dataset synthetic-powerlaw-1000000
+#   python -m benchmark.partitioned_training --override 'gnn.type="gat"' --override train.partition='"random"'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(rank, world_size, port, args, queue):
+    from utils.utils import load_conf, set_seed, parse_overrides
+    from utils.distributed import init_distributed
+    from dataset.dataset import Dataset
+    from exp.solver import Solver
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(world_size))
+    torch.set_num_threads(args.threads)
+    if world_size > 1:
+        init_distributed()
+    set_seed(0)
+    overrides = {"train.partition": "metis", "train.epochs": args.epochs, "train.patience": args.epochs,
+                 "calibration.calibrator_name": "TS", "calibration.epochs": 1}
+    overrides.update(parse_overrides(args.override))
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = Dataset(args.dataset, n_runs=1, device=torch.device("cpu"))
+        conf = load_conf(dataset=args.dataset, overrides=overrides)
+        solver = Solver(conf, dataset, output_root=os.path.join(args.output, str(world_size)))
+        start = time.time()
+        result = solver.run_exp(split=0)
+    report = {"rank": rank, "fit_time": result["fit_time"], "epoch_time": result["fit_time"] / args.epochs,
+              "acc": float(result["uncalibrated"]["acc"]), "ece": float(result["uncalibrated"]["diff"]),
+              "elapsed": time.time() - start}
+    if world_size > 1:
+        partition = solver.partition
+        report.update(owned=len(partition.owned), halo=len(partition.halo))
+        if rank == 0:
+            gnn = solver.gnn.eval()
+            with torch.no_grad():
+                full = gnn(dataset.g, dataset.features)
+            report["max_logit_diff"] = float((full - solver.model.logits).abs().max())
+        torch.distributed.destroy_process_group()
+    queue.put(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="synthetic-powerlaw-200000")
+    parser.add_argument("--world_sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--epochs", type=int, default=20, help="Training epochs, early stopping is off so every world size trains as long")
+    parser.add_argument("--threads", type=int, default=None, help="Threads per rank, defaults to the cores divided by the largest world size")
+    parser.add_argument("--override", type=str, action="append", default=[])
+    parser.add_argument("--output", type=str, default="benchmark_output/partitioned_training")
+    args = parser.parse_args()
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.world_sizes))
+    os.chdir(ROOT)
+
+    results = {}
+    print(f"{'ranks':>5s} {'epoch (s)':>10s} {'speedup':>8s} {'halo/owned':>11s} {'acc':>6s} {'ECE':>6s} {'max |logit diff|':>17s}")
+    for world_size in args.world_sizes:
+        reports = run(world_size, args, target=worker)
+        first = reports[0]
+        # the slowest rank bounds the epoch time
+        epoch_time = max(r["epoch_time"] for r in reports)
+        halo = sum(r.get("halo", 0) for r in reports) / max(1, sum(r.get("owned", 0) for r in reports))
+        results[world_size] = {"epoch_time": epoch_time, "halo_ratio": halo, "acc": first["acc"], "ece": first["ece"],
+                               "max_logit_diff": first.get("max_logit_diff"), "ranks": reports}
+        base = results[args.world_sizes[0]]["epoch_time"]
+        diff = first.get("max_logit_diff")
+        print(f"{world_size:>5d} {epoch_time:>10.3f} {base / epoch_time:>8.2f} {halo:>11.2f} {first['acc']:>6.3f} "
+              f"{first['ece']:>6.2f} {'-' if diff is None else f'{diff:.2e}':>17s}")
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import time
+import numpy as np
+from utils.store import ResultStore
+
+# Scaling benchmark on synthetic graphs (dataset/synthetic.py), no downloads needed. For every size
+# the graph is generated once (and cached), then main.py runs base training and one calibrator per
+# child process, so that the peak memory of every (size, calibrator) pair is measured on its own.
+# Fit/calibration time, peak memory, ECE and the degree-binned calibration gaps come from the result
+# store; a pair that fails or times out is reported and the calibrator is skipped at larger sizes.
+#   python -m benchmark.scaling --model powerlaw --sizes 1e3 1e4 1e5 1e6 --calibrators TS GETS \
+#       --override train.epochs=50 --override calibration.epochs=100
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALIBRATORS = ["TS", "VS", "ETS", "CaGCN", "GATS", "GETS"]
+
+
+def dataset_name(args, size):
+    name = f"synthetic-{args.model}-{int(float(size))}-h{args.homophily}-s{args.skew}-d{args.avg_degree}"
+    return name + "".join(f"-{option}" for option in args.option)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(argv, report):
+    """
+    Generate a dataset (--generate name) or run main.py in this process, and write the wall time
+    and peak RSS to `report`
+    """
+    start = time.perf_counter()
+    if argv[0] == "--generate":
+        from dataset.synthetic import SyntheticGraphDataset
+        SyntheticGraphDataset(argv[1])
+    else:
+        sys.argv = ["main.py"] + argv
+        runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+    with open(report, "w") as f:
+        json.dump({"elapsed": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}, f)
+
+
+def spawn(argv, output, timeout):
+    """
+    Run a child, returns its report or None when it failed
+    """
+    os.makedirs(output, exist_ok=True)
+    report = os.path.join(output, "report.json")
+    if os.path.exists(report):
+        os.remove(report)
+    command = [sys.executable, "-m", "benchmark.scaling", "--child", report, "--"] + argv
+    with open(os.path.join(output, "log.txt"), "w") as log:
+        try:
+            returncode = subprocess.run(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT, timeout=timeout).returncode
+        except subprocess.TimeoutExpired:
+            return None
+    if returncode != 0 or not os.path.exists(report):
+        return None
+    with open(report) as f:
+        return json.load(f)
+
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return float(np.mean(values)) if values else None
+
+
+def run_pair(args, name, calibrator, store):
+    output = os.path.join(args.output, name, calibrator)
+    argv = [f"--dataset={name}", f"--n_runs={args.n_runs}", f"--output={output}", f"--store={store.path}",
+            f"--override=calibration.calibrator_name={json.dumps(calibrator)}"]
+    argv += [f"--override={item}" for item in args.override]
+    start = time.time()
+    report = spawn(argv, output, args.timeout)
+    if report is None:
+        return None
+    rows = store.query(dataset=name, calibrator=calibrator, where=f"created >= {start}")
+    result = {"elapsed": report["elapsed"], "peak_rss_mb": report["peak_rss_mb"]}
+    for metric in ["fit_time", "calibration_time", "uncalibrated_ece", "calibrated_ece", "uncalibrated_acc", "calibrated_acc"]:
+        result[metric] = mean([row[metric] for row in rows])
+    for kind in ["uncalibrated_gaps", "calibrated_gaps"]:
+        result[kind] = np.mean([json.loads(row[kind]) for row in rows], axis=0).tolist()
+    return result
+
+
+def plot(results, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    for calibrator, by_size in results["runs"].items():
+        sizes = [int(size) for size, r in by_size.items() if r is not None]
+        ok = [r for r in by_size.values() if r is not None]
+        axes[0].plot(sizes, [r["calibration_time"] for r in ok], marker="o", label=calibrator)
+        axes[1].plot(sizes, [r["peak_rss_mb"] for r in ok], marker="o", label=calibrator)
+        axes[2].plot(sizes, [r["calibrated_ece"] for r in ok], marker="o", label=calibrator)
+    first = next(iter(results["runs"].values()))
+    sizes = [int(size) for size, r in first.items() if r is not None]
+    axes[0].plot(sizes, [first[str(size)]["fit_time"] for size in sizes], marker="s", linestyle="--", color="black", label="base training")
+    axes[2].plot(sizes, [first[str(size)]["uncalibrated_ece"] for size in sizes], marker="s", linestyle="--", color="black", label="uncalibrated")
+    for ax, label in zip(axes, ["time (s)", "peak RSS (MB)", "ECE (%)"]):
+        ax.set_xscale("log")
+        ax.set_xlabel("nodes")
+        ax.set_ylabel(label)
+        ax.grid(True)
+    axes[0].set_yscale("log")
+    axes[0].legend()
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="sbm", choices=["sbm", "powerlaw"])
+    parser.add_argument("--sizes", type=str, nargs="+", default=["1e3", "1e4", "1e5", "1e6"])
+    parser.add_argument("--homophily", type=float, default=0.8)
+    parser.add_argument("--skew", type=float, default=0.3, help="Degree-dependent label noise, see dataset/synthetic.py")
+    parser.add_argument("--avg_degree", type=int, default=10)
+    parser.add_argument("--option", type=str, action="append", default=[], help="Extra dataset name option, e.g. c10 for 10 classes")
+    parser.add_argument("--calibrators", type=str, nargs="+", default=CALIBRATORS)
+    parser.add_argument("--n_runs", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds per (size, calibrator) run")
+    parser.add_argument("--override", type=str, action="append", default=[])
+    parser.add_argument("--output", type=str, default="benchmark_output/scaling")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+
+    if args.child is not None:
+        run_child([a for a in rest if a != "--"], args.child)
+        sys.exit(0)
+
+    os.makedirs(args.output, exist_ok=True)
+    store = ResultStore(os.path.abspath(os.path.join(args.output, "results.db")))
+    results = {"generation": {}, "runs": {calibrator: {} for calibrator in args.calibrators}}
+    failed = set()
+    print(f"{'dataset':<44s} {'calibrator':<10s} {'base (s)':>9s} {'calib. (s)':>10s} {'peak RSS (MB)':>14s} {'ECE':>6s} {'-> calib.':>9s}")
+    for size in args.sizes:
+        size = int(float(size))
+        name = dataset_name(args, size)
+        generation = spawn(["--generate", name], os.path.join(args.output, name), args.timeout)
+        results["generation"][str(size)] = generation
+        if generation is None:
+            print(f"{name:<44s} generation failed")
+            break
+        print(f"{name:<44s} {'(graph)':<10s} {generation['elapsed']:>9.1f} {'':>10s} {generation['peak_rss_mb']:>14.0f}")
+        for calibrator in args.calibrators:
+            result = None if calibrator in failed else run_pair(args, name, calibrator, store)
+            results["runs"][calibrator][str(size)] = result
+            if result is None:
+                print(f"{name:<44s} {calibrator:<10s} {'skipped' if calibrator in failed else 'failed or timed out'}")
+                failed.add(calibrator)
+                continue
+            print(f"{name:<44s} {calibrator:<10s} {result['fit_time']:>9.1f} {result['calibration_time']:>10.1f} "
+                  f"{result['peak_rss_mb']:>14.0f} {result['uncalibrated_ece']:>6.2f} {result['calibrated_ece']:>9.2f}")
+    store.close()
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    plot(results, os.path.join(args.output, "scaling.png"))
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Load test of serve.py: for every batching delay and concurrency level, starts a server on a Unix
+# socket for a run saved with main.py --save_models and has that many clients send requests of
+# random nodes back to back over keep-alive connections. Reports the throughput, the client-side
+# latency percentiles and, from /metrics, the mean micro-batch size and inference time per batch.
+#   python main.py --dataset synthetic-sbm-100000 --n_runs 1 --save_models models/sbm
+#   python -m benchmark.serving --model models/sbm/run0.pt --concurrency 1 8 32 --max_wait_ms 0 2 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(socket, num_nodes, nodes_per_request, deadline, latencies, rng):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    while time.perf_counter() < deadline:
+        nodes = rng.integers(0, num_nodes, nodes_per_request).tolist()
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, "POST", "/predict", {"nodes": nodes})
+        assert status == 200
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.close()
+
+
+async def load(socket, args, concurrency):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    _, health = await request(reader, writer, "GET", "/health")
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(socket, health["num_nodes"], args.nodes_per_request, start + args.duration, latencies,
+                                  np.random.default_rng(i)) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    _, metrics = await request(reader, writer, "GET", "/metrics")
+    writer.close()
+    return {"requests": len(latencies), "throughput": len(latencies) / elapsed,
+            "p50": float(np.percentile(latencies, 50)), "p99": float(np.percentile(latencies, 99)),
+            "requests_per_batch": metrics["batch_requests"]["mean"], "inference_ms": metrics["inference_ms"]["mean"]}
+
+
+def start_server(args, socket, max_wait_ms):
+    command = [sys.executable, "serve.py", "--model", args.model, "--socket", socket, "--max_wait_ms", str(max_wait_ms),
+               "--max_batch_nodes", str(args.max_batch_nodes)]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    # the server prints one line once it has loaded the model
+    process.stdout.readline()
+    while not os.path.exists(socket):
+        time.sleep(0.05)
+    return process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="Saved calibrator, <save_models>/run<id>.pt")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max_wait_ms", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--max_batch_nodes", type=int, default=1024)
+    parser.add_argument("--nodes_per_request", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per concurrency level")
+    args = parser.parse_args()
+    args.model = os.path.abspath(args.model)
+
+    print(f"{'wait (ms)':>9s} {'clients':>7s} {'requests':>9s} {'req/s':>8s} {'p50 (ms)':>9s} {'p99 (ms)':>9s} {'req/batch':>10s} {'batch (ms)':>11s}")
+    with tempfile.TemporaryDirectory() as directory:
+        for max_wait_ms in args.max_wait_ms:
+            for concurrency in args.concurrency:
+                socket = os.path.join(directory, f"serve-{max_wait_ms}-{concurrency}.sock")
+                process = start_server(args, socket, max_wait_ms)
+                try:
+                    r = asyncio.run(load(socket, args, concurrency))
+                finally:
+                    process.terminate()
+                    process.wait()
+                print(f"{max_wait_ms:>9.1f} {concurrency:>7d} {r['requests']:>9d} {r['throughput']:>8.1f} {r['p50']:>9.2f} "
+                      f"{r['p99']:>9.2f} {r['requests_per_batch']:>10.2f} {r['inference_ms']:>11.2f}")
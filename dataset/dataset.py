@@ -1,22 +1,55 @@
+import os
 import torch
 from dgl import AddSelfLoop, DGLGraph
-from dgl.data import CiteseerGraphDataset, CoraGraphDataset, PubmedGraphDataset, RedditDataset, CoraFullDataset, AmazonCoBuyComputerDataset, AmazonCoBuyPhotoDataset, CoauthorCSDataset, CoauthorPhysicsDataset
-from ogb.nodeproppred import DglNodePropPredDataset
 import numpy as np
-import networkx as nx
 
 class Dataset:
-    def __init__(self, ds_name, n_runs=1):
+    def __init__(self, ds_name, n_runs=1, device=None, out_of_core=None, feature_cache_mb=1024):
+        """
+        out_of_core: directory for a memory-mapped copy of the node features, which then stay out of
+        memory (dataset/features.py) behind a page cache of feature_cache_mb
+        """
         self.ds_name = ds_name
         self.n_runs = n_runs
-        self.device = torch.device('cuda')
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
         data = load_dataset(ds_name)
         self.g, self.features, self.labels, self.num_classes = self._prepare_data(data)
         self.train_idxs, self.val_idxs, self.test_idxs = self._split_data(data)
+        if out_of_core is not None:
+            self._spill_features(out_of_core, feature_cache_mb)
         print(f"Dataset: {ds_name} | #Nodes: {self.g.number_of_nodes()} | #Edges: {self.g.number_of_edges()} | #Classes: {self.num_classes} |#Features: {self.features.shape[1]}")
+
+    def nbytes(self):
+        """
+        Approximate memory footprint of the graph, features and labels
+        """
+        edge_bytes = 2 * self.g.number_of_edges() * self.g.idtype.itemsize
+        return self.features.nbytes + self.labels.nbytes + edge_bytes
+
+    def _spill_features(self, directory, cache_mb):
+        from dataset.features import MemmapFeatures
+        path = os.path.join(directory, f"{self.ds_name}.features.npy")
+        if os.path.exists(path) and np.load(path, mmap_mode="r").shape == tuple(self.features.shape):
+            self.features = MemmapFeatures(path, device=self.device, cache_mb=cache_mb)
+        else:
+            self.features = MemmapFeatures.create(path, self.features, device=self.device, cache_mb=cache_mb)
+        # the graph keeps no second in-memory copy
+        self.g.ndata.pop("feat", None)
+        print(f"Node features out of core: {path} ({self.features.shape[0]} x {self.features.shape[1]}, {cache_mb} MB cache)")
+
+    def share_memory_(self):
+        """
+        Move the node tensors into shared memory so that worker processes read them without copying
+        """
+        if self.device.type == 'cpu':
+            self.features.share_memory_()
+            self.labels.share_memory_()
+        return self
     
     def _prepare_data(self, data):
-        if self.ds_name in ["cora", "citeseer", "pubmed", "reddit"]:
+        if self.ds_name in ["cora", "citeseer", "pubmed", "reddit"] or self.ds_name.startswith("synthetic"):
             g = data[0]
             g = g.int().to(self.device)
 
@@ -42,6 +75,7 @@ class Dataset:
             labels = g.ndata["label"]
 
             # Find the largest connected component
+            import networkx as nx
             nx_g = g.to_networkx()
             nx_g = nx_g.to_undirected()
             largest_cc = max(nx.connected_components(nx_g), key=len)
@@ -57,7 +91,7 @@ class Dataset:
         train_idxs = []
         val_idxs = []
         test_idxs = []
-        if self.ds_name in ["cora", "citeseer", "pubmed", "reddit"]:
+        if self.ds_name in ["cora", "citeseer", "pubmed", "reddit"] or self.ds_name.startswith("synthetic"):
             # train_idx, val_idx, test_idx = self.g.ndata["train_mask"], self.g.ndata["val_mask"], self.g.ndata["test_mask"]
             idx = np.array(range(len(self.labels)))
             np.random.shuffle(idx)
@@ -92,26 +126,40 @@ class Dataset:
         return train_idxs, val_idxs, test_idxs
         
 def load_dataset(ds_name):
+    # dgl.data and ogb are slow to import, only pull in the loader we need
     if ds_name== "cora":
+        from dgl.data import CoraGraphDataset
         data = CoraGraphDataset(transform=AddSelfLoop())
     elif ds_name == "citeseer":
+        from dgl.data import CiteseerGraphDataset
         data = CiteseerGraphDataset(transform=AddSelfLoop())
     elif ds_name == "pubmed":
+        from dgl.data import PubmedGraphDataset
         data = PubmedGraphDataset(transform=AddSelfLoop())
     elif ds_name == "reddit":
+        from dgl.data import RedditDataset
         data = RedditDataset(transform=AddSelfLoop())
     elif ds_name == "cora-full":
+        from dgl.data import CoraFullDataset
         data = CoraFullDataset(transform=AddSelfLoop())
     elif ds_name == "computers":
+        from dgl.data import AmazonCoBuyComputerDataset
         data = AmazonCoBuyComputerDataset()
     elif ds_name == "photo":
+        from dgl.data import AmazonCoBuyPhotoDataset
         data = AmazonCoBuyPhotoDataset()
     elif ds_name == "cs":
+        from dgl.data import CoauthorCSDataset
         data = CoauthorCSDataset()
     elif ds_name == "physics":
+        from dgl.data import CoauthorPhysicsDataset
         data = CoauthorPhysicsDataset()
     elif ds_name == "ogbn-arxiv":
+        from ogb.nodeproppred import DglNodePropPredDataset
         data = DglNodePropPredDataset(name="ogbn-arxiv")
+    elif ds_name.startswith("synthetic"):
+        from dataset.synthetic import SyntheticGraphDataset
+        data = SyntheticGraphDataset(ds_name)
     else:
         raise ValueError(f"Unknown dataset: {ds_name}")
     return data
\ No newline at end of file
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from utils.profiler import profile
+
+# Out-of-core node features: an [N, F] matrix kept in a memory-mapped .npy file instead of memory.
+# Rows are read in pages of `page_rows` rows through a bounded LRU page cache; row gathers
+# (features[idx]) return in-memory tensors, and full passes over the matrix stream it in chunks
+# whose next chunks are read by a background thread while the caller computes on the current one.
+# The models only consume features through a linear projection (project / chunked_matmul), so
+# base training, GETS and inference run with [N, hidden] activations and never the [N, F] matrix.
+
+
+class MemmapFeatures:
+    def __init__(self, path, device=None, page_rows=4096, chunk_rows=65536, cache_mb=1024, prefetch=2):
+        """
+        path: .npy file (see create). cache_mb bounds the page cache; prefetch: chunks read ahead
+        """
+        self.path = path
+        self.array = np.load(path, mmap_mode="r")
+        self.shape = torch.Size(self.array.shape)
+        self.dtype = torch.from_numpy(np.empty(0, dtype=self.array.dtype)).dtype
+        self.device = torch.device(device or "cpu")
+        self.page_rows = page_rows
+        self.chunk_rows = max(page_rows, chunk_rows // page_rows * page_rows)
+        self.row_bytes = self.array.itemsize * self.shape[1]
+        self.cache_pages = max(1, int(cache_mb * 1024 ** 2) // (page_rows * self.row_bytes))
+        self.prefetch = prefetch
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.reset_stats()
+
+    @classmethod
+    def create(cls, path, features, **kwargs):
+        """
+        Write features ([N, F] tensor) to path in row chunks, returns the memory-mapped copy
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        features = features.detach().cpu()
+        out = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=features.numpy().dtype, shape=tuple(features.shape))
+        step = 1 << 16
+        for start in range(0, len(features), step):
+            out[start:start + step] = features[start:start + step].numpy()
+        out.flush()
+        del out
+        # the file only appears once complete, a crashed write is not mistaken for a cached one
+        os.replace(path + ".tmp", path)
+        return cls(path, **kwargs)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def is_cuda(self):
+        return self.device.type == "cuda"
+
+    @property
+    def nbytes(self):
+        # resident footprint: the page cache, the file itself is shared through the OS page cache
+        return self.cache_pages * self.page_rows * self.row_bytes
+
+    def share_memory_(self):
+        return self
+
+    def reset_stats(self):
+        self.hits = self.misses = self.bytes_read = 0
+        self.read_seconds = 0.0
+
+    def stats(self):
+        """
+        Page-cache hit rate and the bandwidth of the reads that missed it
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "read_mb": self.bytes_read / 1024 ** 2,
+            "read_seconds": self.read_seconds,
+            "read_mb_per_s": self.bytes_read / 1024 ** 2 / self.read_seconds if self.read_seconds else None,
+            "cached_mb": len(self.cache) * self.page_rows * self.row_bytes / 1024 ** 2,
+        }
+
+    def format_stats(self):
+        stats = self.stats()
+        if stats["hit_rate"] is None:
+            return "Feature cache: no reads"
+        bandwidth = f"{stats['read_mb_per_s']:.0f} MB/s" if stats["read_mb_per_s"] is not None else "-"
+        return (f"Feature cache: hit rate {stats['hit_rate'] * 100:.1f}% ({stats['hits']}/{stats['hits'] + stats['misses']} pages), "
+                f"read {stats['read_mb']:.1f} MB at {bandwidth}, {stats['cached_mb']:.0f} MB cached")
+
+    def _page(self, page):
+        with self.lock:
+            rows = self.cache.get(page)
+            if rows is not None:
+                self.cache.move_to_end(page)
+                self.hits += 1
+                return rows
+        start = page * self.page_rows
+        with profile("feature_read", rows=self.page_rows):
+            t = time.perf_counter()
+            rows = torch.from_numpy(np.array(self.array[start:start + self.page_rows]))
+            elapsed = time.perf_counter() - t
+        with self.lock:
+            self.misses += 1
+            self.bytes_read += rows.numel() * rows.element_size()
+            self.read_seconds += elapsed
+            self.cache[page] = rows
+            while len(self.cache) > self.cache_pages:
+                self.cache.popitem(last=False)
+        return rows
+
+    def rows(self, start, stop):
+        """
+        Contiguous rows [start, stop) as a CPU tensor
+        """
+        first, last = start // self.page_rows, (stop - 1) // self.page_rows
+        pages = torch.cat([self._page(page) for page in range(first, last + 1)])
+        offset = first * self.page_rows
+        return pages[start - offset:stop - offset]
+
+    def __getitem__(self, idx):
+        """
+        Rows idx (index tensor or array, slice, or int) as a tensor on self.device
+        """
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            return self.rows(start, stop)[::step].to(self.device) if stop > start else torch.empty((0, self.shape[1]), dtype=self.dtype, device=self.device)
+        idx = torch.as_tensor(idx).cpu().long()
+        scalar = idx.dim() == 0
+        idx = idx.reshape(-1)
+        out = torch.empty((len(idx), self.shape[1]), dtype=self.dtype)
+        if len(idx):
+            # one pass over the touched pages in page order
+            pages = idx // self.page_rows
+            order = torch.argsort(pages)
+            unique, counts = torch.unique_consecutive(pages[order], return_counts=True)
+            for page, positions in zip(unique.tolist(), order.split(counts.tolist())):
+                out[positions] = self._page(page)[idx[positions] - page * self.page_rows]
+        out = out.to(self.device)
+        return out[0] if scalar else out
+
+    def __getstate__(self):
+        # spawned workers reopen the file with an empty cache
+        state = self.__dict__.copy()
+        for key in ("array", "lock", "_pool", "_pool_pid"):
+            state.pop(key)
+        state["cache"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.array = np.load(self.path, mmap_mode="r")
+        self.lock = threading.Lock()
+        self._pool = self._pool_pid = None
+
+    def _executor(self):
+        # threads do not survive a fork, worker processes start their own
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(1, thread_name_prefix="feature-prefetch")
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def chunks(self):
+        """
+        (start, rows) over all rows, chunk_rows at a time; up to `prefetch` next chunks are read in
+        the background while the caller works on the current one
+        """
+        starts = list(range(0, len(self), self.chunk_rows))
+        pool = self._executor()
+        pending = deque()
+        for i, start in enumerate(starts):
+            while len(pending) <= self.prefetch and i + len(pending) < len(starts):
+                s = starts[i + len(pending)]
+                pending.append(pool.submit(self.rows, s, min(s + self.chunk_rows, len(self))))
+            yield start, pending.popleft().result()
+
+
+class _ChunkedMatmul(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, weight, features):
+        ctx.features = features
+        ctx.save_for_backward(weight)
+        out = None
+        for start, rows in features.chunks():
+            # under autocast the chunks are multiplied in the autocast dtype, like in-memory features
+            part = rows.to(weight.device) @ weight
+            if out is None:
+                out = part.new_empty((len(features), part.shape[1]))
+            out[start:start + len(part)] = part
+        return out
+
+    @staticmethod
+    def backward(ctx, grad):
+        weight, = ctx.saved_tensors
+        grad_weight = torch.zeros_like(weight)
+        for start, rows in ctx.features.chunks():
+            rows = rows.to(weight.device, weight.dtype)
+            grad_weight += rows.t() @ grad[start:start + len(rows)].to(weight.dtype)
+        return grad_weight, None
+
+
+def chunked_matmul(features, weight):
+    """
+    features @ weight ([F, out]) for in-memory or MemmapFeatures features, differentiable in weight
+    """
+    if isinstance(features, torch.Tensor):
+        return features @ weight
+    return _ChunkedMatmul.apply(weight, features)
+
+
+def project(linear, features):
+    """
+    linear(features) for an nn.Linear (or a quantized linear at inference) and in-memory or
+    MemmapFeatures features
+    """
+    if isinstance(features, torch.Tensor):
+        return linear(features)
+    if not isinstance(getattr(linear, "weight", None), torch.Tensor):
+        # quantized modules (CPU, inference only): project chunk by chunk
+        return torch.cat([linear(rows) for _, rows in features.chunks()])
+    out = chunked_matmul(features, linear.weight.t())
+    return out + linear.bias if linear.bias is not None else out
@@ -0,0 +1,123 @@
+import math
+import os
+import torch
+import dgl
+
+# Offline synthetic node-classification graphs from 10^3 to 10^7 nodes.
+# Edges follow a degree-corrected stochastic block model: every edge endpoint is drawn with
+# probability proportional to a node weight (all ones for "sbm", Pareto distributed for
+# "powerlaw"), and the second endpoint is in the same class with probability `homophily`.
+# Features are noisy class centroids. `calibration_skew` flips the observed label of a node with a
+# probability that decays with its degree, so that a model trusting the features is overconfident
+# on low-degree nodes, the degree-dependent miscalibration GETS is meant to correct.
+#
+# Dataset names describe the generator, e.g. synthetic-sbm-100000 or
+# synthetic-powerlaw-1000000-h0.6-s0.3-d20-c10 (h: homophily, s: calibration skew, d: average
+# degree, c: classes, f: feature dimension, r: random seed). Generated graphs are cached on disk.
+
+MODELS = ["sbm", "powerlaw"]
+OPTIONS = {
+    "h": ("homophily", float),
+    "s": ("calibration_skew", float),
+    "d": ("avg_degree", int),
+    "c": ("num_classes", int),
+    "f": ("feature_dim", int),
+    "r": ("seed", int),
+}
+
+
+def parse_name(ds_name):
+    """
+    Generator arguments encoded in a dataset name synthetic-<model>-<num_nodes>[-<option><value>...]
+    """
+    parts = ds_name.split("-")
+    if len(parts) < 3 or parts[0] != "synthetic" or parts[1] not in MODELS:
+        raise ValueError(f"Synthetic dataset names are synthetic-<{'|'.join(MODELS)}>-<num_nodes>[-h0.8-s0.3...], got {ds_name}")
+    kwargs = {"model": parts[1], "num_nodes": int(float(parts[2]))}
+    for part in parts[3:]:
+        if part[0] not in OPTIONS:
+            raise ValueError(f"Unknown synthetic dataset option {part}, choose from {list(OPTIONS)}")
+        name, cast = OPTIONS[part[0]]
+        kwargs[name] = cast(part[1:])
+    return kwargs
+
+
+def _sample(cumulative, low, high, generator):
+    """
+    Indices i with cumulative[i-1] <= u < cumulative[i] for u uniform in [low, high), element-wise
+    """
+    u = low + (high - low) * torch.rand(low.shape, generator=generator, dtype=torch.float64)
+    return torch.searchsorted(cumulative, u, right=True).clamp_(max=len(cumulative) - 1)
+
+
+def generate_graph(num_nodes, model="sbm", num_classes=5, avg_degree=10, homophily=0.8, power=2.5,
+                   feature_dim=32, feature_noise=1.0, calibration_skew=0.0, seed=0):
+    """
+    Returns a symmetric DGLGraph with self-loops, "feat" (float32) and "label" (int64) node data.
+    Duplicate edges are kept, removing them would cost more than generating the graph at 10^7 nodes.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    n = num_nodes
+    # nodes are grouped by class, so each class is a contiguous range of the cumulative weights
+    labels = torch.sort(torch.randint(0, num_classes, (n,), generator=generator)).values
+    starts = torch.searchsorted(labels, torch.arange(num_classes + 1))
+    if model == "sbm":
+        weights = torch.ones(n, dtype=torch.float64)
+    elif model == "powerlaw":
+        # Pareto weights with tail exponent `power`, the expected degrees follow the same power law
+        weights = torch.rand(n, generator=generator, dtype=torch.float64).pow(-1 / (power - 1))
+        weights.clamp_(max=math.sqrt(n))
+    else:
+        raise ValueError(f"Unknown graph model {model}, choose from {MODELS}")
+    weights = weights / weights.mean()
+    cumulative = torch.cumsum(weights, 0)
+    bounds = torch.cat([torch.zeros(1, dtype=torch.float64), cumulative])
+
+    num_edges = n * avg_degree // 2
+    src = _sample(cumulative, torch.zeros(num_edges, dtype=torch.float64), torch.full((num_edges,), cumulative[-1].item()), generator)
+    same = torch.rand(num_edges, generator=generator) < homophily
+    shift = torch.randint(1, max(num_classes, 2), (num_edges,), generator=generator)
+    dst_class = torch.where(same, labels[src], (labels[src] + shift) % num_classes)
+    dst = _sample(cumulative, bounds[starts[dst_class]], bounds[starts[dst_class + 1]], generator)
+    del same, shift, dst_class
+
+    g = dgl.graph((torch.cat([src, dst]), torch.cat([dst, src])), num_nodes=n, idtype=torch.int32)
+    del src, dst
+    g = dgl.remove_self_loop(g)
+    g = dgl.add_self_loop(g)
+
+    centroids = torch.randn(num_classes, feature_dim, generator=generator)
+    features = centroids[labels] + feature_noise * torch.randn(n, feature_dim, generator=generator)
+    observed = labels
+    if calibration_skew > 0:
+        # flip probability calibration_skew at the lowest degree, decaying to 0 at the highest
+        log_degrees = torch.log(g.in_degrees().double())
+        scale = (log_degrees.max() - log_degrees).div_(log_degrees.max() - log_degrees.min() + 1e-12)
+        flip = torch.rand(n, generator=generator, dtype=torch.float64) < calibration_skew * scale
+        observed = torch.where(flip, (labels + torch.randint(1, max(num_classes, 2), (n,), generator=generator)) % num_classes, labels)
+    g.ndata["feat"] = features
+    g.ndata["label"] = observed
+    return g
+
+
+class SyntheticGraphDataset:
+    """
+    DGL-style dataset (data[0] is the graph, data.num_classes) of a generated graph
+    """
+    def __init__(self, ds_name, cache_dir=os.path.join(os.path.expanduser("~"), ".dgl", "synthetic")):
+        kwargs = parse_name(ds_name)
+        self.num_classes = kwargs.get("num_classes", 5)
+        path = os.path.join(cache_dir, f"{ds_name}.bin")
+        if os.path.exists(path):
+            self.graph = dgl.load_graphs(path)[0][0]
+            return
+        self.graph = generate_graph(**kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        dgl.save_graphs(path, [self.graph])
+
+    def __getitem__(self, idx):
+        assert idx == 0
+        return self.graph
+
+    def __len__(self):
+        return 1
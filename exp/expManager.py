@@ -1,7 +1,32 @@
+import os
 import torch
+import torch.multiprocessing as mp
 import time as time
 from utils.utils import set_seed
 from utils.logger import Logger
+from utils.store import ResultStore
+from utils.report import Reporter
+from utils.profiler import PROFILER
+from utils.distributed import is_distributed, is_main_process
+
+# Per-process solver used by the worker pool, installed once by _init_worker
+_worker_solver = None
+
+
+def _init_worker(solver, num_threads, profiling):
+    global _worker_solver
+    _worker_solver = solver
+    torch.set_num_threads(num_threads)
+    if profiling:
+        PROFILER.enable()
+
+
+def _run_split(task):
+    run, seed = task
+    set_seed(seed)
+    result = _worker_solver.run_exp(split=run)
+    # the worker's profiler events are merged into the parent's
+    return run, result, PROFILER.drain()
 
 
 class ExpManager:
@@ -9,30 +34,93 @@ class ExpManager:
         self.solver = solver
         self.conf = solver.conf
         self.dataset = solver.dataset
-        self.device = torch.device('cuda')
+        self.device = self.dataset.device
         self.split_seeds = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
 
-    def run(self, n_runs=1):
-        assert n_runs <= len(self.split_seeds)
+    def run(self, n_runs=1, n_workers=1, batched=False, run_ids=None, store=None, plot=False):
+        """
+        run_ids selects which splits/seeds to run, by default the first n_runs.
+        store: SQLite file the runs are appended to, by default results.db in the output root
+        plot: render the degree-bin plots (in the background reporting process, like the summary)
+        """
+        run_ids = list(range(n_runs)) if run_ids is None else list(run_ids)
+        assert max(run_ids) < len(self.split_seeds)
+        if is_distributed():
+            assert n_workers == 1 and not batched, "Distributed calibration runs the seeds one after another"
+            if not is_main_process():
+                # the other ranks only take part in the calibrator training, rank 0 logs and stores the results
+                for i in run_ids:
+                    set_seed(self.split_seeds[i])
+                    self.solver.run_exp(split=i)
+                return
         logger = Logger(
-            runs=n_runs,
+            runs=len(run_ids),
             ds_name=self.dataset.ds_name,
             calibrator_name = self.conf.calibration["calibrator_name"],
             num_bin=self.conf.calibration["num_bin"],
             dataset=self.dataset,
-            conf=self.conf
+            conf=self.conf,
+            root=self.solver.output_root,
+            run_ids=run_ids,
+            seeds=[self.split_seeds[i] for i in run_ids],
+            store=ResultStore(store or os.path.join(self.solver.output_root, 'results.db')),
+            # started first, so that its interpreter starts up while the experiments run
+            reporter=Reporter()
         )
-        succeed = 0
-        for i in range(n_runs):
-            print("Exp {}/{}".format(i, n_runs))
-            set_seed(self.split_seeds[i])
-
-            result = self.solver.run_exp(split=i)
-            logger.add_result(succeed, result)
+        if batched:
+            results = self.solver.run_batched_exp(run_ids, [self.split_seeds[i] for i in run_ids])
+            for slot, result in enumerate(results):
+                logger.add_result(slot, result)
+        elif n_workers != 1 and len(run_ids) > 1:
+            self._run_parallel(logger, run_ids, n_workers)
+        else:
+            for slot, i in enumerate(run_ids):
+                print("Exp {}/{}".format(i, len(run_ids)))
+                set_seed(self.split_seeds[i])
 
-            succeed += 1
-            if succeed % n_runs == 0:
-                break
+                result = self.solver.run_exp(split=i)
+                logger.add_result(slot, result)
+        logger.record()
         logger.print_statistics()
-        # logger.plot()
-        logger.save()
\ No newline at end of file
+        logger.save()
+        if plot:
+            logger.plot()
+        logger.summarize()
+        logger.store.close()
+        logger.reporter.close()
+
+    def _num_workers(self, n_runs, n_workers, memory_factor=4):
+        """
+        Size the pool to the requested workers, the cores and the available memory.
+        Each worker keeps its own model, calibrator and activations, estimated as
+        memory_factor times the dataset footprint; the dataset itself is shared.
+        n_workers <= 0 means as many workers as cores.
+        """
+        num_cores = os.cpu_count() or 1
+        if n_workers <= 0:
+            n_workers = num_cores
+        n_workers = min(n_workers, n_runs, num_cores)
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+            n_workers = min(n_workers, int(available // (memory_factor * self.dataset.nbytes())))
+        except ImportError:
+            pass
+        return max(n_workers, 1)
+
+    def _run_parallel(self, logger, run_ids, n_workers):
+        n_runs = len(run_ids)
+        n_workers = self._num_workers(n_runs, n_workers)
+        num_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        print(f"Running {n_runs} experiments on {n_workers} workers with {num_threads} threads each")
+        # CUDA cannot be re-initialised in a forked child, otherwise fork so the
+        # workers inherit the already loaded dataset instead of unpickling it
+        ctx = mp.get_context('spawn' if self.device.type == 'cuda' else 'fork')
+        self.dataset.share_memory_()
+        tasks = [(i, self.split_seeds[i]) for i in run_ids]
+        start = time.time()
+        with ctx.Pool(n_workers, initializer=_init_worker, initargs=(self.solver, num_threads, PROFILER.enabled)) as pool:
+            for finished, (run, result, events) in enumerate(pool.imap_unordered(_run_split, tasks)):
+                logger.add_result(run_ids.index(run), result)
+                PROFILER.events.extend(events)
+                print("Exp {}/{} finished ({}/{} done, {:.1f}s)".format(run, n_runs, finished + 1, n_runs, time.time() - start))
@@ -0,0 +1,280 @@
+import contextlib
+import copy
+import io
+import json
+import math
+import os
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from model.calibrator import CachedLogits
+from utils.utils import set_seed, apply_params
+
+# Hyperparameter search over calibrator configurations that keeps the dataset and the trained
+# base models fixed: the base GNN of every split is trained once, its logits are cached, and each
+# trial only fits and scores a calibrator on top of them. The search space uses the NNI format
+# ({"name": {"_type": "choice", "_value": [...]}}) so spaces written for automl.py can be reused.
+
+# Per-process search state, installed before the worker pool is forked
+_state = None
+
+
+def sample_random(space, rng):
+    params = {}
+    for name, spec in space.items():
+        kind, value = spec["_type"], spec["_value"]
+        if kind == "choice":
+            params[name] = value[rng.integers(len(value))]
+        elif kind == "uniform":
+            params[name] = float(rng.uniform(value[0], value[1]))
+        elif kind == "loguniform":
+            params[name] = float(math.exp(rng.uniform(math.log(value[0]), math.log(value[1]))))
+        elif kind == "randint":
+            params[name] = int(rng.integers(value[0], value[1]))
+        else:
+            raise NotImplementedError(f"Unsupported search space type: {kind}")
+    return params
+
+
+class RandomSampler:
+    def __init__(self, space, seed=0):
+        self.space = space
+        self.rng = np.random.default_rng(seed)
+
+    def suggest(self, history):
+        return sample_random(self.space, self.rng)
+
+
+class TPESampler:
+    """
+    Tree-structured Parzen estimator (Bergstra et al., 2011) with independent per-parameter densities.
+    The best gamma fraction of the finished trials forms the "good" density l(x), the rest g(x);
+    candidates are drawn from l(x) and the one with the largest l(x) / g(x) is returned.
+    """
+    def __init__(self, space, seed=0, gamma=0.25, n_startup=10, n_candidates=24):
+        self.space = space
+        self.rng = np.random.default_rng(seed)
+        self.gamma = gamma
+        self.n_startup = n_startup
+        self.n_candidates = n_candidates
+
+    def suggest(self, history):
+        if len(history) < self.n_startup:
+            return sample_random(self.space, self.rng)
+        ranked = sorted(history, key=lambda trial: trial["score"])
+        n_good = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good = [trial["params"] for trial in ranked[:n_good]]
+        bad = [trial["params"] for trial in ranked[n_good:]]
+        candidates = [self._sample_good(good) for _ in range(self.n_candidates)]
+        scores = [self._log_ratio(candidate, good, bad) for candidate in candidates]
+        return candidates[int(np.argmax(scores))]
+
+    def _to_unit(self, name, x):
+        kind, value = self.space[name]["_type"], self.space[name]["_value"]
+        if kind == "loguniform":
+            return (math.log(x) - math.log(value[0])) / (math.log(value[1]) - math.log(value[0]))
+        return (x - value[0]) / (value[1] - value[0])
+
+    def _from_unit(self, name, u):
+        kind, value = self.space[name]["_type"], self.space[name]["_value"]
+        u = min(max(u, 0.0), 1.0)
+        if kind == "loguniform":
+            return float(math.exp(math.log(value[0]) + u * (math.log(value[1]) - math.log(value[0]))))
+        if kind == "randint":
+            return int(min(value[0] + math.floor(u * (value[1] - value[0])), value[1] - 1))
+        return float(value[0] + u * (value[1] - value[0]))
+
+    def _sample_good(self, good):
+        params = {}
+        for name, spec in self.space.items():
+            if spec["_type"] == "choice":
+                probs = self._choice_probs(name, good)
+                params[name] = spec["_value"][self.rng.choice(len(probs), p=probs)]
+            else:
+                center = self._to_unit(name, good[self.rng.integers(len(good))][name])
+                params[name] = self._from_unit(name, self.rng.normal(center, self._bandwidth(good)))
+        return params
+
+    def _choice_probs(self, name, observed):
+        values = self.space[name]["_value"]
+        # one pseudo-count per choice as prior
+        counts = np.ones(len(values))
+        for params in observed:
+            counts[values.index(params[name])] += 1
+        return counts / counts.sum()
+
+    @staticmethod
+    def _bandwidth(observed):
+        return max(1.0 / (len(observed) + 1), 0.05)
+
+    def _log_density(self, name, x, observed):
+        spec = self.space[name]
+        if spec["_type"] == "choice":
+            return math.log(self._choice_probs(name, observed)[spec["_value"].index(x)])
+        u = self._to_unit(name, x)
+        centers = np.array([self._to_unit(name, params[name]) for params in observed])
+        sigma = self._bandwidth(observed)
+        kernels = np.exp(-0.5 * ((u - centers) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+        # mix in the uniform prior with the weight of one observation
+        return math.log((kernels.sum() + 1.0) / (len(observed) + 1))
+
+    def _log_ratio(self, params, good, bad):
+        return sum(self._log_density(name, params[name], good) - self._log_density(name, params[name], bad)
+                   for name in self.space)
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    budgets = [max_epochs]
+    while budgets[0] // eta >= min_epochs:
+        budgets.insert(0, budgets[0] // eta)
+    return budgets
+
+
+class CalibrationSearch:
+    """
+    solver: a Solver whose dataset stays loaded for the whole search.
+    splits/seeds: the splits scored by every trial, each gets its base model trained once.
+    holdout: share of the calibration nodes of every split that trials are scored on, the
+    calibrators of the trials are fit on the rest.
+    """
+    def __init__(self, solver, space, splits, seeds, algo="tpe", n_workers=1, eta=3, min_epochs=None,
+                 output="search", quiet=True, seed=0, holdout=0.5):
+        self.solver = solver
+        self.conf = solver.conf
+        self.space = space
+        self.splits = splits
+        self.seeds = seeds
+        self.sampler = TPESampler(space, seed=seed) if algo == "tpe" else RandomSampler(space, seed=seed)
+        self.n_workers = n_workers
+        self.eta = eta
+        max_epochs = self.conf.calibration["epochs"]
+        self.budgets = rung_budgets(min_epochs or max_epochs, max_epochs, eta)
+        self.output = output
+        self.quiet = quiet
+        self.holdout = holdout
+        self.history = []
+
+    def prepare(self):
+        """
+        Train the base model of every split once and cache its logits, and split its calibration
+        nodes into the nodes trials are fit on and the held-out nodes they are scored on
+        """
+        logits = []
+        self.val_splits = []
+        for split, seed in zip(self.splits, self.seeds):
+            set_seed(seed)
+            with self._silence():
+                self.solver._set(split)
+                self.solver._learn()
+            self.solver.model.eval()
+            with torch.no_grad():
+                logits.append(self.solver.model(self.solver.dataset.g, self.solver.dataset.features).detach())
+            val_idx = np.random.default_rng(seed).permutation(np.asarray(self.solver.val_idx))
+            held_out = max(1, int(len(val_idx) * self.holdout))
+            self.val_splits.append((np.sort(val_idx[held_out:]), np.sort(val_idx[:held_out])))
+            print(f"Base model of split {split} trained")
+        self.logits = logits
+
+    def _silence(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def trial_conf(self, params, epochs):
+        conf = copy.deepcopy(self.conf)
+        conf.calibration["epochs"] = epochs
+        apply_params(vars(conf), params)
+        return conf
+
+    def evaluate(self, params, epochs, mode="val"):
+        """
+        Mean calibrated degree-binned ECE (x100) over the splits, the metric automl.py reports to NNI.
+        mode="val" scores trials: the calibrator is fit on part of the calibration nodes and scored
+        on the held-out rest. mode="test" only reports the chosen configuration: fit on all the
+        calibration nodes, as main.py does, and scored on the test nodes.
+        """
+        solver = self.solver
+        conf = self.trial_conf(params, epochs)
+        scores = []
+        for split, seed, logits, (fit_idx, held_out_idx) in zip(self.splits, self.seeds, self.logits, self.val_splits):
+            set_seed(seed)
+            solver._set_split(split)
+            solver.model = CachedLogits(logits)
+            calibrator = solver._build_calibrator(conf)
+            idx = held_out_idx
+            if mode == "test":
+                fit_idx, idx = solver.val_idx, solver.test_idx
+            with self._silence():
+                calibrator.fit(solver.dataset.g, solver.dataset.features, solver.dataset.labels,
+                               [solver.train_idx, fit_idx, solver.test_idx])
+            calibrator.eval()
+            with torch.no_grad():
+                calibrated = calibrator(solver.dataset.g, solver.dataset.features)
+            if isinstance(calibrated, tuple):
+                calibrated = calibrated[0]
+            diff = solver._get_diff(calibrated[idx], solver.dataset.labels[idx], idx)[0]
+            scores.append(float(diff) * 100)
+        return float(np.mean(scores))
+
+    def _map(self, pool, tasks):
+        if pool is None:
+            return [_evaluate_task(task) for task in tasks]
+        return pool.map(_evaluate_task, tasks)
+
+    def run(self, n_trials, bracket_size=None):
+        """
+        Successive halving brackets: sample bracket_size configurations, score them all with the
+        smallest epoch budget, keep the best 1/eta for the next budget, up to the configured epochs
+        """
+        global _state
+        _state = self
+        bracket_size = bracket_size or self.eta ** (len(self.budgets) - 1) * max(1, self.n_workers)
+        os.makedirs(self.output, exist_ok=True)
+        pool = None
+        if self.n_workers > 1:
+            num_threads = max(1, (os.cpu_count() or 1) // self.n_workers)
+            ctx = mp.get_context("spawn" if self.solver.device.type == "cuda" else "fork")
+            pool = ctx.Pool(self.n_workers, initializer=_init_worker, initargs=(self, num_threads))
+        sampled = 0
+        start = time.time()
+        try:
+            with open(os.path.join(self.output, "trials.jsonl"), "a") as log:
+                while sampled < n_trials:
+                    n = min(bracket_size, n_trials - sampled)
+                    finals = [trial for trial in self.history if trial["epochs"] == self.budgets[-1]]
+                    configs = [self.sampler.suggest(finals) for _ in range(n)]
+                    sampled += n
+                    for rung, epochs in enumerate(self.budgets):
+                        scores = self._map(pool, [(params, epochs) for params in configs])
+                        trials = [{"params": p, "epochs": epochs, "rung": rung, "score": s} for p, s in zip(configs, scores)]
+                        for trial in trials:
+                            log.write(json.dumps(trial) + "\n")
+                        log.flush()
+                        self.history.extend(trials)
+                        keep = max(1, len(configs) // self.eta)
+                        configs = [t["params"] for t in sorted(trials, key=lambda t: t["score"])[:keep]]
+                    best = self.best()
+                    print(f"{sampled}/{n_trials} configurations | {len(self.history)} fits | {time.time() - start:.1f}s | "
+                          f"best {best['score']:.3f} {best['params']}")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        best = dict(self.best(), test_score=self.evaluate(self.best()["params"], self.budgets[-1], mode="test"))
+        with open(os.path.join(self.output, "best.json"), "w") as f:
+            json.dump(best, f, indent=2)
+        return best
+
+    def best(self):
+        finals = [trial for trial in self.history if trial["epochs"] == self.budgets[-1]]
+        return min(finals or self.history, key=lambda trial: trial["score"])
+
+
+def _init_worker(state, num_threads):
+    global _state
+    _state = state
+    torch.set_num_threads(num_threads)
+
+
+def _evaluate_task(task):
+    params, epochs = task
+    return _state.evaluate(params, epochs)
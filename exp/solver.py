@@ -1,16 +1,31 @@
 from model.gnns import load_gnn
-from utils.recorder import Recorder
-from utils.utils import accuracy, setup_directories
+from utils.recorder import Recorder, ValidationScheduler
+from utils.utils import accuracy, setup_directories, set_seed, autocast, grad_scaler, inference_latency, peak_memory_mb
+from utils.checkpoint import Checkpoint
+from utils.profiler import profile, estimate_flops
+import dgl
 import torch
+import torch.nn.functional as F
 import pandas as pd
 import numpy as np
 import math
-import matplotlib.pyplot as plt
-from model.calibrator import TS, ETS, VS, CaGCN, GATS, CaGCN_GETS
+import time
+import os
+from model.calibrator import TS, ETS, VS, CaGCN, CaGCN_GETS, CachedLogits
+from model.gats import GATS
+from model.partition import Partition, partitioned_forward
+from dataset.features import MemmapFeatures
+from utils.distributed import is_distributed, is_main_process, get_rank, all_reduce_sum, all_reduce_gradients, broadcast_module
+from model.batched import batch_gnn, unbatch_gnn, fit_calibration_batched, BATCHED_CALIBRATORS
 
 class Solver:
-    def __init__(self, conf, dataset):
+    def __init__(self, conf, dataset, output_root='output', save_dir=None):
+        """
+        save_dir: write the fitted calibrator of every run, with its base model, to <save_dir>/run<id>.pt (serve.py)
+        """
         self.dataset = dataset
+        self.output_root = output_root
+        self.save_dir = save_dir
         self.conf = conf
         self.device = self.dataset.device
         self.calibrator_name = self.conf.calibration['calibrator_name']
@@ -20,33 +35,185 @@ class Solver:
         self.conf.gnn["in_dim"] = in_dim
         self.conf.gnn["out_dim"] = out_dim
         self.num_bin = self.conf.calibration['num_bin']
+        self.precision = self.conf.train.get('precision')
+        self.cal_precision = self.conf.calibration.get('precision')
+        self.partition = None
         try:
-            setup_directories('output', self.calibrator_name, dataset.ds_name)
+            setup_directories(output_root, self.calibrator_name, dataset.ds_name)
         except:
             pass
     
     def run_exp(self, split=0):
         self._set(split)
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
         print("************************************")
         print("Start fitting model")
         print("************************************")
+        start = time.time()
         self._learn()
+        fit_time = time.time() - start
         print("************************************")
         print("Start fitting calibration")
         print("************************************")
         print("Calibration model configuration")
         print(self.conf)
         print("************************************")
+        start = time.time()
         self._calibrate()
-        print("************************************")
-        print("GPU memory allowcation")
-        gpu_memory_allocated = torch.cuda.memory_allocated() / 1024 ** 2  # Memory allocated by tensors
-        gpu_memory_reserved = torch.cuda.memory_reserved() / 1024 ** 2  # Memory reserved by the allocator
-        print(f"GPU Memory Allocated: {gpu_memory_allocated:.2f} MB")
-        print(f"GPU Memory Reserved: {gpu_memory_reserved:.2f} MB")
+        self._record_cost(fit_time, time.time() - start)
+        self._save_model(split)
+        if self.device.type == 'cuda':
+            print("************************************")
+            print("GPU memory allowcation")
+            gpu_memory_allocated = torch.cuda.memory_allocated() / 1024 ** 2  # Memory allocated by tensors
+            gpu_memory_reserved = torch.cuda.memory_reserved() / 1024 ** 2  # Memory reserved by the allocator
+            print(f"GPU Memory Allocated: {gpu_memory_allocated:.2f} MB")
+            print(f"GPU Memory Reserved: {gpu_memory_reserved:.2f} MB")
+        if isinstance(self.dataset.features, MemmapFeatures):
+            print(self.dataset.features.format_stats())
         return self.result
     
     
+    def _save_model(self, split):
+        if self.save_dir is None or not is_main_process():
+            return
+        from utils.serving import save_model
+        os.makedirs(self.save_dir, exist_ok=True)
+        # partitioned training leaves the gathered logits as the base model, save the network instead
+        base = getattr(self, "gnn", None) if isinstance(self.calibrated_model.model, CachedLogits) else None
+        save_model(os.path.join(self.save_dir, f"run{split}.pt"), self.calibrated_model, base)
+
+    def _record_cost(self, fit_time, calibration_time):
+        self.result['fit_time'] = fit_time
+        self.result['calibration_time'] = calibration_time
+        self.result['peak_memory_mb'] = peak_memory_mb(self.device)
+
+    def run_batched_exp(self, splits, seeds):
+        """
+        Train one replica of the base GNN per seed as a single batched model, then calibrate all
+        replicas (batched for TS/VS/CaGCN, one after the other otherwise) and return their results
+        """
+        models = []
+        for seed in seeds:
+            set_seed(seed)
+            models.append(load_gnn(self.conf).to(self.device))
+        print("************************************")
+        print(f"Start fitting {len(models)} models")
+        print("************************************")
+        start = time.time()
+        self._learn_batched(models, splits)
+        fit_time = time.time() - start
+        print("************************************")
+        print("Start fitting calibration")
+        print("************************************")
+        start = time.time()
+        calibrators = self._calibrate_batched(models, splits, seeds)
+        batched_calibration_time = time.time() - start
+        results = []
+        for r, split in enumerate(splits):
+            self.model = models[r]
+            self._set_split(split)
+            self._record_uncalibrated()
+            if calibrators is None:
+                set_seed(seeds[r])
+                start = time.time()
+                self._calibrate()
+                calibration_time = time.time() - start
+            else:
+                self.calibrated_model = calibrators[r]
+                self._record_calibrated()
+                calibration_time = batched_calibration_time / len(models)
+            # the replicas share one training (and batched calibration) run, split its cost evenly
+            self._record_cost(fit_time / len(models), calibration_time)
+            self._save_model(split)
+            results.append(self.result)
+        return results
+
+    def _learn_batched(self, models, splits):
+        self.batched_model = batch_gnn(models).to(self.device)
+        optimizer = torch.optim.Adam(self.batched_model.parameters(), lr=self.conf.train["lr"], weight_decay=self.conf.train["weight_decay"])
+        recorders = [Recorder(self.conf.train['patience']) for _ in models]
+        active = [True] * len(models)
+        checkpoint = Checkpoint(self.batched_model, buffers=False, spill_dir=self.conf.train.get('checkpoint_dir'))
+        checkpoint.save()
+        labels = self.dataset.labels
+        # one validation graph for all replicas, the receptive field of the val nodes of every split
+        val_idxs = [torch.as_tensor(self.dataset.val_idxs[split], device=self.dataset.g.device) for split in splits]
+        val_g, val_features = self.dataset.g, self.dataset.features
+        val_union = torch.unique(torch.cat(val_idxs))
+        val_graph = self._val_subgraph(val_union.to(self.dataset.g.idtype), len(models[0].layers))
+        if val_graph is not None:
+            val_g, val_features, positions = val_graph
+            val_idxs = [positions[torch.searchsorted(val_union, idx)] for idx in val_idxs]
+        scheduler = ValidationScheduler(
+            self.conf.train["epochs"],
+            self.conf.train.get("val_every", 1),
+            self.conf.train.get("val_adaptive", False)
+        )
+        for epoch in range(self.conf.train["epochs"]):
+            with profile("train_epoch", epoch=epoch, replicas=len(models)):
+                self.batched_model.train()
+                optimizer.zero_grad()
+                logits = self.batched_model(self.dataset.g, self.dataset.features)
+                loss = sum(
+                    self.loss_fcn(logits[self.dataset.train_idxs[split], r], labels[self.dataset.train_idxs[split]])
+                    for r, split in enumerate(splits)
+                )
+                loss.backward()
+                optimizer.step()
+            if not scheduler.due(epoch):
+                print("Epoch {:05d} | Loss(train) {:.4f} | Active {}/{}"
+                      .format(epoch + 1, loss.item() / len(models), sum(active), len(models)))
+                continue
+
+            self.batched_model.eval()
+            with torch.no_grad(), profile("val_eval", replicas=len(models)):
+                logits = self.batched_model(val_g, val_features)
+            steps = scheduler.mark(epoch)
+            accs_val = []
+            improved = False
+            for r, split in enumerate(splits):
+                acc_val = accuracy(logits[val_idxs[r], r], labels[self.dataset.val_idxs[split]])
+                accs_val.append(acc_val)
+                if not active[r]:
+                    continue
+                flag, flag_earlystop = recorders[r].add(acc_val, steps=steps)
+                improved = improved or flag
+                if flag:
+                    checkpoint.save(index=r)
+                if flag_earlystop:
+                    active[r] = False
+            scheduler.update(improved)
+            print("Epoch {:05d} | Loss(train) {:.4f} | Acc(val) {:.4f} ± {:.4f} | Active {}/{}"
+                  .format(epoch + 1, loss.item() / len(models), np.mean(accs_val), np.std(accs_val), sum(active), len(models)))
+            if not any(active):
+                print("Early stopping at epoch {}".format(epoch))
+                break
+        checkpoint.restore()
+        checkpoint.close()
+        unbatch_gnn(self.batched_model, models)
+
+    def _calibrate_batched(self, models, splits, seeds):
+        if self.calibrator_name not in BATCHED_CALIBRATORS:
+            return None
+        calibrators = []
+        for model, split, seed in zip(models, splits, seeds):
+            set_seed(seed)
+            self.model = model
+            self._set_split(split)
+            calibrators.append(self._build_calibrator())
+        batched = BATCHED_CALIBRATORS[self.calibrator_name](calibrators).to(self.device)
+        self.batched_model.eval()
+        with torch.no_grad():
+            logits = self.batched_model(self.dataset.g, self.dataset.features)
+        masks = [[self.dataset.train_idxs[s], self.dataset.val_idxs[s], self.dataset.test_idxs[s]] for s in splits]
+        optimizer = torch.optim.Adam(batched.train_param(), lr=self.conf.calibration["cal_lr"], weight_decay=self.conf.calibration["cal_weight_decay"])
+        fit_calibration_batched(batched, self.dataset.g, logits, self.dataset.labels, masks,
+                                self.conf.calibration["epochs"], self.conf.calibration["patience"], optimizer)
+        batched.unstack(calibrators)
+        return [calibrator.to(self.device) for calibrator in calibrators]
+
     def _setup_result_dict(self):
         dict_template = {
             "acc": None,
@@ -71,33 +238,146 @@ class Solver:
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.conf.train["lr"], weight_decay=self.conf.train["weight_decay"])
         self.best_val_acc = -1
         self.recorder = Recorder(self.conf.train['patience'])
-        self.weights = None
+        self.checkpoint = Checkpoint(self.model, spill_dir=self.conf.train.get('checkpoint_dir'))
+        self.val_graph = None
+        self._set_split(run)
+
+    def _set_split(self, run):
         self._setup_result_dict()
         self.train_idx = self.dataset.train_idxs[run]
         self.val_idx = self.dataset.val_idxs[run]
         self.test_idx = self.dataset.test_idxs[run]
 
     
+    def _set_val_graph(self):
+        self.val_graph = self._val_subgraph(self.val_idx, len(self.model.layers))
+
+    def _val_subgraph(self, val_idx, num_layers):
+        """
+        Validation logits only depend on the val nodes' receptive field: the nodes within num_layer
+        hops, plus one more hop so the degree normalisation of the outermost nodes is the one of the
+        full graph (the graphs are symmetric, so in-hops also cover out-degrees). Returns that
+        subgraph, its features and the positions of val_idx in it when it is clearly smaller than
+        the graph, None to evaluate on the graph itself.
+        """
+        if not self.conf.train.get("val_subgraph", True):
+            return None
+        sg, positions = dgl.khop_in_subgraph(self.dataset.g, val_idx, num_layers + 1, store_ids=True)
+        if sg.num_nodes() > 0.5 * self.dataset.g.num_nodes():
+            return None
+        nodes = sg.ndata[dgl.NID].long()
+        print(f"Validating on the receptive field of the val nodes: {sg.num_nodes()}/{self.dataset.g.num_nodes()} nodes")
+        return sg, self.dataset.features[nodes], positions.long()
+
     def _learn(self):
+        if self.conf.train.get("partition") and is_distributed():
+            return self._learn_partitioned()
+        self._set_val_graph()
+        scheduler = ValidationScheduler(
+            self.conf.train["epochs"],
+            self.conf.train.get("val_every", 1),
+            self.conf.train.get("val_adaptive", False)
+        )
+        scaler = grad_scaler(self.device, self.precision)
+        # forward and backward pass, the backward costs about twice the forward
+        train_flops = lambda: 3 * estimate_flops(self.model, self.dataset.g)
         for epoch in range(self.conf.train["epochs"]):
-            self.model.train()
-            self.optimizer.zero_grad()
-            logits = self.model(self.dataset.g, self.dataset.features)
-            loss = self.loss_fcn(logits[self.train_idx], self.dataset.labels[self.train_idx])
-            loss.backward()
-            self.optimizer.step()
-            acc_train = accuracy(logits[self.train_idx], self.dataset.labels[self.train_idx])
+            with profile("train_epoch", flops=train_flops, epoch=epoch):
+                self.model.train()
+                self.optimizer.zero_grad()
+                with autocast(self.device, self.precision):
+                    logits = self.model(self.dataset.g, self.dataset.features)
+                logits = logits.float()
+                loss = self.loss_fcn(logits[self.train_idx], self.dataset.labels[self.train_idx])
+                scaler.scale(loss).backward()
+                scaler.step(self.optimizer)
+                scaler.update()
+                # Train accuracy comes from the logits of the training step itself
+                acc_train = accuracy(logits[self.train_idx], self.dataset.labels[self.train_idx])
+            if not scheduler.due(epoch):
+                print("Epoch {:05d} | Loss(train) {:.4f} | Acc(train) {:.4f} |"
+                      .format(epoch + 1, loss.item(), acc_train))
+                continue
             acc_val = self._evaluate(mode='val')
-            flag, flag_earlystop = self.recorder.add(acc_val)
+            flag, flag_earlystop = self.recorder.add(acc_val, steps=scheduler.mark(epoch))
+            scheduler.update(flag)
             if flag:
-                self.weights = self.model.state_dict()
+                self.checkpoint.save()
             if flag_earlystop:
                 print("Early stopping at epoch {}".format(epoch))
                 break
             print("Epoch {:05d} | Loss(train) {:.4f} | Acc(train) {:.4f} | Acc(val) {:.4f} |{}"
                   .format(epoch + 1, loss.item(), acc_train, acc_val, "*" if flag else ""))
-        self.model.load_state_dict(self.weights)
-        
+        self.checkpoint.restore()
+        self.checkpoint.close()
+        self._record_uncalibrated()
+
+    def _learn_partitioned(self):
+        """
+        _learn with the graph split over the ranks (train.partition: metis or random, see
+        model/partition.py). Losses and accuracies are summed over the partitions, so every rank
+        takes the same steps and stops at the same epoch. The logits of the best model are then
+        gathered on every rank and self.model is replaced by them (CachedLogits), the trained
+        network is kept in self.gnn.
+        """
+        if self.partition is None:
+            # the graph is the same for every split and seed
+            self.partition = Partition(self.dataset.g, self.dataset.features, self.conf.train["partition"])
+            print(f"Rank {get_rank()}: {len(self.partition.owned)} nodes, {len(self.partition.halo)} halo nodes")
+        partition = self.partition
+        broadcast_module(self.model)
+        labels = self.dataset.labels[partition.owned]
+        train_pos, _ = partition.local(self.train_idx)
+        val_pos, _ = partition.local(self.val_idx)
+        scheduler = ValidationScheduler(
+            self.conf.train["epochs"],
+            self.conf.train.get("val_every", 1),
+            self.conf.train.get("val_adaptive", False)
+        )
+        scaler = grad_scaler(self.device, self.precision)
+        for epoch in range(self.conf.train["epochs"]):
+            with profile("train_epoch", epoch=epoch, rank=get_rank()):
+                self.model.train()
+                self.optimizer.zero_grad()
+                with autocast(self.device, self.precision):
+                    logits = partitioned_forward(self.model, partition)
+                logits = logits.float()
+                # mean over the train nodes of all partitions once the gradients are summed
+                loss = F.cross_entropy(logits[train_pos], labels[train_pos], reduction='sum') / len(self.train_idx)
+                scaler.scale(loss).backward()
+                all_reduce_gradients(self.model.parameters())
+                scaler.step(self.optimizer)
+                scaler.update()
+                correct = (logits[train_pos].argmax(1) == labels[train_pos]).sum().float()
+                loss, correct = all_reduce_sum(torch.stack([loss.detach(), correct])).tolist()
+                acc_train = correct / len(self.train_idx)
+            if not scheduler.due(epoch):
+                print("Epoch {:05d} | Loss(train) {:.4f} | Acc(train) {:.4f} |"
+                      .format(epoch + 1, loss, acc_train))
+                continue
+            self.model.eval()
+            with torch.no_grad(), profile("val_eval", rank=get_rank()), autocast(self.device, self.precision):
+                logits = partitioned_forward(self.model, partition)
+                acc_val = all_reduce_sum((logits[val_pos].argmax(1) == labels[val_pos]).sum().float()).item() / len(self.val_idx)
+            flag, flag_earlystop = self.recorder.add(acc_val, steps=scheduler.mark(epoch))
+            scheduler.update(flag)
+            if flag:
+                self.checkpoint.save()
+            if flag_earlystop:
+                print("Early stopping at epoch {}".format(epoch))
+                break
+            print("Epoch {:05d} | Loss(train) {:.4f} | Acc(train) {:.4f} | Acc(val) {:.4f} |{}"
+                  .format(epoch + 1, loss, acc_train, acc_val, "*" if flag else ""))
+        self.checkpoint.restore()
+        self.checkpoint.close()
+        self.model.eval()
+        with torch.no_grad(), autocast(self.device, self.precision):
+            logits = partitioned_forward(self.model, partition).float()
+        self.gnn = self.model
+        self.model = CachedLogits(partition.gather(logits, self.dataset.g.num_nodes()))
+        self._record_uncalibrated()
+
+    def _record_uncalibrated(self):
         self.result['uncalibrated']['index'] = self.test_idx        
         self.result['uncalibrated']['true'] = self.dataset.labels[self.test_idx].cpu().numpy()
         self.result['uncalibrated']['pred'],self.result['uncalibrated']['pred_confidence'] = self._save_nodewise_results(mode='test')
@@ -122,11 +402,13 @@ class Solver:
             model = self.calibrated_model
         
         model.eval()
-        with torch.no_grad():
+        precision = self.cal_precision if mode == 'calibration' else self.precision
+        with torch.no_grad(), autocast(self.device, precision):
             if self.calibrator_name == 'GETS' and mode == 'calibration':
                 logits, _, node_gates = model(self.dataset.g, self.dataset.features)                
             else:
                 logits = model(self.dataset.g, self.dataset.features)
+        logits = logits.float()
         if mode in ['test', 'calibration']:
             softmax_values = torch.softmax(logits, dim=1).cpu().numpy()
             confidence = np.amax(softmax_values, axis=1)            
@@ -147,18 +429,30 @@ class Solver:
             idx = self.test_idx
             model = self.calibrated_model
         others = {}
+        g, features, logits_idx = self.dataset.g, self.dataset.features, idx
+        if mode == 'val' and self.val_graph is not None:
+            # val nodes sit at logits_idx of the receptive field subgraph
+            g, features, logits_idx = self.val_graph
         model.eval()
-        with torch.no_grad():
-            if self.calibrator_name == 'GETS' and mode == 'calibration':
-                logits, _, node_gates = model(self.dataset.g, self.dataset.features)
-                others['node_gates'] = node_gates
-            else:
-                logits = model(self.dataset.g, self.dataset.features)
-            acc = accuracy(logits[idx], self.dataset.labels[idx])
+        precision = self.cal_precision if mode == 'calibration' else self.precision
+        with torch.no_grad(), profile(f"{mode}_eval", flops=lambda: estimate_flops(model, g)):
+            with autocast(self.device, precision):
+                if self.calibrator_name == 'GETS' and mode == 'calibration':
+                    logits, _, (experts, gates) = model(g, features)
+                    # expert ids as positions in expert_configs, also after pruning; a distilled
+                    # calibrator has no routing to record
+                    expert_ids = model.learner.expert_ids
+                    if expert_ids is not None:
+                        others['node_gates'] = (torch.tensor(expert_ids, device=experts.device)[experts], gates)
+                else:
+                    logits = model(g, features)
+            logits = logits.float()
+            acc = accuracy(logits[logits_idx], self.dataset.labels[idx])
         if mode == 'val':
             return acc
         elif mode in ['test', 'calibration']:
-            diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df  = self._get_diff(logits[idx], self.dataset.labels[idx])
+            with profile("metrics"):
+                diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df  = self._get_diff(logits[idx], self.dataset.labels[idx])
             return acc, diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df, others
         
         
@@ -166,11 +460,13 @@ class Solver:
         acc, diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df, others = self._evaluate(mode='test')
         return acc, diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df, others
     
-    def _get_diff(self, logits, labels):
+    def _get_diff(self, logits, labels, idx=None):
+        # logits and labels of the nodes idx, the test nodes by default
+        idx = self.test_idx if idx is None else idx
         # Calculate degree confidence dataframe
         softmax_values = torch.softmax(logits, dim=1).cpu().numpy()
         confidence_values = np.amax(softmax_values, axis=1)
-        degrees = self.dataset.g.in_degrees()[self.test_idx].cpu().numpy()
+        degrees = self.dataset.g.in_degrees()[idx].cpu().numpy()
         degree_confidence_df = pd.DataFrame({
             'degree': degrees, 
             'confidence': confidence_values
@@ -219,89 +515,107 @@ class Solver:
 
         return weighted_sum_diff, degree_confidence_bined_df, degree_accuracy_bined_df, degree_diff_bined_df
 
-    def _calibrate(self):
-        if self.calibrator_name == 'GETS':
-            self.calibrated_model = CaGCN_GETS(
+    def _build_calibrator(self, conf=None):
+        conf = conf or self.conf
+        calibrator_name = conf.calibration['calibrator_name']
+        if calibrator_name == 'GETS':
+            return CaGCN_GETS(
                     self.model,
                     self.dataset.features.shape[1],
                     self.dataset.num_classes,
                     self.device,
-                    self.conf
+                    conf
                 )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
-            )
-        elif self.calibrator_name == 'VS':
-            self.calibrated_model = VS(
+        elif calibrator_name == 'VS':
+            return VS(
                 self.model,
                 self.dataset.num_classes,
                 self.device,
-                self.conf
+                conf
             )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
-            )
-        elif self.calibrator_name == 'TS':
-            self.calibrated_model = TS(
+        elif calibrator_name == 'TS':
+            return TS(
                 self.model,
                 self.device,
-                self.conf
-            )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
+                conf
             )
-        elif self.calibrator_name == 'ETS':
-            self.calibrated_model = ETS(
+        elif calibrator_name == 'ETS':
+            return ETS(
                 self.model,
                 self.dataset.num_classes,
                 self.device,
-                self.conf
+                conf
             )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
-            )
-        elif self.calibrator_name == 'CaGCN':
-            self.calibrated_model = CaGCN(
+        elif calibrator_name == 'CaGCN':
+            return CaGCN(
                 self.model,
                 self.dataset.num_classes,
                 self.device,
-                self.conf
-            )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
+                conf
             )
-        elif self.calibrator_name == 'GATS':
-            self.calibrated_model = GATS(
+        elif calibrator_name == 'GATS':
+            return GATS(
                 self.model,
                 self.dataset.g,
                 self.dataset.num_classes,
                 self.train_idx,
                 self.device,
-                self.conf
+                conf
             )
-            self.calibrated_model.fit(
-                self.dataset.g,
-                self.dataset.features,
-                self.dataset.labels,
-                [self.train_idx, self.val_idx, self.test_idx]
+        raise NotImplementedError
+
+    def _calibrate(self):
+        self.calibrated_model = self._build_calibrator()
+        self.calibrated_model.fit(
+            self.dataset.g,
+            self.dataset.features,
+            self.dataset.labels,
+            [self.train_idx, self.val_idx, self.test_idx]
+        )
+        if self.calibrator_name == 'GETS' and self.conf.calibration.get('prune_threshold') is not None:
+            self._prune_calibrator()
+        if self.calibrator_name == 'GETS' and self.conf.calibration.get('quantize'):
+            self._quantize_calibrator()
+        self._record_calibrated()
+
+    def _prune_calibrator(self):
+        """
+        Drop the GETS experts below calibration.prune_threshold of the gate mass and, with
+        calibration.distill, distill the rest into a single expert; reports the calibration
+        change and the inference speedup
+        """
+        from model.prune import prune_gets, distill_gets
+        g, features = self.dataset.g, self.dataset.features
+        acc, diff = self._evaluate(mode='calibration')[:2]
+        latency = inference_latency(self.calibrated_model, g, features)
+        configs = [expert.expert_config for expert in self.calibrated_model.learner.experts]
+        load, keep = prune_gets(self.calibrated_model, g, features, self.conf.calibration['prune_threshold'])
+        print("Expert load: " + ", ".join(f"{'+'.join(c)} {share:.3f}" for c, share in zip(configs, load.tolist())))
+        print(f"Kept {len(keep)}/{len(load)} experts: {[configs[i] for i in keep]}")
+        if self.conf.calibration.get('distill'):
+            loss = distill_gets(
+                self.calibrated_model, g, features,
+                self.conf.calibration.get('distill_epochs', 200),
+                self.conf.calibration['cal_lr'],
+                self.conf.calibration.get('distill_hidden_dim')
             )
+            print(f"Distilled into one {self.calibrated_model.learner.experts[0].expert_config} expert | MSE {loss:.4f}")
+        pruned_acc, pruned_diff = self._evaluate(mode='calibration')[:2]
+        pruned_latency = inference_latency(self.calibrated_model, g, features)
+        print(f"Pruning: ECE {diff * 100:.2f} -> {pruned_diff * 100:.2f} | Acc {acc * 100:.2f} -> {pruned_acc * 100:.2f} | "
+              f"latency {latency:.1f}ms -> {pruned_latency:.1f}ms ({latency / pruned_latency:.2f}x)")
 
-        
+    def _quantize_calibrator(self):
+        """
+        Serve the fitted GETS calibrator with dynamic int8 layers, CPU only
+        """
+        if self.device.type != 'cpu':
+            print("Skipping int8 quantization of GETS: quantized kernels only run on the CPU")
+            return
+        from model.quantize import quantize_gets
+        self.calibrated_model = quantize_gets(self.calibrated_model)
+
+    def _record_calibrated(self):
         self.result['calibrated']['index'] = self.test_idx
         assert (self.result['calibrated']['index'] == self.result['uncalibrated']['index']).all()
         
@@ -1,8 +1,10 @@
 import argparse
-from utils.utils import load_conf, set_seed
+from utils.utils import load_conf, set_seed, parse_overrides
 from dataset.dataset import Dataset
 from exp.solver import Solver
 from exp.expManager import ExpManager
+from utils.profiler import PROFILER, profile
+from utils.distributed import init_distributed, is_main_process
 import os
 
 
@@ -13,16 +15,51 @@ if __name__ == "__main__":
     parser.add_argument("--dataset",type=str, default="ogbn-arxiv", help="Choose from: [cora, citeseer, pubmed, cora-full, computers, photo, cs, physics, ogbn-arxiv]")
     parser.add_argument("--gpu", type=int, default=1, help="Use which gpu")
     parser.add_argument('--n_runs', type=int, default=10)
+    parser.add_argument('--n_workers', type=int, default=1, help="Run the seeds in parallel worker processes, 0 sizes the pool to the available cores and memory")
+    parser.add_argument('--batched', action='store_true', help="Train the seeds as one vectorized model (gcn/gin base models)")
+    parser.add_argument('--run_ids', type=int, nargs='+', default=None, help="Only run these splits/seeds, e.g. --run_ids 3")
+    parser.add_argument('--output', type=str, default='output', help="Root directory for results")
+    parser.add_argument('--override', type=str, action='append', default=[], help="Configuration override, e.g. --override calibration.calibrator_name=TS")
+    parser.add_argument('--store', type=str, default=None, help="SQLite result store the runs are appended to, defaults to <output>/results.db")
+    parser.add_argument('--plot', action='store_true', help="Render the degree-bin plots in the background after the runs")
+    parser.add_argument('--profile', type=str, default=None, help="Profile the hot paths and write profile.json and a Chrome trace (trace.json) to this directory")
+    parser.add_argument('--distributed', action='store_true', help="Join the process group started by torchrun (gloo): shards the GETS calibrator training and, with train.partition, the base model training")
+    parser.add_argument('--out_of_core', type=str, default=None, help="Keep the node features in a memory-mapped file in this directory instead of in memory")
+    parser.add_argument('--feature_cache_mb', type=int, default=1024, help="Page cache for --out_of_core features")
+    parser.add_argument('--save_models', type=str, default=None, help="Save the graph, the features and the fitted calibrator of every run to this directory, for serve.py")
+    parser.add_argument('--precision', type=str, default=None, choices=['fp32', 'bf16', 'fp16'], help="Mixed precision for base training and calibration (train.precision / calibration.precision)")
     args = parser.parse_args()
 
     # os.environ['CUDA_VISIBLE_DEVICES'] = str(args.gpu)
     # print(f"Using GPU: {args.gpu}")
 
-    conf = load_conf(dataset=args.dataset)
+    overrides = parse_overrides(args.override)
+    if args.precision is not None:
+        overrides.setdefault('train.precision', args.precision)
+        overrides.setdefault('calibration.precision', args.precision)
+    conf = load_conf(dataset=args.dataset, overrides=overrides)
+    if args.out_of_core and conf.gnn["type"] == "gat":
+        parser.error("--out_of_core supports gcn and gin base models, the GAT attention needs the features in memory")
 
-    dataset = Dataset(ds_name=args.dataset, n_runs=args.n_runs)
+    if args.distributed:
+        rank, world_size = init_distributed()
+        print(f"Rank {rank}/{world_size}")
+    if args.profile:
+        PROFILER.enable()
+    n_splits = args.n_runs if args.run_ids is None else max(args.run_ids) + 1
+    with profile("dataset_load", dataset=args.dataset):
+        dataset = Dataset(ds_name=args.dataset, n_runs=n_splits, out_of_core=args.out_of_core, feature_cache_mb=args.feature_cache_mb)
 
-    solver = Solver(conf, dataset)
+    if args.save_models and is_main_process():
+        from utils.serving import save_graph
+        save_graph(args.save_models, dataset.g, dataset.features)
+    solver = Solver(conf, dataset, output_root=args.output, save_dir=args.save_models)
 
     exp = ExpManager(solver)
-    exp.run(n_runs=args.n_runs)
\ No newline at end of file
+    exp.run(n_runs=args.n_runs, n_workers=args.n_workers, batched=args.batched, run_ids=args.run_ids, store=args.store, plot=args.plot)
+
+    if args.profile and is_main_process():
+        os.makedirs(args.profile, exist_ok=True)
+        PROFILER.export_json(os.path.join(args.profile, "profile.json"))
+        PROFILER.export_chrome_trace(os.path.join(args.profile, "trace.json"))
+        print(PROFILER.format_summary())
\ No newline at end of file
@@ -1,11 +1,68 @@
+import weakref
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import dgl
 import dgl.nn as dglnn
+from model.gnns import full_precision
+from utils.profiler import profile, estimate_flops
+from dataset.features import project
 from torch.distributions.normal import Normal
-import numpy as np
-import networkx as nx
+from torch.utils.checkpoint import checkpoint
+
+# Node data of a subgraph holding the full-graph degrees of its nodes, read by the degree experts
+DEGREES = "gets_degrees"
+
+# Degrees of the graphs seen by the degree encoders, computed once per graph for all the experts
+_DEGREES = weakref.WeakKeyDictionary()
+
+# calibration.activation_checkpointing: keep only the inputs and outputs of every expert ("expert")
+# or of every message-passing layer ("layer") for the backward pass and recompute the rest
+CHECKPOINTING = [None, "expert", "layer"]
+
+
+def checkpointed(enabled, function, *args):
+    """
+    function(*args); when enabled and gradients are on, its activations are recomputed in the
+    backward pass instead of being kept
+    """
+    if enabled and torch.is_grad_enabled():
+        return checkpoint(function, *args, use_reentrant=False)
+    return function(*args)
+
+
+def node_degrees(g):
+    """
+    In- plus out-degrees of the nodes of g; subgraphs carry the full-graph degrees of their nodes
+    """
+    if DEGREES in g.ndata:
+        return g.ndata[DEGREES]
+    degrees = _DEGREES.get(g)
+    if degrees is None:
+        degrees = _DEGREES[g] = g.in_degrees() + g.out_degrees()
+    return degrees
+
+
+class DegreeEncoder(nn.Module):
+    """
+    Embedding of the node degrees bucketed on a log scale: `per_octave` buckets per doubling of the
+    degree, the last of the `num_buckets` buckets holds all larger degrees. Its size does not depend
+    on the graph, so it is built and optimized with the other parameters, and GETS shares one
+    encoder across its degree experts.
+    """
+    def __init__(self, embedding_dim, num_buckets=32, per_octave=2):
+        super().__init__()
+        self.num_buckets = num_buckets
+        self.per_octave = per_octave
+        self.embedding = nn.Embedding(num_buckets, embedding_dim)
+
+    def buckets(self, degrees):
+        return (torch.log2(degrees.float() + 1) * self.per_octave).long().clamp(max=self.num_buckets - 1)
+
+    def forward(self, g):
+        return self.embedding(self.buckets(node_degrees(g)))
+
 
 # Adapted form https://raw.githubusercontent.com/davidmrau/mixture-of-experts/master/GETS.py
 
@@ -20,7 +77,8 @@ class GCN_GETS(torch.nn.Module):
                  expert_config,
                  feature_dim,
                  feature_hidden_dim,
-                 degree_hidden_dim):
+                 degree_hidden_dim,
+                 degree_encoder=None):
         super().__init__()
         self.dropout_rate = dropout_rate
         self.expert_config = expert_config
@@ -33,6 +91,7 @@ class GCN_GETS(torch.nn.Module):
             self.proj_feature = nn.Linear(feature_dim, feature_hidden_dim)
             in_channels += feature_hidden_dim
         if "degrees" in expert_config:
+            self.degree_encoder = degree_encoder or DegreeEncoder(degree_hidden_dim)
             in_channels += degree_hidden_dim
         for _ in range(num_layers-2):
             self.feature_list.insert(-1, hidden_dim)
@@ -45,26 +104,20 @@ class GCN_GETS(torch.nn.Module):
         self.layer_list = torch.nn.ModuleDict(layer_list)
 
         self.degree_dim = degree_hidden_dim
+        self.checkpoint_layers = False
 
     def forward(self, g, logits, features):
         inputs = []
         if "logits" in self.expert_config:
             inputs.append(logits)
         if "features" in self.expert_config:
-            features = self.proj_feature(features)
+            features = project(self.proj_feature, features)
             inputs.append(features)
         if "degrees" in self.expert_config:
-            # only compute once
-            if not hasattr(self, "degrees"):
-                degrees = g.in_degrees() + g.out_degrees()
-                max_degree = degrees.max() + 1
-                self.degree_embdder = nn.Embedding(num_embeddings=max_degree, embedding_dim=self.degree_dim).to(self.device)
-                self.degrees= degrees.unsqueeze(-1)
-            degree_embeds = self.degree_embdder(self.degrees.squeeze(-1))
-            inputs.append(degree_embeds)
+            inputs.append(self.degree_encoder(g))
         x = torch.concat(inputs,dim=-1)
         for i in range(len(self.feature_list)-1):
-            x = self.layer_list["conv"+str(i+1)](g, x)
+            x = checkpointed(self.checkpoint_layers, self.layer_list["conv"+str(i+1)], g, x)
             if i < len(self.feature_list)-2:
                 x = F.relu(x)
                 x = F.dropout(x, self.dropout_rate, self.training)
@@ -81,7 +134,8 @@ class GAT_GETS(torch.nn.Module):
                  feature_dim,
                  feature_hidden_dim,
                  degree_hidden_dim,
-                 num_heads=2):  
+                 num_heads=2,
+                 degree_encoder=None):  
         super().__init__()
         self.dropout_rate = dropout_rate
         self.expert_config = expert_config
@@ -95,6 +149,7 @@ class GAT_GETS(torch.nn.Module):
             self.proj_feature = nn.Linear(feature_dim, feature_hidden_dim)
             in_channels += feature_hidden_dim
         if "degrees" in expert_config:
+            self.degree_encoder = degree_encoder or DegreeEncoder(degree_hidden_dim)
             in_channels += degree_hidden_dim
         self.feature_list = [in_channels] + [hidden_dim] * (num_layers - 1)
         layer_list = []
@@ -106,6 +161,7 @@ class GAT_GETS(torch.nn.Module):
 
         self.layer_list = nn.ModuleDict(layer_list)
         self.degree_dim = degree_hidden_dim
+        self.checkpoint_layers = False
         self.final_proj = nn.Linear(hidden_dim , num_classes)
 
     def forward(self, g, logits, features):
@@ -113,19 +169,13 @@ class GAT_GETS(torch.nn.Module):
         if "logits" in self.expert_config:
             inputs.append(logits)
         if "features" in self.expert_config:
-            features = self.proj_feature(features)
+            features = project(self.proj_feature, features)
             inputs.append(features)
         if "degrees" in self.expert_config:
-            if not hasattr(self, "degrees"):
-                degrees = g.in_degrees() + g.out_degrees()
-                max_degree = degrees.max().item() + 1
-                self.degree_embdder = nn.Embedding(num_embeddings=max_degree, embedding_dim=self.degree_dim).to(self.device)
-                self.degrees = degrees.unsqueeze(-1)
-            degree_embeds = self.degree_embdder(self.degrees.squeeze(-1))
-            inputs.append(degree_embeds)
+            inputs.append(self.degree_encoder(g))
         x = torch.cat(inputs, dim=-1)
         for i in range(len(self.feature_list) - 1):
-            x = self.layer_list["conv" + str(i + 1)](g, x)
+            x = checkpointed(self.checkpoint_layers, full_precision, self.layer_list["conv" + str(i + 1)], g, x)
             x = x.flatten(start_dim=2)              
             if i < len(self.feature_list) - 2:
                 x = F.relu(x)
@@ -145,7 +195,8 @@ class GIN_GETS(torch.nn.Module):
                  expert_config,
                  feature_dim,
                  feature_hidden_dim,
-                 degree_hidden_dim):
+                 degree_hidden_dim,
+                 degree_encoder=None):
         super().__init__()
         self.dropout_rate = dropout_rate
         self.expert_config = expert_config
@@ -158,6 +209,7 @@ class GIN_GETS(torch.nn.Module):
             self.proj_feature = nn.Linear(feature_dim, feature_hidden_dim)
             in_channels += feature_hidden_dim
         if "degrees" in expert_config:
+            self.degree_encoder = degree_encoder or DegreeEncoder(degree_hidden_dim)
             in_channels += degree_hidden_dim
 
         self.feature_list = [in_channels, hidden_dim, num_classes]
@@ -176,27 +228,21 @@ class GIN_GETS(torch.nn.Module):
 
         self.layer_list = torch.nn.ModuleDict(layer_list)
         self.degree_dim = degree_hidden_dim
+        self.checkpoint_layers = False
 
     def forward(self, g, logits, features):
         inputs = []
         if "logits" in self.expert_config:
             inputs.append(logits)
         if "features" in self.expert_config:
-            features = self.proj_feature(features)
+            features = project(self.proj_feature, features)
             inputs.append(features)
         if "degrees" in self.expert_config:
-            # only compute once
-            if not hasattr(self, "degrees"):
-                degrees = g.in_degrees() + g.out_degrees()
-                max_degree = degrees.max() + 1
-                self.degree_embdder = nn.Embedding(num_embeddings=max_degree, embedding_dim=self.degree_dim).to(self.device)
-                self.degrees = degrees.unsqueeze(-1)
-            degree_embeds = self.degree_embdder(self.degrees.squeeze(-1))
-            inputs.append(degree_embeds)
+            inputs.append(self.degree_encoder(g))
 
         x = torch.concat(inputs, dim=-1)
         for i in range(len(self.feature_list) - 1):
-            x = self.layer_list["conv" + str(i + 1)](g, x)
+            x = checkpointed(self.checkpoint_layers, self.layer_list["conv" + str(i + 1)], g, x)
             if i < len(self.feature_list) - 2:
                 x = F.relu(x)
                 x = F.dropout(x, self.dropout_rate, training=self.training)
@@ -225,10 +271,17 @@ class GETS(nn.Module):
                  noisy_gating,
                  coef,
                  device,
-                 backbone='gcn'):
+                 backbone='gcn',
+                 checkpointing=None,
+                 degree_buckets=32,
+                 expert_groups=None,
+                 group_select=2,
+                 expert_subgraphs=False):
         super(GETS, self).__init__()
         self.noisy_gating = noisy_gating
         self.num_experts = len(expert_configs)
+        # positions of the experts in expert_configs, kept through pruning (None once distilled)
+        self.expert_ids = list(range(self.num_experts))
         self.k = expert_select # an integer - how many experts to use for each batch element
         self.loss_coef = coef
         self.device = device
@@ -237,6 +290,8 @@ class GETS(nn.Module):
         # instantiate experts
         # self.cagcn = GCN(num_class, 1, 16, drop_rate=dropout_rate, num_layers=2)
         self.proj_feature = nn.Linear(feature_dim, feature_hidden_dim)
+        # one degree embedding shared by all the degree experts
+        self.degree_encoder = DegreeEncoder(degree_hidden_dim, degree_buckets) if any("degrees" in c for c in expert_configs) else None
         if backbone == 'gcn':
             self.experts = nn.ModuleList([
                 GCN_GETS(
@@ -249,6 +304,7 @@ class GETS(nn.Module):
                     feature_dim=feature_dim,
                     feature_hidden_dim=feature_hidden_dim,
                     degree_hidden_dim=degree_hidden_dim,
+                    degree_encoder=self.degree_encoder,
                 ) for i in range(self.num_experts)])
         elif backbone == 'gat':
             self.experts = nn.ModuleList([
@@ -262,6 +318,7 @@ class GETS(nn.Module):
                     feature_dim=feature_dim,
                     feature_hidden_dim=feature_hidden_dim,
                     degree_hidden_dim=degree_hidden_dim,
+                    degree_encoder=self.degree_encoder,
                 ) for i in range(self.num_experts)])
         elif backbone =='gin':
             self.experts = nn.ModuleList([
@@ -275,6 +332,7 @@ class GETS(nn.Module):
                     feature_dim=feature_dim,
                     feature_hidden_dim=feature_hidden_dim,
                     degree_hidden_dim=degree_hidden_dim,
+                    degree_encoder=self.degree_encoder,
                 ) for i in range(self.num_experts)])
         else:
             raise NotImplementedError
@@ -286,6 +344,27 @@ class GETS(nn.Module):
         self.register_buffer("mean", torch.tensor([0.0]))
         self.register_buffer("std", torch.tensor([1.0]))
         assert(self.k <= self.num_experts)
+        if checkpointing not in CHECKPOINTING:
+            raise ValueError(f"Unknown activation checkpointing {checkpointing}, choose from {CHECKPOINTING}")
+        self.checkpointing = checkpointing
+        for expert in self.experts:
+            expert.checkpoint_layers = checkpointing == "layer"
+
+        # two-level gating: expert_groups is a number of groups of consecutive experts or a list of
+        # groups of expert indices, every node is routed to group_select groups. With one selected
+        # group its gate would always be 1 and w_group would get no gradient from the calibration loss
+        self.groups = None
+        if isinstance(expert_groups, int):
+            expert_groups = [group.tolist() for group in np.array_split(np.arange(self.num_experts), expert_groups)]
+        if expert_groups is not None and len(expert_groups) > 1:
+            if sorted(e for group in expert_groups for e in group) != list(range(self.num_experts)) or not all(expert_groups):
+                raise ValueError(f"expert_groups must split the {self.num_experts} experts into non-empty groups, got {expert_groups}")
+            self.groups = [list(group) for group in expert_groups]
+            self.w_group = nn.Parameter(torch.zeros(feature_hidden_dim+num_classses, len(self.groups)), requires_grad=True)
+            self.w_group_noise = nn.Parameter(torch.zeros(feature_hidden_dim+num_classses, len(self.groups)), requires_grad=True)
+            self.group_select = min(group_select, len(self.groups))
+        # evaluate an expert on the receptive field of its routed nodes when that is less than half the graph
+        self.expert_subgraphs = expert_subgraphs
 
     def cv_squared(self, x):
         """The squared coefficient of variation of a sample.
@@ -304,17 +383,29 @@ class GETS(nn.Module):
             return torch.tensor([0], device=x.device, dtype=x.dtype)
         return x.float().var() / (x.float().mean()**2 + eps)
 
-    def _gates_to_load(self, gates):
-        """Compute the true load per expert, given the gates.
-        The load is the number of examples for which the corresponding gate is >0.
+    def _gates_to_load(self, top_k_indices, num_experts=None):
+        """Compute the true load per expert, given the top-k expert indices.
+        The load is the number of examples routed to the expert (whose gate is >0).
         Args:
-        gates: a `Tensor` of shape [batch_size, n]
+        top_k_indices: a `Tensor` of shape [batch_size, k]
+        num_experts: n, defaults to the number of experts
         Returns:
-        a float32 `Tensor` of shape [n]
+        a `Tensor` of shape [n]
         """
-        return (gates > 0).sum(0)
+        return torch.bincount(top_k_indices.flatten(), minlength=num_experts or self.num_experts)
 
-    def _prob_in_top_k(self, clean_values, noisy_values, noise_stddev, noisy_top_values):
+    def expert_importance(self, top_k_indices, top_k_gates):
+        """Sum of the gates of every expert over the batch, from the compact top-k gates.
+        Args:
+        top_k_indices: a `Tensor` of shape [batch_size, k]
+        top_k_gates: a `Tensor` of shape [batch_size, k]
+        Returns:
+        a `Tensor` of shape [n]
+        """
+        importance = torch.zeros(self.num_experts, dtype=top_k_gates.dtype, device=top_k_gates.device)
+        return importance.index_add(0, top_k_indices.flatten(), top_k_gates.flatten())
+
+    def _prob_in_top_k(self, clean_values, noisy_values, noise_stddev, noisy_top_values, k=None):
         """Helper function to NoisyTopKGating.
         Computes the probability that value is in top k, given different random noise.
         This gives us a way of backpropagating from a loss that balances the number
@@ -328,6 +419,7 @@ class GETS(nn.Module):
         noise_stddev: a `Tensor` of shape [batch, n], or None
         noisy_top_values: a `Tensor` of shape [batch, m].
            "values" Output of tf.top_k(noisy_top_values, m).  m >= k+1
+        k: an integer, defaults to self.k
         Returns:
         a `Tensor` of shape [batch, n].
         """
@@ -335,7 +427,8 @@ class GETS(nn.Module):
         m = noisy_top_values.size(1)
         top_values_flat = noisy_top_values.flatten()
 
-        threshold_positions_if_in = torch.arange(batch, device=clean_values.device) * m + self.k
+        k = self.k if k is None else k
+        threshold_positions_if_in = torch.arange(batch, device=clean_values.device) * m + k
         threshold_if_in = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_in), 1)
         is_in = torch.gt(noisy_values, threshold_if_in)
         threshold_positions_if_out = threshold_positions_if_in - 1
@@ -348,20 +441,26 @@ class GETS(nn.Module):
         return prob
     
     
-    def noisy_top_k_gating(self, x,  train, noise_epsilon=1e-2):
+    def noisy_top_k_gating(self, x,  train, noise_epsilon=1e-2, w_gate=None, w_noise=None, k=None):
         """Noisy top-k gating.
           See paper: https://arxiv.org/abs/1701.06538.
           Args:
             x: input Tensor with shape [batch_size, input_size]
             train: a boolean - we only add noise at training time.
             noise_epsilon: a float
+            w_gate, w_noise, k: gate over other weights [input_size, n] and k, default to the experts'
           Returns:
-            gates: a Tensor with shape [batch_size, num_experts]
-            load: a Tensor with shape [num_experts]
+            top_k_indices: a Tensor with shape [batch_size, k], the experts every example is routed to
+            top_k_gates: a Tensor with shape [batch_size, k], their gates
+            load: a Tensor with shape [n]
         """
-        clean_logits = x @ self.w_gate # size:(nums_node,nums_expert)
+        w_gate = self.w_gate if w_gate is None else w_gate
+        w_noise = self.w_noise if w_noise is None else w_noise
+        k = self.k if k is None else k
+        num_experts = w_gate.shape[1]
+        clean_logits = x @ w_gate # size:(nums_node,nums_expert)
         if self.noisy_gating and train:
-            raw_noise_stddev = x @ self.w_noise
+            raw_noise_stddev = x @ w_noise
             noise_stddev = ((self.softplus(raw_noise_stddev) + noise_epsilon))
             noisy_logits = clean_logits + (torch.randn_like(clean_logits) * noise_stddev)
             logits = noisy_logits
@@ -369,37 +468,139 @@ class GETS(nn.Module):
             logits = clean_logits
 
         # calculate topk + 1 that will be needed for the noisy gates
-        top_logits, top_indices = logits.topk(min(self.k+1, self.num_experts), dim=1) 
-        top_k_logits = top_logits[:, :self.k] # size:(batch_size,self.k)
-        top_k_indices = top_indices[:, :self.k] # size:(batch_size,self.k)
+        top_logits, top_indices = logits.topk(min(k+1, num_experts), dim=1) 
+        top_k_logits = top_logits[:, :k] # size:(batch_size,k)
+        top_k_indices = top_indices[:, :k] # size:(batch_size,k)
         top_k_gates = self.softmax(top_k_logits)
 
-        zeros = torch.zeros_like(logits, requires_grad=True)
-        gates = zeros.scatter(1, top_k_indices, top_k_gates)  # size:(batch_size,num_experts)
-
-        if self.noisy_gating and self.k < self.num_experts and train:
-            load = (self._prob_in_top_k(clean_logits, noisy_logits, noise_stddev, top_logits)).sum(0)
+        if self.noisy_gating and k < num_experts and train:
+            load = (self._prob_in_top_k(clean_logits, noisy_logits, noise_stddev, top_logits, k)).sum(0)
         else:
-            load = self._gates_to_load(gates)
-        return gates, load  
+            load = self._gates_to_load(top_k_indices, num_experts)
+        return top_k_indices, top_k_gates, load
+
+    def hierarchical_gating(self, x, train):
+        """Two-level noisy top-k gating (appendix B of the paper above): every node is routed to the
+        top group_select groups (w_group), then to the top k experts within each of them (the
+        group's columns of w_gate), with the products of the two gates. Only the expert logits of
+        the selected groups are computed, [N, G + group_select * E / G] instead of [N, E].
+          Returns:
+            top_k_indices, top_k_gates: Tensors with shape [batch_size, group_select * k]
+            load: a Tensor with shape [num_experts]
+            group_loss: the load-balancing loss of the groups
+        """
+        group_indices, group_gates, group_load = self.noisy_top_k_gating(
+            x, train, w_gate=self.w_group, w_noise=self.w_group_noise, k=self.group_select)
+        group_importance = torch.zeros(len(self.groups), dtype=group_gates.dtype, device=x.device)
+        group_importance = group_importance.index_add(0, group_indices.flatten(), group_gates.flatten())
+
+        k = min(self.k, min(len(group) for group in self.groups))
+        top_k_indices = group_indices.new_zeros((x.shape[0], self.group_select, k))
+        top_k_gates = group_gates.new_zeros((x.shape[0], self.group_select, k))
+        load = x.new_zeros(self.num_experts, dtype=torch.float)
+        for j, group in enumerate(self.groups):
+            # a node selects a group at most once
+            rows, slots = (group_indices == j).nonzero().unbind(1)
+            if len(rows) == 0:
+                continue
+            experts = torch.tensor(group, device=x.device)
+            indices, gates, group_expert_load = self.noisy_top_k_gating(
+                x[rows], train, w_gate=self.w_gate[:, experts], w_noise=self.w_noise[:, experts], k=k)
+            top_k_indices[rows, slots] = experts[indices]
+            top_k_gates[rows, slots] = group_gates[rows, slots].unsqueeze(1) * gates
+            load = load.index_add(0, experts, group_expert_load.float())
+        group_loss = self.cv_squared(group_importance) + self.cv_squared(group_load)
+        return top_k_indices.flatten(1), top_k_gates.flatten(1), load, group_loss
     
-    def forward(self, g, logits, features):
-        features_trans = self.proj_feature(features)
-        gating_input = torch.cat([features_trans, logits], dim=1)
-        node_gates, load = self.noisy_top_k_gating(gating_input, self.training) # N, |E|
-        importance = node_gates.sum(0) 
-        loss = self.cv_squared(importance) + self.cv_squared(load)
-        loss *= self.loss_coef
-
-        expert_outputs = []
-        for i in range(self.num_experts):
-            expert_i_output = self.experts[i](g, logits, features)
-            expert_outputs.append(expert_i_output)
-        expert_outputs = torch.stack(expert_outputs, dim=1)
-        
-        # print(expert_outputs.shape)
-        # print(node_gates.shape)
+    def prune_experts(self, keep):
+        """
+        Keep only the experts at the indices in `keep`; the gating softmax runs over the remaining
+        experts, so the gates of every node are re-normalized over them
+        """
+        self.experts = nn.ModuleList([self.experts[i] for i in keep])
+        self.w_gate = nn.Parameter(self.w_gate.data[:, keep].clone())
+        self.w_noise = nn.Parameter(self.w_noise.data[:, keep].clone())
+        self.num_experts = len(keep)
+        if self.expert_ids is not None:
+            self.expert_ids = [self.expert_ids[i] for i in keep]
+        self.k = min(self.k, self.num_experts)
+        if self.groups is not None:
+            position = {e: i for i, e in enumerate(keep)}
+            groups = [(j, [position[e] for e in group if e in position]) for j, group in enumerate(self.groups)]
+            groups = [(j, group) for j, group in groups if group]
+            if len(groups) > 1:
+                kept = [j for j, _ in groups]
+                self.groups = [group for _, group in groups]
+                self.w_group = nn.Parameter(self.w_group.data[:, kept].clone())
+                self.w_group_noise = nn.Parameter(self.w_group_noise.data[:, kept].clone())
+                self.group_select = min(self.group_select, len(self.groups))
+            else:
+                # a single group left, gate over its experts directly
+                self.groups = self.w_group = self.w_group_noise = None
 
-        temperature = (expert_outputs * node_gates.unsqueeze(-1)).sum(dim=1)
+    def forward(self, g, logits, features):
+        temperature, loss, node_gates = self.temperature(g, logits, features)
         calibrated = logits * F.softplus(temperature)
-        return calibrated, loss, node_gates
\ No newline at end of file
+        return calibrated, loss, node_gates
+
+    def temperature(self, g, logits, features):
+        """
+        Gate-weighted sum of the expert outputs, before the softplus
+        """
+        with profile("gets_gating"):
+            features_trans = project(self.proj_feature, features)
+            gating_input = torch.cat([features_trans, logits], dim=1)
+            if self.groups is None:
+                top_k_indices, top_k_gates, load = self.noisy_top_k_gating(gating_input, self.training) # N, k
+                loss = 0
+            else:
+                top_k_indices, top_k_gates, load, loss = self.hierarchical_gating(gating_input, self.training)
+            importance = self.expert_importance(top_k_indices, top_k_gates)
+            loss = loss + self.cv_squared(importance) + self.cv_squared(load)
+            loss *= self.loss_coef
+
+        # Group the (node, slot) pairs by expert once (a stable sort of the expert ids, on the
+        # narrowest integer type, which sorts fastest) and accumulate the gated outputs of the
+        # routed experts one at a time, so only [N, k] gates and one [N, C] output are alive instead
+        # of a dense [N, |E|] gate matrix and [N, |E|, C] outputs. A node selects an expert at most once.
+        k = top_k_indices.shape[1]
+        flat_indices = top_k_indices.flatten()
+        key = flat_indices.to(torch.uint8 if self.num_experts <= 256 else torch.int16 if self.num_experts <= 2 ** 15 else torch.int32)
+        order = torch.argsort(key, stable=True)
+        counts = torch.bincount(flat_indices, minlength=self.num_experts).tolist()
+        flat_gates = top_k_gates.flatten()
+        temperature = 0
+        for i, slots in enumerate(torch.split(order, counts)):
+            if len(slots) == 0:
+                continue
+            nodes = slots // k
+            gates = flat_gates[slots].unsqueeze(1)
+            expert = self.experts[i]
+            with profile(f"gets_expert{i}", flops=lambda: estimate_flops(expert, g), inputs="+".join(expert.expert_config)):
+                field = self.receptive_field(g, nodes, len(expert.feature_list) - 1) if self.expert_subgraphs else None
+                if field is None:
+                    # the expert runs on the whole graph anyway, scale its output by a dense weight
+                    weight = gates.new_zeros((len(logits), 1)).index_put((nodes,), gates)
+                    temperature = temperature + weight * checkpointed(self.checkpointing == "expert", expert, g, logits, features)
+                else:
+                    sg, nid, seeds = field
+                    out = checkpointed(self.checkpointing == "expert", expert, sg, logits[nid], features[nid])
+                    part = gates * out[seeds]
+                    temperature = temperature + part.new_zeros((len(logits), part.shape[1])).index_add(0, nodes, part)
+        return temperature, loss, (top_k_indices, top_k_gates)
+
+    def receptive_field(self, g, nodes, num_hops):
+        """
+        Subgraph of g within num_hops + 1 hops of nodes, so that its outermost aggregating nodes keep
+        their full-graph degree normalisation (the graphs are symmetric), with the full-graph degrees
+        in ndata[DEGREES]. Returns (subgraph, its node ids in g, positions of nodes in it), or None
+        when it is not clearly smaller than g.
+        """
+        if len(nodes) > 0.5 * g.num_nodes():
+            return None
+        sg, seeds = dgl.khop_in_subgraph(g, nodes.to(g.idtype), num_hops + 1, store_ids=True)
+        if sg.num_nodes() > 0.5 * g.num_nodes():
+            return None
+        nid = sg.ndata[dgl.NID].long()
+        sg.ndata[DEGREES] = node_degrees(g)[nid]
+        return sg, nid, seeds.long()
\ No newline at end of file
@@ -0,0 +1,227 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import dgl.function as fn
+import dgl.nn as dglnn
+from model.gnns import GCN, GIN, gcn_aggregate
+from utils.checkpoint import Checkpoint
+
+# R independent copies of a model trained as one: every parameter gets a leading replica
+# dimension and node tensors are [N, R, *], so all replicas share each sparse aggregation.
+# Adam and weight decay act elementwise and the replica losses are summed, so each replica
+# follows the same trajectory it would have followed when trained on its own.
+
+
+def _stack(tensors):
+    return nn.Parameter(torch.stack([t.detach() for t in tensors]).clone())
+
+
+def batched_matmul(h, weight):
+    """
+    h: [N, in] shared by all replicas or [N, R, in], weight: [R, in, out] -> [N, R, out]
+    """
+    if h.dim() == 2:
+        R, in_dim, out_dim = weight.shape
+        return (h @ weight.permute(1, 0, 2).reshape(in_dim, R * out_dim)).view(-1, R, out_dim)
+    return torch.einsum('nri,rio->nro', h, weight)
+
+
+class BatchedLinear(nn.Module):
+    def __init__(self, linears):
+        super().__init__()
+        self.weight = _stack([linear.weight.t() for linear in linears])
+        self.bias = _stack([linear.bias for linear in linears])
+
+    def forward(self, h):
+        return batched_matmul(h, self.weight) + self.bias
+
+    def unstack(self, linears):
+        for r, linear in enumerate(linears):
+            linear.weight.data.copy_(self.weight[r].t())
+            linear.bias.data.copy_(self.bias[r])
+
+
+class BatchedGraphConv(nn.Module):
+    def __init__(self, convs):
+        super().__init__()
+        self.weight = _stack([conv.weight for conv in convs])
+        self.bias = _stack([conv.bias for conv in convs])
+        self.norm = convs[0]._norm
+        self.in_feats = convs[0]._in_feats
+        self.out_feats = convs[0]._out_feats
+
+    def forward(self, g, h):
+        # Same order as dglnn.GraphConv: aggregate on the narrower side of the weight
+        if self.in_feats > self.out_feats:
+            rst = gcn_aggregate(g, batched_matmul(h, self.weight), self.norm)
+        else:
+            rst = batched_matmul(gcn_aggregate(g, h, self.norm), self.weight)
+        return rst + self.bias
+
+    def unstack(self, convs):
+        for r, conv in enumerate(convs):
+            conv.weight.data.copy_(self.weight[r])
+            conv.bias.data.copy_(self.bias[r])
+
+
+class BatchedGINConv(nn.Module):
+    def __init__(self, convs):
+        super().__init__()
+        if convs[0]._aggregator_type != 'mean' or len(convs[0].apply_func) != 1:
+            raise NotImplementedError("Batched GIN only supports a mean aggregator with a single linear layer")
+        self.register_buffer('eps', convs[0].eps.detach().clone())
+        self.linear = BatchedLinear([conv.apply_func[0] for conv in convs])
+
+    def forward(self, g, h):
+        with g.local_scope():
+            g.srcdata['h'] = h
+            g.update_all(fn.copy_u('h', 'm'), fn.mean('m', 'neigh'))
+            rst = (1 + self.eps) * h + g.dstdata['neigh']
+        return self.linear(rst)
+
+    def unstack(self, convs):
+        self.linear.unstack([conv.apply_func[0] for conv in convs])
+
+
+class BatchedGCN(nn.Module):
+    """
+    layers: for every layer, the list of GraphConv (or GINConv) modules of all replicas
+    """
+    def __init__(self, layers, dropout):
+        super().__init__()
+        conv_type = BatchedGINConv if isinstance(layers[0][0], dglnn.GINConv) else BatchedGraphConv
+        self.layers = nn.ModuleList([conv_type(convs) for convs in layers])
+        self.dropout = dropout
+
+    def forward(self, g, h):
+        for i, layer in enumerate(self.layers):
+            h = layer(g, h)
+            if i < len(self.layers) - 1:
+                h = F.relu(h)
+                h = F.dropout(h, self.dropout, self.training)
+        return h
+
+    def unstack(self, layers):
+        for layer, convs in zip(self.layers, layers):
+            layer.unstack(convs)
+
+
+def _gnn_layers(models):
+    return [[model.layers[i] for model in models] for i in range(len(models[0].layers))]
+
+
+def batch_gnn(models):
+    """
+    Stack R base GNNs built by load_gnn into one BatchedGCN, undo with unbatch_gnn
+    """
+    if not all(type(model) in [GCN, GIN] for model in models):
+        raise NotImplementedError("Batched training supports the gcn and gin base models")
+    if models[0].norm:
+        raise NotImplementedError("Batched training does not support normalisation layers")
+    return BatchedGCN(_gnn_layers(models), models[0].dropout.p)
+
+
+def unbatch_gnn(batched, models):
+    batched.unstack(_gnn_layers(models))
+
+
+class BatchedTS(nn.Module):
+    def __init__(self, calibrators):
+        super().__init__()
+        self.temperature = _stack([cal.temperature for cal in calibrators])
+
+    def forward(self, g, logits):
+        return logits / self.temperature
+
+    def train_param(self):
+        return [self.temperature]
+
+    def unstack(self, calibrators):
+        for r, cal in enumerate(calibrators):
+            cal.temperature.data.copy_(self.temperature[r])
+
+
+class BatchedVS(nn.Module):
+    def __init__(self, calibrators):
+        super().__init__()
+        self.temperature = _stack([cal.temperature for cal in calibrators])
+        self.bias = _stack([cal.bias for cal in calibrators])
+
+    def forward(self, g, logits):
+        return logits * self.temperature + self.bias
+
+    def train_param(self):
+        return [self.temperature]
+
+    def unstack(self, calibrators):
+        for r, cal in enumerate(calibrators):
+            cal.temperature.data.copy_(self.temperature[r])
+            cal.bias.data.copy_(self.bias[r])
+
+
+class BatchedCaGCN(nn.Module):
+    def __init__(self, calibrators):
+        super().__init__()
+        self.cagcn = BatchedGCN(self._layers(calibrators), calibrators[0].cagcn.drop_rate)
+
+    @staticmethod
+    def _layers(calibrators):
+        return [list(convs) for convs in zip(*[cal.cagcn.layer_list.values() for cal in calibrators])]
+
+    def forward(self, g, logits):
+        return logits * F.softplus(self.cagcn(g, logits))
+
+    def train_param(self):
+        return self.cagcn.parameters()
+
+    def unstack(self, calibrators):
+        self.cagcn.unstack(self._layers(calibrators))
+
+
+BATCHED_CALIBRATORS = {
+    'TS': BatchedTS,
+    'VS': BatchedVS,
+    'CaGCN': BatchedCaGCN,
+}
+
+
+def fit_calibration_batched(batched, g, logits, labels, masks, epochs, patience, optimizer):
+    """
+    fit_calibration for R calibrators stacked in one module.
+    logits: [N, R, C] base logits, masks[r]: [train_idx, val_idx, test_idx] of replica r.
+    Every replica keeps its own early stopping state and best snapshot; a replica that ran out
+    of patience stops updating its snapshot and the loop ends once all of them have stopped.
+    """
+    train_idxs = [mask[1] for mask in masks]
+    val_idxs = [mask[0] for mask in masks]
+    vlss_mn = [float('Inf')] * len(masks)
+    curr_step = [0] * len(masks)
+    active = [True] * len(masks)
+    checkpoint = Checkpoint(batched, buffers=False)
+    checkpoint.save()
+    for epoch in range(epochs):
+        optimizer.zero_grad()
+        batched.train()
+        calibrated = batched(g, logits)
+        loss = sum(F.cross_entropy(calibrated[idx, r], labels[idx]) for r, idx in enumerate(train_idxs))
+        loss.backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            batched.eval()
+            calibrated = batched(g, logits)
+            for r, idx in enumerate(val_idxs):
+                if not active[r]:
+                    continue
+                val_loss = F.cross_entropy(calibrated[idx, r], labels[idx]).item()
+                if val_loss <= vlss_mn[r]:
+                    vlss_mn[r] = val_loss
+                    curr_step[r] = 0
+                    checkpoint.save(index=r)
+                else:
+                    curr_step[r] += 1
+                    if curr_step[r] >= patience:
+                        active[r] = False
+        if not any(active):
+            break
+    checkpoint.restore()
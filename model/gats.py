@@ -0,0 +1,189 @@
+import torch
+from torch import Tensor, nn, optim
+import torch.nn.functional as F
+from torch.nn import Parameter
+import dgl
+from model.calibrator import fit_calibration
+
+def shortest_path_length(edge_index, mask, max_hop, device):
+    """
+    Return the shortest path length to the mask for every node
+    """
+    dist_to_train = torch.ones_like(mask, dtype=torch.long, device=device) * torch.iinfo(torch.long).max
+    seen_mask = torch.clone(mask).to(device)
+    for hop in range(max_hop):
+        current_hop = torch.nonzero(mask).to(device)
+        dist_to_train[mask] = hop
+        next_hop = torch.zeros_like(mask, dtype=torch.bool, device=device)
+        for node in current_hop:
+            node_mask = edge_index[0,:]==node
+            nbrs = edge_index[1,node_mask]
+            next_hop[nbrs] = True
+        hop += 1
+        # mask for the next hop shouldn't be seen before
+        mask = torch.logical_and(next_hop, ~seen_mask)
+        seen_mask[next_hop] = True
+    return dist_to_train   
+
+class CalibAttentionLayer(nn.Module):
+    """
+    GATS attention on a DGL graph. The graph with its self-loops replaced by one per node and its
+    degrees are built once; every forward is an edge score (u_dot_v), an edge softmax by
+    destination and two sparse aggregations, so per-edge tensors are [E, 1] and no [E, heads + 1]
+    messages are materialized.
+    """
+    def __init__(
+            self,
+            in_channels: int,
+            out_channels: int,
+            g,
+            train_mask,
+            dist_to_train: Tensor = None,
+            heads: int = 8,
+            negative_slope: float = 0.2,
+            bias: float = 1,
+            self_loops: bool = True,
+            bfs_depth=2,
+            device='cpu',
+    ):
+        super().__init__()
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.heads = heads
+        self.negative_slope = negative_slope
+        self.num_nodes = g.num_nodes()
+
+        self.temp_lin = nn.Linear(in_channels, heads, bias=False)
+
+        # The learnable clustering coefficient for training node and their neighbors
+        self.conf_coef = Parameter(torch.zeros([]))
+        self.bias = Parameter(torch.ones(1) * bias)
+        self.train_a = Parameter(torch.ones(1))
+        self.dist1_a = Parameter(torch.ones(1))
+
+        # Compute the distances to the nearest training node of each node
+        train_mask_indices_tensor = torch.as_tensor(train_mask).to(device)
+        train_mask_tensor = torch.zeros(self.num_nodes, dtype=torch.bool, device=device)
+        train_mask_tensor.scatter_(0, train_mask_indices_tensor, True)
+        if dist_to_train is None:
+            dist_to_train = shortest_path_length(torch.stack(g.edges()).long(), train_mask_tensor, bfs_depth, device)
+        self.register_buffer('dist_to_train', dist_to_train)
+
+        self.self_loops = self_loops
+        self.reset_parameters()
+        self.set_graph(g)
+
+    def structure(self, g):
+        """
+        Message-passing structure of g: the graph with one self-loop per node, in-degrees for the
+        confidence differences and inverse out-degrees for their normalization
+        """
+        if self.self_loops:
+            g = dgl.add_self_loop(dgl.remove_self_loop(g))
+        # edge softmax and the aggregations reduce over the in-edges of each node
+        g = g.formats(['csc', 'csr', 'coo'])
+        out_deg = g.out_degrees().float()
+        return g, g.in_degrees().float().unsqueeze(-1), torch.where(out_deg > 0, 1 / out_deg, torch.zeros_like(out_deg)).unsqueeze(-1)
+
+    def set_graph(self, g):
+        """
+        Cache the structure of g, the graph the layer is fit on
+        """
+        self.graph, in_deg, deg_inverse = self.structure(g)
+        self.register_buffer('in_deg', in_deg, persistent=False)
+        self.register_buffer('deg_inverse', deg_inverse, persistent=False)
+
+    def reset_parameters(self):
+        nn.init.xavier_uniform_(self.temp_lin.weight)
+
+    def forward(self, x: Tensor, g=None, nid=None):
+        """
+        x: logits of the nodes of the fitted graph, or of g, a subgraph of it whose node ids in the
+        fitted graph are nid. The subgraph must hold the full neighbourhoods of the nodes whose
+        output is used (e.g. a receptive field of 2 hops).
+        """
+        N, H = x.shape[0], self.heads
+        if g is None:
+            if self.graph.device != x.device:
+                self.graph = self.graph.to(x.device)
+            graph, in_deg, deg_inverse, dist_to_train = self.graph, self.in_deg, self.deg_inverse, self.dist_to_train
+        else:
+            graph, in_deg, deg_inverse = self.structure(g)
+            dist_to_train = self.dist_to_train[nid]
+
+        # Individual Temperature
+        x_min, x_max = x.amin(1, keepdim=True), x.amax(1, keepdim=True)
+        normalized_x = (x - x_min) / (x_max - x_min)
+
+        # t_delta for individual nodes
+        x_sorted = torch.sort(normalized_x, -1)[0]
+        temp = self.temp_lin(x_sorted)
+
+        # Next, we assign spatial coefficient
+        # a_cluster:[N, 1]
+        one = torch.ones((), dtype=x.dtype, device=x.device)
+        a_cluster = torch.where(dist_to_train == 0, self.train_a,
+                                torch.where(dist_to_train == 1, self.dist1_a, one)).unsqueeze(-1)
+
+        # Agreement smoothing: attention of the scaled logits of both end points, softmax over the
+        # in-edges of every node
+        alpha = x / a_cluster
+        score = F.leaky_relu(dgl.ops.u_dot_v(graph, alpha, alpha), self.negative_slope)
+        attention = dgl.ops.edge_softmax(graph, score)
+        sim = dgl.ops.u_mul_e_sum(graph, temp.view(N, H) * a_cluster, attention)
+
+        # Confidence smoothing: sum of conf_i - conf_j over the in-edges of i
+        conf = F.softmax(x, dim=1).amax(-1, keepdim=True)
+        dconf = in_deg * conf - dgl.ops.copy_u_sum(graph, conf)
+
+        out = F.softplus(sim + self.conf_coef * dconf * deg_inverse)
+        out = out.mean(dim=1) + self.bias
+        return out.unsqueeze(1)
+
+    def __repr__(self) -> str:
+        return (
+            f'{self.__class__.__name__}{self.out_channels}, heads={self.heads}')
+
+    
+class GATS(nn.Module):
+    def __init__(self, model, g, num_class, train_mask, device, conf):
+        super().__init__()
+        self.model = model
+        self.num_nodes = g.num_nodes()
+        self.conf = conf
+        self.cagat = CalibAttentionLayer(in_channels=num_class,
+                                         out_channels=1,
+                                         g=g,
+                                         train_mask=train_mask,
+                                         dist_to_train=conf.calibration["dist_to_train"],
+                                         heads=conf.calibration["heads"],
+                                         bias=conf.calibration["bias"],
+                                         device = device)
+        self.device = device
+        
+    def forward(self, g, features, nid=None):
+        """
+        nid: when g is a subgraph of the fitted graph, the node ids of its nodes in that graph
+        """
+        logits = self.model(g, features)
+        temperature = self.graph_temperature_scale(logits, None if nid is None else g, nid)
+        return logits / temperature
+
+    def graph_temperature_scale(self, logits, g=None, nid=None):
+        """
+        Perform graph temperature scaling on logits
+        """
+        temperature = self.cagat(logits, g, nid).view(logits.size(0), -1)
+        return temperature.expand(logits.size(0), logits.size(1))
+
+    def fit(self, g, features, labels, masks):
+        self.to(self.device)
+        def eval(logits):
+            temperature = self.graph_temperature_scale(logits)
+            calibrated = logits / temperature
+            return calibrated
+
+        self.train_param = self.cagat.parameters()
+        self.optimizer = optim.Adam(self.train_param, lr=self.conf.calibration["cal_lr"], weight_decay=self.conf.calibration["cal_weight_decay"])
+        fit_calibration(self, eval, g, features, labels, masks, self.conf.calibration["epochs"], self.conf.calibration["patience"])
+        return self
\ No newline at end of file
@@ -1,9 +1,65 @@
 import dgl.nn as dglnn
+import dgl.function as fn
+import torch
+from dataset.features import chunked_matmul
 
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+def gcn_aggregate(g, h, norm='both'):
+    """
+    Message passing of dglnn.GraphConv without the weight: h can have any trailing shape [N, *].
+    The weight commutes with the degree normalisation, so callers may apply it before or after.
+    """
+    with g.local_scope():
+        if norm in ['left', 'both']:
+            degs = g.out_degrees().to(h).clamp(min=1)
+            src_norm = degs.pow(-0.5) if norm == 'both' else 1.0 / degs
+            h = h * src_norm.view(-1, *([1] * (h.dim() - 1)))
+        g.srcdata['h'] = h
+        g.update_all(fn.copy_u('h', 'm'), fn.sum('m', 'h'))
+        rst = g.dstdata['h']
+        if norm in ['right', 'both']:
+            degs = g.in_degrees().to(rst).clamp(min=1)
+            dst_norm = degs.pow(-0.5) if norm == 'both' else 1.0 / degs
+            rst = rst * dst_norm.view(-1, *([1] * (rst.dim() - 1)))
+    return rst
+
+
+def conv(layer, g, h):
+    """
+    layer(g, h). Out-of-core features (dataset/features.py) are first multiplied by the layer weight
+    in row chunks, then aggregated: the weight commutes with the GraphConv normalisation and with
+    the GINConv mean, so the result is the same without the [N, F] matrix in memory.
+    """
+    if isinstance(h, torch.Tensor):
+        return layer(g, h)
+    if isinstance(layer, dglnn.GraphConv):
+        rst = gcn_aggregate(g, chunked_matmul(h, layer.weight))
+        return rst + layer.bias if layer.bias is not None else rst
+    if isinstance(layer, dglnn.GINConv) and len(layer.apply_func) == 1 and isinstance(layer.apply_func[0], nn.Linear):
+        linear = layer.apply_func[0]
+        h = chunked_matmul(h, linear.weight.t())
+        with g.local_scope():
+            g.srcdata['h'] = h
+            g.update_all(fn.copy_u('h', 'm'), fn.mean('m', 'neigh'))
+            rst = (1 + layer.eps) * h + g.dstdata['neigh']
+        return rst + linear.bias
+    raise NotImplementedError(f"{type(layer).__name__} does not support out-of-core features")
+
+
+def full_precision(layer, g, h):
+    """
+    DGL's attention kernels need node and edge features of one dtype, which autocast breaks
+    (low precision projections, fp32 attention scores), so attention layers always run in fp32
+    """
+    if not isinstance(h, torch.Tensor):
+        raise NotImplementedError(f"{type(layer).__name__} does not support out-of-core features")
+    with torch.autocast(device_type=h.device.type, enabled=False):
+        return layer(g, h.float())
+
+
 def load_gnn(conf):
     if conf.gnn["type"] == "gcn":
         return GCN(
@@ -61,7 +117,7 @@ class GCN(nn.Module):
     def forward(self, g, features):
         h = features
         for i, layer in enumerate(self.layers):
-            h = layer(g, h)
+            h = conv(layer, g, h)
             if i < len(self.layers) - 1:
                 if self.norm:
                     h = self.norms[i](h)
@@ -100,7 +156,7 @@ class GAT(nn.Module):
     def forward(self, g, features):
         h = features
         for i, layer in enumerate(self.layers):
-            h = layer(g, h)
+            h = full_precision(layer, g, h)
             if i < len(self.layers) - 1:
                 if self.norm:
                     h = self.norms[i](h)
@@ -151,7 +207,7 @@ class GIN(nn.Module):
     def forward(self, g, features):
         h = features
         for i, layer in enumerate(self.layers):
-            h = layer(g, h)
+            h = conv(layer, g, h)
             if i < len(self.layers) - 1:
                 if self.norm:
                     h = self.norms[i](h)
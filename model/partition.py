@@ -0,0 +1,197 @@
+import torch
+import torch.nn.functional as F
+import torch.distributed as dist
+import dgl
+import dgl.nn as dglnn
+from model.gnns import GAT, full_precision
+
+# Partition-parallel full-graph training of the base GNNs over torch.distributed.
+# The nodes are split into one partition per rank (METIS by default). A rank owns the features of
+# its nodes and keeps a block of the in-edges of its nodes, whose sources are its own nodes plus the
+# halo: the nodes of other partitions with an edge into it. Before every layer the ranks exchange
+# the embeddings of their boundary nodes point-to-point (gloo has no all-to-all), and the backward
+# pass sends the halo gradients back to the owners, so every step equals a full-graph step.
+# GraphConv degree normalisation and BatchNorm statistics are those of the full graph.
+
+METHODS = ["metis", "random"]
+
+
+def assign_partitions(g, num_parts, method="metis", seed=0):
+    """
+    Partition id of every node. METIS is not deterministic across processes, Partition broadcasts
+    the assignment of rank 0.
+    """
+    if num_parts == 1:
+        return torch.zeros(g.num_nodes(), dtype=torch.int64)
+    if method == "metis":
+        # METIS minimizes the edge cut, hence the halo, and balances the partition sizes
+        return dgl.metis_partition_assignment(g.cpu().long(), num_parts).long()
+    if method == "random":
+        generator = torch.Generator().manual_seed(seed)
+        return torch.randint(0, num_parts, (g.num_nodes(),), generator=generator)
+    raise ValueError(f"Unknown partition method {method}, choose from {METHODS}")
+
+
+def _p2p(outgoing, incoming, like):
+    """
+    Send outgoing[q] to every rank q and receive a [incoming[q], *] tensor from it, in one round
+    of non-blocking sends and receives. Communication goes through CPU tensors for gloo.
+    """
+    rank = dist.get_rank()
+    received = [torch.empty((count,) + like.shape[1:], dtype=like.dtype) for count in incoming]
+    # the send buffers must stay alive until the requests complete
+    sent = [t.detach().cpu().contiguous() for t in outgoing]
+    requests = []
+    for q in range(dist.get_world_size()):
+        if q == rank:
+            continue
+        if len(sent[q]) > 0:
+            requests.append(dist.isend(sent[q], q))
+        if incoming[q] > 0:
+            requests.append(dist.irecv(received[q], q))
+    for request in requests:
+        request.wait()
+    return [r.to(like.device) for r in received]
+
+
+class HaloExchange(torch.autograd.Function):
+    """
+    Embeddings of the owned nodes [n_owned, *] -> embeddings of the halo nodes [n_halo, *]
+    """
+    @staticmethod
+    def forward(ctx, h, partition):
+        ctx.partition = partition
+        ctx.num_owned = h.shape[0]
+        received = _p2p([h[idx] for idx in partition.send], partition.recv, h)
+        return torch.cat(received)
+
+    @staticmethod
+    def backward(ctx, grad):
+        partition = ctx.partition
+        received = _p2p(list(grad.split(partition.recv)), [len(idx) for idx in partition.send], grad)
+        grad_h = grad.new_zeros((ctx.num_owned,) + grad.shape[1:])
+        for idx, g in zip(partition.send, received):
+            grad_h.index_add_(0, idx, g)
+        return grad_h, None
+
+
+class _AllReduceSum(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x):
+        x = x.clone()
+        dist.all_reduce(x)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad):
+        grad = grad.clone()
+        dist.all_reduce(grad)
+        return grad
+
+
+def sync_batch_norm(norm, h):
+    """
+    nn.BatchNorm1d over the nodes of all partitions: the batch statistics and the running
+    statistics are the ones of the full graph
+    """
+    if not norm.training:
+        return F.batch_norm(h, norm.running_mean, norm.running_var, norm.weight, norm.bias, False, 0.0, norm.eps)
+    h = h.float()
+    n = torch.tensor(float(h.shape[0]))
+    dist.all_reduce(n)
+    stats = _AllReduceSum.apply(torch.cat([h.sum(0), (h * h).sum(0)]))
+    mean, sq_mean = stats.split(h.shape[1])
+    mean, var = mean / n.item(), sq_mean / n.item() - (mean / n.item()) ** 2
+    with torch.no_grad():
+        norm.num_batches_tracked += 1
+        momentum = norm.momentum if norm.momentum is not None else 1.0 / norm.num_batches_tracked.item()
+        norm.running_mean.mul_(1 - momentum).add_(mean.detach(), alpha=momentum)
+        norm.running_var.mul_(1 - momentum).add_(var.detach() * n / (n - 1), alpha=momentum)
+    return (h - mean) * torch.rsqrt(var + norm.eps) * norm.weight + norm.bias
+
+
+class Partition:
+    """
+    This rank's part of the graph: owned node ids, halo node ids, the block of in-edges of the owned
+    nodes (sources: owned then halo nodes) and the owned and halo input features.
+    send[q]: positions (in owned) of the nodes rank q needs; recv[q]: halo nodes owned by rank q.
+    """
+    def __init__(self, g, features, method="metis"):
+        rank, num_parts = dist.get_rank(), dist.get_world_size()
+        assignment = assign_partitions(g, num_parts, method) if rank == 0 else torch.empty(g.num_nodes(), dtype=torch.int64)
+        dist.broadcast(assignment, 0)
+        assignment = assignment.to(g.device)
+        src, dst = g.edges()
+        src, dst = src.long(), dst.long()
+        self.parts = [(assignment == q).nonzero().squeeze(1) for q in range(num_parts)]
+        self.owned = self.parts[rank]
+        local = torch.full((g.num_nodes(),), -1, dtype=torch.int64, device=g.device)
+        local[self.owned] = torch.arange(len(self.owned), device=g.device)
+
+        # (node, partition that needs it) over the cut edges, sorted by node id
+        cut = assignment[src] != assignment[dst]
+        pairs = torch.unique(src[cut] * num_parts + assignment[dst[cut]])
+        nodes, needers = pairs // num_parts, pairs % num_parts
+        owners = assignment[nodes]
+        self.send = [local[nodes[(owners == rank) & (needers == q)]] for q in range(num_parts)]
+        # halo nodes grouped by owner, in the node order every owner sends them in
+        mine = needers == rank
+        order = torch.sort(owners[mine], stable=True).indices
+        self.halo = nodes[mine][order]
+        self.recv = [int((owners[mine] == q).sum()) for q in range(num_parts)]
+        local[self.halo] = len(self.owned) + torch.arange(len(self.halo), device=g.device)
+
+        inner = assignment[dst] == rank
+        self.block = dgl.create_block((local[src[inner]], local[dst[inner]]), num_src_nodes=len(self.owned) + len(self.halo),
+                                      num_dst_nodes=len(self.owned), idtype=g.idtype, device=g.device)
+        # GraphConv normalises the sources by their out-degree in the block, rescale the messages
+        # to the out-degree in the full graph
+        full_out = g.out_degrees().float()[torch.cat([self.owned, self.halo])]
+        ratio = self.block.out_degrees().float() / full_out.clamp(min=1)
+        self.edge_weight = ratio.sqrt()[self.block.edges()[0].long()]
+        self.features = torch.cat([features[self.owned], HaloExchange.apply(features[self.owned], self)])
+
+    def local(self, idx):
+        """
+        Positions of the owned nodes among idx, and those nodes' ids
+        """
+        positions = torch.isin(self.owned, torch.as_tensor(idx, device=self.owned.device)).nonzero().squeeze(1)
+        return positions, self.owned[positions]
+
+    def gather(self, h, num_nodes):
+        """
+        Rows of all partitions [num_nodes, *] from this rank's owned rows, on every rank
+        """
+        size = max(len(part) for part in self.parts)
+        padded = h.new_zeros((size,) + h.shape[1:]).cpu()
+        padded[:len(h)] = h.detach().cpu()
+        gathered = [torch.empty_like(padded) for _ in self.parts]
+        dist.all_gather(gathered, padded)
+        out = h.new_empty((num_nodes,) + h.shape[1:])
+        for part, rows in zip(self.parts, gathered):
+            out[part] = rows[:len(part)].to(h.device)
+        return out
+
+
+def partitioned_forward(model, partition):
+    """
+    model (gnns.GCN / GAT / GIN) on this rank's partition, returns the logits of the owned nodes
+    """
+    h = partition.features
+    for i, layer in enumerate(model.layers):
+        if i > 0:
+            h = torch.cat([h, HaloExchange.apply(h, partition)])
+        if isinstance(layer, dglnn.GraphConv):
+            h = layer(partition.block, h, edge_weight=partition.edge_weight)
+        elif isinstance(layer, dglnn.GATConv):
+            h = full_precision(layer, partition.block, h)
+        else:
+            h = layer(partition.block, h)
+        if i < len(model.layers) - 1:
+            if model.norm:
+                h = sync_batch_norm(model.norms[i], h)
+            h = F.relu(h)
+            h = model.dropout(h)
+    if isinstance(model, GAT):
+        h = model.final_project(h.view(h.size(0), -1))
+    return h
@@ -0,0 +1,77 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch import optim
+from model.GETS import GCN_GETS, GAT_GETS, GIN_GETS
+
+# Post-fit slimming of a GETS calibrator: drop the experts the gate hardly routes to, and
+# optionally distill the remaining mixture into one expert that sees the union of their inputs.
+
+EXPERTS = {
+    'gcn': GCN_GETS,
+    'gat': GAT_GETS,
+    'gin': GIN_GETS,
+}
+INPUTS = ['logits', 'features', 'degrees']
+
+
+@torch.no_grad()
+def expert_load(calibrator, g, features):
+    """
+    Share of the total gate mass every expert receives over all nodes, without gating noise
+    """
+    calibrator.eval()
+    _, _, node_gates = calibrator(g, features)
+    importance = calibrator.learner.expert_importance(*node_gates)
+    return importance / importance.sum()
+
+
+def prune_gets(calibrator, g, features, threshold):
+    """
+    Remove the experts whose load is below threshold (at least the most loaded one is kept).
+    Returns the load of the experts before pruning and the indices of the kept ones.
+    """
+    load = expert_load(calibrator, g, features)
+    keep = [i for i, share in enumerate(load.tolist()) if share >= threshold]
+    if not keep:
+        keep = [int(load.argmax())]
+    calibrator.learner.prune_experts(keep)
+    return load, keep
+
+
+def distill_gets(calibrator, g, features, epochs, lr, hidden_dim=None):
+    """
+    Replace the experts of a fitted GETS calibrator by a single expert trained to reproduce the
+    mixture's temperatures on all nodes (MSE, no labels needed). Returns the final distillation loss.
+    """
+    learner = calibrator.learner
+    conf = calibrator.conf.calibration
+    calibrator.eval()
+    with torch.no_grad():
+        logits = calibrator.model(g, features)
+        target, _, _ = learner.temperature(g, logits, features)
+    student = EXPERTS[conf['backbone']](
+        num_classes=logits.shape[1],
+        hidden_dim=hidden_dim or conf['hidden_dim'],
+        dropout_rate=conf['cal_dropout'],
+        num_layers=conf['cal_num_layer'],
+        device=calibrator.device,
+        expert_config=[name for name in INPUTS if any(name in expert.expert_config for expert in learner.experts)],
+        feature_dim=features.shape[1],
+        feature_hidden_dim=conf['feature_hidden_dim'],
+        degree_hidden_dim=conf['degree_hidden_dim'],
+        # starts from the mixture's degree embedding
+        degree_encoder=learner.degree_encoder,
+    ).to(calibrator.device)
+    optimizer = optim.Adam(student.parameters(), lr=lr)
+    for epoch in range(epochs):
+        student.train()
+        optimizer.zero_grad()
+        loss = F.mse_loss(student(g, logits, features), target)
+        loss.backward()
+        optimizer.step()
+    learner.experts = nn.ModuleList([student])
+    learner.prune_experts([0])
+    # the student is none of the configured experts
+    learner.expert_ids = None
+    return loss.item()
@@ -0,0 +1,58 @@
+import copy
+import torch
+import torch.nn as nn
+import dgl.nn as dglnn
+from model.gnns import gcn_aggregate
+
+# Post-training dynamic int8 quantization of a fitted GETS calibrator for CPU inference.
+# nn.Linear layers (proj_feature, final_proj, the GIN MLPs, GATConv's fc) become dynamically
+# quantized Linear modules; GraphConv keeps its sparse aggregation in fp32 and only its dense
+# weight is quantized. The gating weights stay fp32 since they decide the top-k expert routing.
+
+
+class QuantizableGraphConv(nn.Module):
+    """
+    dglnn.GraphConv with the weight held by an nn.Linear, so quantize_dynamic can replace it
+    """
+    def __init__(self, conv):
+        super().__init__()
+        self.linear = nn.Linear(conv._in_feats, conv._out_feats, bias=False)
+        self.linear.weight.data.copy_(conv.weight.detach().t())
+        self.bias = nn.Parameter(conv.bias.detach().clone())
+        self.norm = conv._norm
+        self.in_feats = conv._in_feats
+        self.out_feats = conv._out_feats
+
+    def forward(self, g, h):
+        # Same order as dglnn.GraphConv: aggregate on the narrower side of the weight
+        if self.in_feats > self.out_feats:
+            rst = gcn_aggregate(g, self.linear(h), self.norm)
+        else:
+            rst = self.linear(gcn_aggregate(g, h, self.norm))
+        return rst + self.bias
+
+
+def _replace_graph_convs(module):
+    for name, child in module.named_children():
+        if isinstance(child, dglnn.GraphConv):
+            setattr(module, name, QuantizableGraphConv(child))
+        else:
+            _replace_graph_convs(child)
+
+
+def quantize_gets(calibrator):
+    """
+    Copy of a fitted CaGCN_GETS with its GETS learner quantized to dynamic int8, on the CPU
+    (PyTorch only has CPU kernels for dynamically quantized layers). The base model is kept as is.
+    """
+    # the training state (optimizer, parameter generator) is not copied and the base model is shared
+    memo = {id(getattr(calibrator, name)): None for name in ['optimizer', 'train_param'] if hasattr(calibrator, name)}
+    if torch.device(calibrator.device).type == 'cpu':
+        memo[id(calibrator.model)] = calibrator.model
+    quantized = copy.deepcopy(calibrator, memo).cpu().eval()
+    quantized.device = torch.device('cpu')
+    for expert in quantized.learner.experts:
+        expert.device = torch.device('cpu')
+    _replace_graph_convs(quantized.learner)
+    quantized.learner = torch.ao.quantization.quantize_dynamic(quantized.learner, {nn.Linear}, dtype=torch.qint8)
+    return quantized
@@ -0,0 +1,23 @@
+import argparse
+from utils.report import plot_results, write_summary, serve
+
+# Regenerate the plots and the summary of stored results without rerunning the experiment, e.g.
+#   python report.py output/GETS/cora --prefix gcn_ --store output/results.db --dataset cora --calibrator GETS
+# With --serve it is the background reporting process started by Logger.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root_dir", type=str, nargs="?", help="Result directory <output>/<calibrator>/<dataset>")
+    parser.add_argument("--prefix", type=str, default="", help="File prefix, the backbone for GETS (e.g. gcn_)")
+    parser.add_argument("--store", type=str, default=None, help="Also write the summary of this result store")
+    parser.add_argument("--dataset", type=str, default=None)
+    parser.add_argument("--calibrator", type=str, default=None)
+    parser.add_argument("--serve", action="store_true", help="Run the jobs read from stdin")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+    else:
+        plot_results(args.root_dir, args.prefix)
+        if args.store:
+            write_summary(args.store, args.root_dir, args.prefix, dataset=args.dataset, calibrator=args.calibrator)
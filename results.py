@@ -0,0 +1,31 @@
+import argparse
+from utils.store import ResultStore, format_groups, METRICS
+
+# Query the append-only result store written by main.py and sweep.py, e.g.
+#   python results.py --db sweep/results.db --dataset cora --calibrator GETS TS
+#   python results.py --db output/results.db --by dataset calibrator --where "calibrated_ece < 5"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", type=str, default="output/results.db")
+    parser.add_argument("--dataset", type=str, nargs="+", default=None)
+    parser.add_argument("--calibrator", type=str, nargs="+", default=None)
+    parser.add_argument("--backbone", type=str, nargs="+", default=None)
+    parser.add_argument("--config_hash", type=str, nargs="+", default=None)
+    parser.add_argument("--seed", type=int, nargs="+", default=None)
+    parser.add_argument("--where", type=str, default=None, help="Extra SQL condition on the runs table")
+    parser.add_argument("--by", type=str, nargs="+", default=["dataset", "calibrator", "backbone", "config_hash"])
+    parser.add_argument("--metrics", type=str, nargs="+", default=["uncalibrated_acc", "uncalibrated_ece", "calibrated_acc", "calibrated_ece"], choices=METRICS)
+    parser.add_argument("--rows", action="store_true", help="Print the matching runs instead of aggregates")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    filters = dict(dataset=args.dataset, calibrator=args.calibrator, backbone=args.backbone, config_hash=args.config_hash, seed=args.seed)
+    if args.rows:
+        columns = args.by + args.metrics
+        print("  ".join(f"{c:>16s}" for c in columns))
+        for row in store.query(where=args.where, **filters):
+            print("  ".join(f"{row[c]:>16.2f}" if isinstance(row[c], float) else f"{str(row[c]):>16s}" for c in columns))
+    else:
+        print(format_groups(store.aggregate(by=args.by, metrics=args.metrics, where=args.where, **filters), args.metrics))
+    store.close()
@@ -1,61 +1,18 @@
 #!/bin/bash
 
-calibration_methods=("GETS" "VS" "TS" "ETS" "CaGCN" "GATS")
-
-yaml_directory="./config"
-log_directory="./log"
-
-mkdir -p "$log_directory"
-
-yaml_files=("citeseer.yaml" "computers.yaml" "cora-full.yaml" "cora.yaml" "cs.yaml" 
-            "ogbn-arxiv.yaml" "photo.yaml" "physics.yaml" "pubmed.yaml" "reddit.yaml")
-
-if ! command -v ~/yq &> /dev/null
-then
-    echo "Error: yq is not installed. Please install yq (https://mikefarah.gitbook.io/yq/) or choose any other methods that could automatically replace values in yaml files in your machine."
-    exit 1
-fi
-
-run_script() {
-  local yaml_file="$1"
-  local method="$2"
-  local gpu_id="$3"
-
-  dataset_name=$(basename "$yaml_file" .yaml)
-
-  ~/yq eval ".calibration.calibrator_name = \"$method\"" -i "$yaml_directory/$yaml_file"
+# Every (dataset, method, seed) combination runs as its own job of sweep.py. Configuration
+# changes are passed to main.py as overrides, so the files in ./config are never rewritten.
+# Logs are stored in ./sweep/logs, results in ./sweep/jobs and the summary in ./sweep/summary.csv.
+# Finished jobs are skipped when the sweep is run again.
 
-  log_file="$log_directory/${dataset_name}_${method}.txt"
-
-  echo "Running: python main.py --dataset=$dataset_name --gpu=$gpu_id --n_runs=10 with $method on GPU $gpu_id"
-  CUDA_VISIBLE_DEVICES=$gpu_id python main.py --dataset="$dataset_name" --gpu="$gpu_id" --n_runs=10 > "$log_file" 2>&1
-}
-
-process_dataset() {
-  local yaml_file="$1"
-  local gpu_id="$2"
-
-  for method in "${calibration_methods[@]}"
-  do
-    run_script "$yaml_file" "$method" "$gpu_id"
-  done
-}
-
-gpu_id=0
-job_count=0
-
-for yaml_file in "${yaml_files[@]}"
-do
-  process_dataset "$yaml_file" "$gpu_id" &
-
-  gpu_id=$(( (gpu_id + 1) % 10 ))
-
-  job_count=$((job_count + 1))
+calibration_methods=("GETS" "VS" "TS" "ETS" "CaGCN" "GATS")
 
-  if [ "$job_count" -ge 10 ]; then
-    wait
-    job_count=0
-  fi
-done
+datasets=("citeseer" "computers" "cora-full" "cora" "cs"
+          "ogbn-arxiv" "photo" "physics" "pubmed" "reddit")
 
-wait
\ No newline at end of file
+python sweep.py \
+  --datasets "${datasets[@]}" \
+  --calibrators "${calibration_methods[@]}" \
+  --seeds 0 1 2 3 4 5 6 7 8 9 \
+  --sweep_dir ./sweep \
+  "$@"
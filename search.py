@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+from utils.utils import load_conf, set_seed, parse_overrides
+from dataset.dataset import Dataset
+from exp.solver import Solver
+from exp.search import CalibrationSearch
+
+search_space = {
+    "hidden_dim": {"_type": "choice", "_value": [16, 32, 64]},
+    "coef": {"_type": "choice", "_value": [0.1, 0.5, 1.0, 2.0]},
+}
+
+
+if __name__ == "__main__":
+    os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
+    set_seed(3407)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, default="photo")
+    parser.add_argument("--space", type=str, default=None, help="Search space in the NNI json format, defaults to the space of automl.py")
+    parser.add_argument("--algo", type=str, default="tpe", choices=["tpe", "random"])
+    parser.add_argument("--n_trials", type=int, default=100, help="Number of sampled configurations")
+    parser.add_argument("--n_splits", type=int, default=10, help="Splits every configuration is scored on")
+    parser.add_argument("--n_workers", type=int, default=1)
+    parser.add_argument("--min_epochs", type=int, default=None, help="Smallest successive halving budget in calibration epochs, defaults to no halving")
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--holdout", type=float, default=0.5, help="Share of the calibration nodes trials are scored on, they are fit on the rest")
+    parser.add_argument("--output", type=str, default="search")
+    parser.add_argument("--override", type=str, action="append", default=[], help="Configuration override, e.g. --override calibration.calibrator_name=GETS")
+    args = parser.parse_args()
+
+    space = search_space
+    if args.space is not None:
+        with open(args.space) as f:
+            space = json.load(f)
+
+    conf = load_conf(dataset=args.dataset, overrides=parse_overrides(args.override))
+    dataset = Dataset(ds_name=args.dataset, n_runs=args.n_splits)
+    solver = Solver(conf, dataset)
+    split_seeds = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    search = CalibrationSearch(
+        solver,
+        space,
+        splits=list(range(args.n_splits)),
+        seeds=split_seeds[:args.n_splits],
+        algo=args.algo,
+        n_workers=args.n_workers,
+        eta=args.eta,
+        min_epochs=args.min_epochs,
+        holdout=args.holdout,
+        output=args.output
+    )
+    search.prepare()
+    best = search.run(args.n_trials)
+    print(f"Best configuration: {best['params']} | score {best['score']:.3f} | test score {best['test_score']:.3f}")
@@ -0,0 +1,35 @@
+import argparse
+import asyncio
+import os
+import torch
+from utils.serving import load_graph, load_model, SubgraphInference, MicroBatcher, ServingStats, Server
+
+# Calibrated inference server for a run saved with main.py --save_models DIR, e.g.
+#   python serve.py --model DIR/run0.pt --socket /tmp/gets.sock
+#   curl --unix-socket /tmp/gets.sock -d '{"nodes": [0, 5, 42]}' http://localhost/predict
+#   curl --unix-socket /tmp/gets.sock http://localhost/metrics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="Saved calibrator, <save_models>/run<id>.pt")
+    parser.add_argument("--graph", type=str, default=None, help="Directory of graph.bin and features.npy, defaults to the model's")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--socket", type=str, default=None, help="Listen on this Unix socket instead of host:port")
+    parser.add_argument("--max_batch_nodes", type=int, default=1024, help="Nodes per micro-batch")
+    parser.add_argument("--max_wait_ms", type=float, default=2.0, help="How long a batch waits for more requests")
+    parser.add_argument("--feature_cache_mb", type=int, default=1024, help="Page cache of the memory-mapped features")
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads, defaults to torch's")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    g, features = load_graph(args.graph or os.path.dirname(os.path.abspath(args.model)), args.device, args.feature_cache_mb)
+    calibrator = load_model(args.model, args.device)
+    infer = SubgraphInference(calibrator, g, features, args.device)
+    batcher = MicroBatcher(infer, args.max_batch_nodes, args.max_wait_ms, ServingStats())
+    server = Server(batcher, g.num_nodes())
+    address = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving {type(calibrator).__name__} on {g.num_nodes()} nodes ({infer.hops}-hop receptive fields) at {address}", flush=True)
+    asyncio.run(server.serve(args.host, args.port, args.socket))
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from utils.utils import conf_path, parse_overrides
+
+DATASETS = ["citeseer", "computers", "cora-full", "cora", "cs", "ogbn-arxiv", "photo", "physics", "pubmed", "reddit"]
+CALIBRATORS = ["GETS", "VS", "TS", "ETS", "CaGCN", "GATS"]
+METRICS = ["uncalibrated_acc", "uncalibrated_diff", "calibrated_acc", "calibrated_diff"]
+
+
+def make_jobs(datasets, calibrators, seeds, overrides):
+    jobs = []
+    for dataset in datasets:
+        for calibrator in calibrators:
+            for seed in seeds:
+                job_overrides = dict(overrides)
+                job_overrides["calibration.calibrator_name"] = calibrator
+                jobs.append({
+                    "name": f"{dataset}_{calibrator}_{seed}",
+                    "dataset": dataset,
+                    "calibrator": calibrator,
+                    "seed": seed,
+                    "overrides": job_overrides,
+                })
+    return jobs
+
+
+def job_hash(job):
+    """
+    Hash of the job and of the configuration files it reads, a finished job is only
+    skipped when neither changed
+    """
+    digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode())
+    for path in sorted({conf_path(job["dataset"]), conf_path(job["dataset"], job["calibrator"])}):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def job_command(job, job_dir, store):
+    command = [sys.executable, "main.py",
+               f"--dataset={job['dataset']}",
+               "--n_runs=1",
+               f"--run_ids={job['seed']}",
+               f"--output={job_dir}",
+               f"--store={store}"]
+    for key, value in job["overrides"].items():
+        command.append(f"--override={key}={json.dumps(value)}")
+    return command
+
+
+def read_metrics(job_dir):
+    paths = glob.glob(os.path.join(job_dir, "*", "*", "*metrics.json"))
+    if not paths:
+        return None
+    with open(paths[0]) as f:
+        return json.load(f)["runs"][0]
+
+
+def is_complete(job_dir, digest):
+    spec_path = os.path.join(job_dir, "job.json")
+    if not os.path.exists(spec_path):
+        return False
+    with open(spec_path) as f:
+        spec = json.load(f)
+    return spec.get("hash") == digest and spec.get("returncode") == 0 and read_metrics(job_dir) is not None
+
+
+def run_job(job, sweep_dir, threads, gpu_slots):
+    job_dir = os.path.join(sweep_dir, "jobs", job["name"])
+    log_path = os.path.join(sweep_dir, "logs", f"{job['name']}.txt")
+    digest = job_hash(job)
+    if is_complete(job_dir, digest):
+        return dict(job, status="skipped", returncode=0, elapsed=0.0, **(read_metrics(job_dir) or {}))
+
+    os.makedirs(job_dir, exist_ok=True)
+    command = job_command(job, job_dir, os.path.join(sweep_dir, "results.db"))
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+    gpu = gpu_slots.get() if gpu_slots is not None else None
+    if gpu is not None:
+        env["CUDA_VISIBLE_DEVICES"] = str(gpu)
+    start = time.time()
+    try:
+        with open(log_path, "w") as log:
+            log.write(" ".join(command) + "\n")
+            log.flush()
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env).returncode
+    finally:
+        if gpu is not None:
+            gpu_slots.put(gpu)
+    elapsed = time.time() - start
+    with open(os.path.join(job_dir, "job.json"), "w") as f:
+        json.dump(dict(job, hash=digest, command=command, returncode=returncode, elapsed=elapsed), f, indent=2)
+    metrics = read_metrics(job_dir) if returncode == 0 else None
+    status = "done" if metrics is not None else "failed"
+    return dict(job, status=status, returncode=returncode, elapsed=elapsed, **(metrics or {}))
+
+
+def num_workers(n_jobs, workers, threads, mem_per_job, gpus, jobs_per_gpu):
+    """
+    Concurrency from the cores (threads per job), the available memory (mem_per_job GB each)
+    and, when GPUs are given, jobs_per_gpu jobs per GPU. workers > 0 caps the result.
+    """
+    limit = max(1, (os.cpu_count() or 1) // threads)
+    try:
+        import psutil
+        limit = min(limit, max(1, int(psutil.virtual_memory().available // (mem_per_job * 1024 ** 3))))
+    except ImportError:
+        pass
+    if gpus:
+        limit = min(limit, len(gpus) * jobs_per_gpu)
+    if workers > 0:
+        limit = min(limit, workers)
+    return max(1, min(limit, n_jobs))
+
+
+def write_summary(sweep_dir, rows):
+    columns = ["dataset", "calibrator", "seed", "status", "returncode", "elapsed"] + METRICS
+    with open(os.path.join(sweep_dir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for row in sorted(rows, key=lambda r: (r["dataset"], r["calibrator"], r["seed"])):
+            writer.writerow(row)
+
+    groups = {}
+    for row in rows:
+        if row["status"] in ["done", "skipped"]:
+            groups.setdefault((row["dataset"], row["calibrator"]), []).append(row)
+    summary = []
+    print(f"{'dataset':<12s} {'calibrator':<10s} {'runs':>4s} " + " ".join(f"{m:>22s}" for m in METRICS))
+    for (dataset, calibrator), group in sorted(groups.items()):
+        entry = {"dataset": dataset, "calibrator": calibrator, "runs": len(group)}
+        cells = []
+        for metric in METRICS:
+            values = np.array([r[metric] for r in group])
+            # sample std, as print_statistics and ResultStore.aggregate report it
+            std = values.std(ddof=1) if len(values) > 1 else float("nan")
+            entry[metric] = {"mean": float(values.mean()), "std": float(std)}
+            cells.append(f"{values.mean():>13.2f} ± {std:>6.2f}")
+        summary.append(entry)
+        print(f"{dataset:<12s} {calibrator:<10s} {len(group):>4d} " + " ".join(cells))
+    with open(os.path.join(sweep_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datasets", type=str, nargs="+", default=DATASETS)
+    parser.add_argument("--calibrators", type=str, nargs="+", default=CALIBRATORS)
+    parser.add_argument("--seeds", type=int, nargs="+", default=list(range(10)), help="Split/seed indices, one job each")
+    parser.add_argument("--override", type=str, action="append", default=[], help="Override for every job, e.g. --override train.epochs=100")
+    parser.add_argument("--sweep_dir", type=str, default="sweep")
+    parser.add_argument("--workers", type=int, default=0, help="Maximum concurrent jobs, 0 sizes it to cores, memory and GPUs")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads per job")
+    parser.add_argument("--mem_per_job", type=float, default=4.0, help="Expected peak memory per job in GB")
+    parser.add_argument("--gpus", type=int, nargs="*", default=None, help="GPU ids to spread the jobs over")
+    parser.add_argument("--jobs_per_gpu", type=int, default=1)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.datasets, args.calibrators, args.seeds, parse_overrides(args.override))
+    os.makedirs(os.path.join(args.sweep_dir, "logs"), exist_ok=True)
+    os.makedirs(os.path.join(args.sweep_dir, "jobs"), exist_ok=True)
+
+    workers = num_workers(len(jobs), args.workers, args.threads, args.mem_per_job, args.gpus, args.jobs_per_gpu)
+    gpu_slots = None
+    if args.gpus:
+        gpu_slots = queue.Queue()
+        for _ in range(args.jobs_per_gpu):
+            for gpu in args.gpus:
+                gpu_slots.put(gpu)
+    print(f"{len(jobs)} jobs on {workers} workers")
+
+    rows = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_job, job, args.sweep_dir, args.threads, gpu_slots) for job in jobs]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(jobs)}] {row['name']}: {row['status']} ({row['elapsed']:.1f}s)")
+    write_summary(args.sweep_dir, rows)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import torch
+
+
+class Checkpoint:
+    """
+    Best-so-far snapshot of a module for early stopping.
+    The shadow buffers are allocated once, on the first save, and every later save/restore is an
+    in-place copy_ of the module's parameters and buffers, so improvements do not allocate.
+
+    exclude: top-level submodule names left out of the snapshot (e.g. the frozen base "model" of a calibrator).
+    buffers: also snapshot the module's buffers, not only its parameters.
+    spill_dir: keep the shadow buffers in a file-backed (memory-mapped) tensor under this directory
+    instead of in memory next to the model, for models too large to hold twice on the device.
+    """
+    def __init__(self, module, exclude=(), buffers=True, spill_dir=None):
+        self.module = module
+        self.buffers = buffers
+        self.exclude = set(exclude)
+        self.spill_dir = spill_dir
+        self.shadow = None
+        self.spill_path = None
+
+    def _tensors(self):
+        tensors = dict(self.module.named_parameters())
+        if self.buffers:
+            tensors.update(self.module.named_buffers())
+        return {k: v for k, v in tensors.items() if k.split(".")[0] not in self.exclude}
+
+    def _allocate(self, tensors):
+        if self.spill_dir is None:
+            return {k: torch.empty_like(v, memory_format=torch.contiguous_format) for k, v in tensors.items()}
+        # one byte file holding every tensor, offsets aligned to 8 bytes so each slice can be viewed as its dtype
+        offsets, total = {}, 0
+        for k, v in tensors.items():
+            offsets[k] = total
+            total += (v.numel() * v.element_size() + 7) // 8 * 8
+        os.makedirs(self.spill_dir, exist_ok=True)
+        fd, self.spill_path = tempfile.mkstemp(suffix=".ckpt", dir=self.spill_dir)
+        os.close(fd)
+        flat = torch.from_file(self.spill_path, shared=True, size=max(total, 1), dtype=torch.uint8)
+        return {
+            k: flat[offsets[k]:offsets[k] + v.numel() * v.element_size()].view(v.dtype).view(v.shape)
+            for k, v in tensors.items()
+        }
+
+    @torch.no_grad()
+    def save(self, index=None):
+        """
+        index: for modules with stacked replica parameters ([R, ...]), only snapshot replica `index`
+        """
+        tensors = self._tensors()
+        if self.shadow is None or self.shadow.keys() != tensors.keys():
+            # (re)allocate when parameters appeared since the last save, e.g. lazily built layers
+            self.close()
+            self.shadow = self._allocate(tensors)
+            if index is not None:
+                for k, v in tensors.items():
+                    self.shadow[k].copy_(v)
+        for k, v in tensors.items():
+            if index is None:
+                self.shadow[k].copy_(v)
+            else:
+                self.shadow[k][index].copy_(v[index])
+
+    @torch.no_grad()
+    def restore(self):
+        if self.shadow is None:
+            return
+        for k, v in self._tensors().items():
+            v.copy_(self.shadow[k])
+
+    def close(self):
+        self.shadow = None
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spill_path = None
@@ -0,0 +1,37 @@
+import json
+import os
+import numpy as np
+
+# Columnar result tables: a directory with one .npy file per column and a schema.json listing
+# their dtypes and shapes. Readers memory-map single columns without unpickling anything.
+
+
+def index_dtype(n):
+    """
+    Smallest unsigned integer dtype holding the values 0..n
+    """
+    return np.min_scalar_type(n)
+
+
+def write_columns(path, columns):
+    os.makedirs(path, exist_ok=True)
+    schema = {}
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values)
+        np.save(os.path.join(path, f"{name}.npy"), values)
+        schema[name] = {"dtype": values.dtype.str, "shape": list(values.shape)}
+    with open(os.path.join(path, "schema.json"), "w") as f:
+        json.dump(schema, f, indent=2)
+
+
+def read_schema(path):
+    with open(os.path.join(path, "schema.json")) as f:
+        return json.load(f)
+
+
+def read_columns(path, names=None, mmap=True):
+    """
+    names: columns to read, all by default. With mmap the arrays are read-only memory maps.
+    """
+    names = names or list(read_schema(path))
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None) for name in names}
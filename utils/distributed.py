@@ -0,0 +1,75 @@
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+# Data-parallel calibrator training over torch.distributed. Every rank holds the whole graph and
+# the frozen base model, fits the calibrator on its shard of the calibration nodes and the
+# gradients are summed over the ranks, so all ranks keep identical calibrator weights.
+# Launch one process per rank with torchrun (RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT), e.g.
+#   torchrun --nproc_per_node=4 main.py --dataset=cora --distributed
+
+
+def init_distributed(backend="gloo"):
+    """
+    Join the process group described by the environment, returns (rank, world size)
+    """
+    if not dist.is_initialized():
+        dist.init_process_group(backend)
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def shard(idx):
+    """
+    This rank's contiguous part of idx, every rank must pass the same idx
+    """
+    return np.array_split(np.asarray(idx), dist.get_world_size())[dist.get_rank()]
+
+
+def all_reduce_sum(tensor):
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def broadcast_module(module, src=0):
+    """
+    Copy the parameters and buffers of rank src to all ranks
+    """
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(tensor.data, src)
+
+
+def all_reduce_gradients(parameters):
+    """
+    Sum the gradients over the ranks in one flat all-reduce. A parameter without a gradient on
+    this rank (e.g. an expert no local node is routed to) contributes zeros, and it keeps no
+    gradient when no rank has one, as in a single-process step.
+    """
+    parameters = [p for p in parameters if p.requires_grad]
+    grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in parameters]
+    present = torch.tensor([p.grad is not None for p in parameters], dtype=torch.float32, device=grads[0].device)
+    flat = all_reduce_sum(_flatten_dense_tensors(grads + [present]))
+    *grads, present = _unflatten_dense_tensors(flat, grads + [present])
+    for p, grad, has_grad in zip(parameters, grads, present.tolist()):
+        if not has_grad:
+            p.grad = None
+        elif p.grad is None:
+            p.grad = grad
+        else:
+            p.grad.copy_(grad)
@@ -1,35 +1,27 @@
-import torch
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
+import json
+import uuid
 import numpy as np
-import warnings
+from utils.utils import in_nni_trial, conf_hash
+from utils.columns import write_columns, index_dtype
+from utils.report import plot_results, write_summary
 
 class Logger(object):
-    def __init__(self, runs, ds_name, calibrator_name, num_bin, dataset,conf):
+    def __init__(self, runs, ds_name, calibrator_name, num_bin, dataset,conf, root='output', run_ids=None, seeds=None, store=None, reporter=None):
         self.ds_name = ds_name
+        self.root = root
+        self.run_ids = run_ids if run_ids is not None else list(range(runs))
+        self.seeds = seeds if seeds is not None else self.run_ids
+        # ResultStore the runs are appended to, batch identifies this invocation in it
+        self.store = store
+        self.batch = uuid.uuid4().hex
+        # background Reporter for plots and summaries, without one they are rendered in place
+        self.reporter = reporter
         self.calibrator_name = calibrator_name
         self.num_bin = num_bin
         self.results = [{"uncalibrated": {}, "calibrated": {}} for _ in range(runs)]
         self.dataset = dataset
         self.conf = conf
-        self._setup_plot()
-
-
-    def _setup_plot(self):
-        self.figsize = (self.num_bin * 2, 12)
-        self.bar_width = 0.5
-        self.errwidth = 5
-        self.capsize = 8
-        self.confidence_color = '#AECDE1'
-        self.accuracy_color = '#BBDE93'
-        self.diff_color = '#EE9F9B'
-        self.root_dir = f'output/{self.calibrator_name}/{self.ds_name}'
-        self.font_size = 40
-        self.left_adjust = 0.12
-        self.right_adjust = 0.95
-        self.top_adjust = 0.95
-        self.bottom_adjust = 0.24
+        self.root_dir = f'{self.root}/{self.calibrator_name}/{self.ds_name}'
 
 
     def add_result(self, run, result_dict):
@@ -54,87 +46,142 @@ class Logger(object):
         self.results[run]['calibrated']['true'] = result_dict["calibrated"]["true"]
         self.results[run]['calibrated']['pred_confidence'] = result_dict["calibrated"]["pred_confidence"]
         self.results[run]['calibrated']['pred'] = result_dict["calibrated"]["pred"]
+        for key in ["fit_time", "calibration_time", "peak_memory_mb"]:
+            self.results[run][key] = result_dict.get(key)
+
+    def record(self):
+        """
+        Append every run to the result store
+        """
+        backbone = self.conf.calibration.get('backbone') if self.calibrator_name == 'GETS' else None
+        config = vars(self.conf)
+        digest = conf_hash(self.conf)
+        rows = []
+        for run_id, seed, r in zip(self.run_ids, self.seeds, self.results):
+            rows.append({
+                "batch": self.batch,
+                "dataset": self.ds_name,
+                "calibrator": self.calibrator_name,
+                "backbone": backbone,
+                "config_hash": digest,
+                "seed": seed,
+                "run": run_id,
+                "uncalibrated_acc": float(r["uncalibrated"]["acc"]),
+                "uncalibrated_ece": float(r["uncalibrated"]["diff"]),
+                "calibrated_acc": float(r["calibrated"]["acc"]),
+                "calibrated_ece": float(r["calibrated"]["diff"]),
+                "uncalibrated_gaps": (r["uncalibrated"]["degree_diff_bined_df"]["difference"].to_numpy() * 100).tolist(),
+                "calibrated_gaps": (r["calibrated"]["degree_diff_bined_df"]["difference"].to_numpy() * 100).tolist(),
+                "fit_time": r.get("fit_time"),
+                "calibration_time": r.get("calibration_time"),
+                "peak_memory_mb": r.get("peak_memory_mb"),
+                "config": json.dumps(config, sort_keys=True, default=str),
+            })
+        self.store.add(rows)
 
     def print_statistics(self):
-        accs_uncalibrated = torch.tensor([r["uncalibrated"]["acc"] for r in self.results])
-        diffs_uncalibrated = torch.tensor([r["uncalibrated"]["diff"] for r in self.results])
-        accs_calibrated = torch.tensor([r["calibrated"]["acc"] for r in self.results])
-        diffs_calibrated = torch.tensor([r["calibrated"]["diff"] for r in self.results])
+        """
+        Summary of this invocation's runs, aggregated by the result store
+        """
+        group = self.store.aggregate(by=["dataset", "calibrator", "backbone", "config_hash"], batch=self.batch)[0]
         print(f'All runs:')
-        print(f'Uncalibrated Test Accuracy: {accs_uncalibrated.mean():.2f} ± {accs_uncalibrated.std():.2f}')
-        print(f'Uncalibrated Difference: {diffs_uncalibrated.mean():.2f} ± {diffs_uncalibrated.std():.2f}')
-        print(f'Calibrated Test Accuracy: {accs_calibrated.mean():.2f} ± {accs_calibrated.std():.2f}')
-        print(f'Calibrated Difference: {diffs_calibrated.mean():.2f} ± {diffs_calibrated.std():.2f}')
-        
-        import nni
-        if nni.get_trial_id()!="STANDALONE":
+        print(f'Uncalibrated Test Accuracy: {group["uncalibrated_acc"][0]:.2f} ± {group["uncalibrated_acc"][1]:.2f}')
+        print(f'Uncalibrated Difference: {group["uncalibrated_ece"][0]:.2f} ± {group["uncalibrated_ece"][1]:.2f}')
+        print(f'Calibrated Test Accuracy: {group["calibrated_acc"][0]:.2f} ± {group["calibrated_acc"][1]:.2f}')
+        print(f'Calibrated Difference: {group["calibrated_ece"][0]:.2f} ± {group["calibrated_ece"][1]:.2f}')
+
+        if in_nni_trial():
+            import nni
             metric = {
-                'default': float(diffs_calibrated.mean())
+                'default': float(group["calibrated_ece"][0])
             }
             nni.report_final_result(metric)
 
 
+    def _report(self, job, function, **kwargs):
+        if self.reporter is not None:
+            self.reporter.submit(job, **kwargs)
+        else:
+            function(**kwargs)
+
     def plot(self):
-        warnings.filterwarnings("ignore", category=pd.errors.PerformanceWarning)
-        uncalibrated_degree_confidence_bined_df = pd.concat([r["uncalibrated"]["degree_confidence_bined_df"] for r in self.results])
-        uncalibrated_degree_accuracy_bined_df = pd.concat([r["uncalibrated"]["degree_accuracy_bined_df"] for r in self.results])
-        uncalibrated_degree_diff_bined_df = pd.concat([r["uncalibrated"]["degree_diff_bined_df"] for r in self.results])
-        calibrated_degree_confidence_bined_df = pd.concat([r["calibrated"]["degree_confidence_bined_df"] for r in self.results])
-        calibrated_degree_accuracy_bined_df = pd.concat([r["calibrated"]["degree_accuracy_bined_df"] for r in self.results])
-        calibrated_degree_diff_bined_df = pd.concat([r["calibrated"]["degree_diff_bined_df"] for r in self.results])
-        self._plot_combined_df(uncalibrated_degree_confidence_bined_df, f'{self.root_dir}/confidence/uncalibrated_confidence.png', self.confidence_color, 'confidence')
-        self._plot_combined_df(uncalibrated_degree_accuracy_bined_df, f'{self.root_dir}/accuracy/uncalibrated_accuracy.png', self.accuracy_color, 'accuracy')
-        self._plot_combined_df(uncalibrated_degree_diff_bined_df, f'{self.root_dir}/diff/uncalibrated_diff.png', self.diff_color, 'difference')
-        self._plot_combined_df(calibrated_degree_confidence_bined_df, f'{self.root_dir}/confidence/calibrated_confidence.png', self.confidence_color, 'confidence')
-        self._plot_combined_df(calibrated_degree_accuracy_bined_df, f'{self.root_dir}/accuracy/calibrated_accuracy.png', self.accuracy_color, 'accuracy')
-        self._plot_combined_df(calibrated_degree_diff_bined_df, f'{self.root_dir}/diff/calibrated_diff.png', self.diff_color, 'difference')
-    
+        """
+        Degree-bin plots of all runs, rendered from the bins tables written by save()
+        """
+        self._report("plot", plot_results, root_dir=self.root_dir, prefix=self._prefix(), num_bin=self.num_bin)
+
+    def summarize(self):
+        """
+        {prefix}summary.txt with every stored run of this dataset and calibrator, e.g. from previous sweeps
+        """
+        self._report("summary", write_summary, store_path=self.store.path, root_dir=self.root_dir, prefix=self._prefix(),
+                     dataset=self.ds_name, calibrator=self.calibrator_name)
+
     def save(self):
-        
-        if self.conf.calibration['calibrator_name']=='GETS':            
-            backbone = self.conf.calibration['backbone']
-            torch.save(self.results,f'{self.root_dir}/{backbone}_results.pt')
-        else:
-            torch.save(self.results, f'{self.root_dir}/results.pt')            
-        if "node_gates" in self.results[0]["calibrated"]["others"]:
-            torch.save(self.results[0]["calibrated"]["others"]["node_gates"], f'{self.root_dir}/{backbone}_node_gates.pt')
-            test_idx = self.dataset.test_idxs[0]
-            torch.save(test_idx, f'{self.root_dir}/{backbone}_test_idx.pt')
-        
+        self.save_metrics()
+        self.save_columns()
 
-    def _plot_combined_df(self, df, path, color, y_label):
-        df_mean = df.groupby('degree_range', sort=False).mean().reset_index()
-        df_std = df.groupby('degree_range', sort=False).std().reset_index()
-        fig, ax = plt.subplots(figsize=self.figsize)
-        ax.set_xlabel('degree range', fontsize=self.font_size)
-        ax.set_ylabel(y_label, fontsize=self.font_size)
-        if y_label != "difference":
-            y = (y_label, 'mean')
-        else:
-            y = y_label
-        sns.barplot(
-            x='degree_range',
-            y=y,
-            data=df_mean,
-            color=color,
-            ax=ax,
-            width=self.bar_width
-        )
-
-        # x = np.arange(len(df_mean['degree_range']))
-        # ax.errorbar(
-        #     x, df_mean[y], yerr=df_std[y_label].values.flatten(),
-        #     fmt='none', ecolor='black', elinewidth=self.errwidth, capsize=self.capsize, capthick=self.errwidth
-        # )
-
-        ax.tick_params(axis='y')
-        plt.xticks(rotation=30, fontsize=self.font_size)
-        plt.yticks(fontsize=self.font_size)
-        plt.grid(True)
-        plt.subplots_adjust(
-            left=self.left_adjust, 
-            right=self.right_adjust, 
-            top=self.top_adjust, 
-            bottom=self.bottom_adjust
-        )
-        plt.savefig(path)
\ No newline at end of file
+    def _prefix(self):
+        return f"{self.conf.calibration['backbone']}_" if self.calibrator_name == 'GETS' else ''
+
+    def save_columns(self):
+        """
+        Write the per-node and per-degree-bin results of every run as columnar tables (utils/columns.py):
+        {prefix}results/run{id}/nodes: index, label, prediction and confidence of the test nodes
+        {prefix}results/run{id}/gates: for GETS, top-k expert ids (positions in expert_configs, uint8
+        up to 256 experts) and gates (float16) of every node, not written for a distilled calibrator
+        {prefix}results/run{id}/bins: degree range, count, mean confidence and accuracy of every degree bin
+        """
+        label_dtype = index_dtype(self.dataset.num_classes)
+        for run_id, r in zip(self.run_ids, self.results):
+            root = f'{self.root_dir}/{self._prefix()}results/run{run_id}'
+            index = np.asarray(r["calibrated"]["index"])
+            nodes = {
+                "index": index.astype(index_dtype(self.dataset.g.num_nodes())),
+                "true": r["calibrated"]["true"].astype(label_dtype),
+            }
+            for kind in ["uncalibrated", "calibrated"]:
+                # predictions are kept for the whole graph, store the test nodes'
+                nodes[f"{kind}_pred"] = r[kind]["pred"][index].astype(label_dtype)
+                nodes[f"{kind}_confidence"] = r[kind]["pred_confidence"][index].astype(np.float32)
+            write_columns(f'{root}/nodes', nodes)
+            if "node_gates" in r["calibrated"].get("others", {}):
+                experts, gates = r["calibrated"]["others"]["node_gates"]
+                num_experts = len(self.conf.calibration["expert_configs"])
+                write_columns(f'{root}/gates', {
+                    "experts": experts.cpu().numpy().astype(index_dtype(num_experts - 1)),
+                    "values": gates.float().cpu().numpy().astype(np.float16),
+                })
+
+            confidence = r["uncalibrated"]["degree_confidence_bined_df"]
+            bins = {
+                "degree_min": confidence[("degree", "min")].to_numpy(),
+                "degree_max": confidence[("degree", "max")].to_numpy(),
+                "count": confidence[("count", "")].to_numpy(),
+            }
+            for kind in ["uncalibrated", "calibrated"]:
+                bins[f"{kind}_confidence"] = r[kind]["degree_confidence_bined_df"][("confidence", "mean")].to_numpy(np.float32)
+                bins[f"{kind}_accuracy"] = r[kind]["degree_accuracy_bined_df"][("accuracy", "mean")].to_numpy(np.float32)
+            write_columns(f'{root}/bins', bins)
+
+
+    def save_metrics(self):
+        """
+        Write the scalar metrics of every run to metrics.json, a small summary that sweeps read back
+        """
+        runs = []
+        for run_id, r in zip(self.run_ids, self.results):
+            runs.append({
+                "run": run_id,
+                "uncalibrated_acc": float(r["uncalibrated"]["acc"]),
+                "uncalibrated_diff": float(r["uncalibrated"]["diff"]),
+                "calibrated_acc": float(r["calibrated"]["acc"]),
+                "calibrated_diff": float(r["calibrated"]["diff"]),
+            })
+        metrics = {
+            "dataset": self.ds_name,
+            "calibrator": self.calibrator_name,
+            "runs": runs,
+        }
+        with open(f'{self.root_dir}/{self._prefix()}metrics.json', 'w') as f:
+            json.dump(metrics, f, indent=2)
@@ -0,0 +1,169 @@
+import contextlib
+import json
+import os
+import resource
+import time
+import torch
+import torch.nn as nn
+import dgl.nn as dglnn
+
+# Structured timing of the hot paths (dataset load, base-training epochs, evaluation, calibrator
+# epochs, GETS gating and experts, metrics). Code marks a region with `with profile(name):`; while
+# the profiler is disabled this returns a shared no-op context, so the hooks cost one attribute
+# check. Enabled, every region records wall and CPU time, the process memory peaks and an optional
+# FLOP estimate, exportable as a JSON summary and as a Chrome trace (chrome://tracing, Perfetto).
+
+_DISABLED = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "flops", "args", "wall", "cpu")
+
+    def __init__(self, profiler, name, flops, args):
+        self.profiler = profiler
+        self.name = name
+        self.flops = flops
+        self.args = args
+
+    def __enter__(self):
+        self.profiler._sync()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._sync()
+        wall, cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        flops = self.flops() if callable(self.flops) else self.flops
+        event = {
+            "name": self.name,
+            "pid": os.getpid(),
+            "start": self.wall,
+            "wall_ms": wall * 1000,
+            "cpu_ms": cpu * 1000,
+            # ru_maxrss is in KB on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event["cuda_allocated_mb"] = torch.cuda.memory_allocated() / 1024 ** 2
+            event["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / 1024 ** 2
+        if flops is not None:
+            event["flops"] = flops
+        event.update(self.args)
+        self.profiler.events.append(event)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sync_cuda = True
+        self.events = []
+
+    def enable(self, sync_cuda=True):
+        """
+        sync_cuda: synchronize the GPU at region boundaries, so that wall times include the kernels
+        """
+        self.enabled = True
+        self.sync_cuda = sync_cuda
+
+    def disable(self):
+        self.enabled = False
+
+    def _sync(self):
+        if self.sync_cuda and torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    def drain(self):
+        """
+        Hand over the recorded events, e.g. from a worker process to the parent
+        """
+        events, self.events = self.events, []
+        return events
+
+    def summary(self):
+        """
+        Per region: calls, total/mean/max wall time, CPU time, FLOPs and throughput, memory peaks
+        """
+        regions = {}
+        for event in self.events:
+            region = regions.setdefault(event["name"], {"calls": 0, "wall_ms": 0.0, "max_wall_ms": 0.0, "cpu_ms": 0.0, "flops": 0, "peak_rss_mb": 0.0})
+            region["calls"] += 1
+            region["wall_ms"] += event["wall_ms"]
+            region["max_wall_ms"] = max(region["max_wall_ms"], event["wall_ms"])
+            region["cpu_ms"] += event["cpu_ms"]
+            region["flops"] += event.get("flops", 0)
+            region["peak_rss_mb"] = max(region["peak_rss_mb"], event["peak_rss_mb"])
+            if "cuda_peak_mb" in event:
+                region["cuda_peak_mb"] = max(region.get("cuda_peak_mb", 0.0), event["cuda_peak_mb"])
+        for region in regions.values():
+            region["mean_wall_ms"] = region["wall_ms"] / region["calls"]
+            region["gflops_per_s"] = region["flops"] / region["wall_ms"] / 1e6 if region["flops"] and region["wall_ms"] else None
+        return dict(sorted(regions.items(), key=lambda item: -item[1]["wall_ms"]))
+
+    def format_summary(self):
+        lines = [f"{'region':<24s} {'calls':>6s} {'wall (ms)':>11s} {'mean (ms)':>10s} {'cpu (ms)':>11s} {'GFLOP/s':>8s} {'peak RSS (MB)':>14s}"]
+        for name, region in self.summary().items():
+            gflops = f"{region['gflops_per_s']:.2f}" if region["gflops_per_s"] is not None else "-"
+            lines.append(f"{name:<24s} {region['calls']:>6d} {region['wall_ms']:>11.1f} {region['mean_wall_ms']:>10.2f} "
+                         f"{region['cpu_ms']:>11.1f} {gflops:>8s} {region['peak_rss_mb']:>14.1f}")
+        return "\n".join(lines)
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "events": self.events}, f, indent=2)
+
+    def export_chrome_trace(self, path):
+        """
+        Complete ("X") events in the Trace Event Format; nested regions show up nested per process
+        """
+        origin = min((event["start"] for event in self.events), default=0.0)
+        trace = []
+        for event in self.events:
+            args = {key: value for key, value in event.items() if key not in ("name", "pid", "start", "wall_ms")}
+            trace.append({
+                "name": event["name"],
+                "ph": "X",
+                "ts": (event["start"] - origin) * 1e6,
+                "dur": event["wall_ms"] * 1000,
+                "pid": event["pid"],
+                "tid": event["pid"],
+                "args": args,
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+PROFILER = Profiler()
+
+
+def profile(name, flops=None, **args):
+    """
+    Context manager timing a region. flops: estimate for the region, or a callable that is only
+    evaluated when the profiler is enabled. Extra keyword arguments are stored with the event.
+    """
+    if not PROFILER.enabled:
+        return _DISABLED
+    return _Span(PROFILER, name, flops, args)
+
+
+def estimate_flops(module, g):
+    """
+    Rough forward FLOPs of a GNN or calibrator on g: every dense layer is applied to all nodes
+    (2 * in * out per node) and every message-passing layer does one multiply-add per edge and
+    aggregated feature. Dropout, activations and normalization are not counted.
+    """
+    n, e = g.num_nodes(), g.num_edges()
+    flops = 0
+    for m in module.modules():
+        if isinstance(m, nn.Linear):
+            flops += 2 * n * m.in_features * m.out_features
+        elif isinstance(m, dglnn.GraphConv):
+            flops += 2 * n * m._in_feats * m._out_feats + 2 * e * min(m._in_feats, m._out_feats)
+        elif isinstance(m, dglnn.GATConv):
+            # fc is an nn.Linear counted above; attention logits, softmax and weighted aggregation
+            flops += e * m._num_heads * (2 * m._out_feats + 6)
+        elif isinstance(m, dglnn.GINConv):
+            in_feats = next((l.in_features for l in m.apply_func.modules() if isinstance(l, nn.Linear)), 0) if m.apply_func is not None else 0
+            flops += 2 * e * in_feats
+    return flops
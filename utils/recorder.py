@@ -6,15 +6,48 @@ class Recorder:
         self.best_metric = -1
         self.wait = 0
 
-    def add(self, metric_val):
+    def add(self, metric_val, steps=1):
+        """
+        steps: epochs since the previous call, so patience stays counted in epochs when
+        the metric is not evaluated every epoch
+        """
         flag = metric_val > self.best_metric
 
         if flag:
             self.best_metric = metric_val
             self.wait = 0
         else:
-            self.wait += 1
+            self.wait += steps
 
         flag_earlystop = self.patience and self.wait >= self.patience
 
-        return flag, flag_earlystop
\ No newline at end of file
+        return flag, flag_earlystop
+
+class ValidationScheduler:
+    """
+    Decides in which epochs the validation set is evaluated: every `every` epochs and always in
+    the last one. With adaptive=True it switches to every epoch while the validation metric has
+    stopped improving, near a plateau, where skipping epochs would most likely miss the best model.
+    """
+    def __init__(self, epochs, every=1, adaptive=False):
+        self.epochs = epochs
+        self.every = max(1, every or 1)
+        self.adaptive = adaptive
+        self.last = -1
+        self.plateau = False
+
+    def due(self, epoch):
+        interval = 1 if self.plateau else self.every
+        return epoch - self.last >= interval or epoch == self.epochs - 1
+
+    def mark(self, epoch):
+        """
+        Record an evaluation at `epoch`, returns the number of epochs since the previous one
+        """
+        steps = epoch - self.last
+        self.last = epoch
+        return steps
+
+    def update(self, improved):
+        if self.adaptive:
+            self.plateau = not improved
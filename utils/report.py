@@ -0,0 +1,138 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import traceback
+import numpy as np
+from utils.columns import read_columns
+from utils.store import ResultStore, format_groups, METRICS
+
+# Reporting off the experiment's critical path. Logger hands plot and summary jobs to a background
+# process (report.py --serve) that renders them from what the run already wrote to disk: the
+# columnar bins tables of every run and the result store. The same functions regenerate the plots
+# and summaries of any stored result later, without rerunning anything (python report.py).
+
+STYLE = {
+    "bar_width": 0.5,
+    "font_size": 40,
+    "left_adjust": 0.12,
+    "right_adjust": 0.95,
+    "top_adjust": 0.95,
+    "bottom_adjust": 0.24,
+}
+PLOTS = [
+    # (directory, y label, color)
+    ("confidence", "confidence", "#AECDE1"),
+    ("accuracy", "accuracy", "#BBDE93"),
+    ("diff", "difference", "#EE9F9B"),
+]
+REPORT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "report.py")
+
+
+def load_bins(root_dir, prefix=''):
+    """
+    Degree-bin tables of every run stored under root_dir, ordered by run id
+    """
+    paths = glob.glob(os.path.join(root_dir, f"{prefix}results", "run*", "bins"))
+    paths = sorted(paths, key=lambda path: int(os.path.basename(os.path.dirname(path))[3:]))
+    return [read_columns(path, mmap=False) for path in paths]
+
+
+def bins_frame(bins, kind, name):
+    import pandas as pd
+    frames = []
+    for b in bins:
+        confidence, accuracy = b[f"{kind}_confidence"], b[f"{kind}_accuracy"]
+        value = {"confidence": confidence, "accuracy": accuracy, "diff": np.abs(confidence - accuracy)}[name]
+        frames.append(pd.DataFrame({
+            "degree_range": [f"[{int(lo)}, {int(hi)}]" for lo, hi in zip(b["degree_min"], b["degree_max"])],
+            "value": value,
+        }))
+    return pd.concat(frames)
+
+
+def plot_results(root_dir, prefix='', num_bin=None):
+    """
+    Bar plots of the mean confidence, accuracy and calibration gap per degree bin over all runs,
+    before and after calibration, written to {root_dir}/{confidence,accuracy,diff}/
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    bins = load_bins(root_dir, prefix)
+    if not bins:
+        raise FileNotFoundError(f"No results/run*/bins tables in {root_dir}")
+    num_bin = num_bin or len(bins[0]["count"])
+    for name, y_label, color in PLOTS:
+        os.makedirs(os.path.join(root_dir, name), exist_ok=True)
+        for kind in ["uncalibrated", "calibrated"]:
+            df_mean = bins_frame(bins, kind, name).groupby("degree_range", sort=False).mean().reset_index()
+            fig, ax = plt.subplots(figsize=(num_bin * 2, 12))
+            ax.set_xlabel("degree range", fontsize=STYLE["font_size"])
+            ax.set_ylabel(y_label, fontsize=STYLE["font_size"])
+            sns.barplot(x="degree_range", y="value", data=df_mean, color=color, ax=ax, width=STYLE["bar_width"])
+            plt.xticks(rotation=30, fontsize=STYLE["font_size"])
+            plt.yticks(fontsize=STYLE["font_size"])
+            plt.grid(True)
+            plt.subplots_adjust(left=STYLE["left_adjust"], right=STYLE["right_adjust"], top=STYLE["top_adjust"], bottom=STYLE["bottom_adjust"])
+            plt.savefig(os.path.join(root_dir, name, f"{prefix}{kind}_{name}.png"))
+            plt.close(fig)
+
+
+def write_summary(store_path, root_dir, prefix='', **filters):
+    """
+    Aggregates of every stored run matching the filters (e.g. dataset, calibrator), one line per
+    configuration, written to {root_dir}/{prefix}summary.txt
+    """
+    store = ResultStore(store_path)
+    try:
+        groups = store.aggregate(metrics=METRICS, **filters)
+    finally:
+        store.close()
+    with open(os.path.join(root_dir, f"{prefix}summary.txt"), "w") as f:
+        f.write(f"Stored runs in {store_path} matching {filters}:\n")
+        f.write(format_groups(groups, METRICS) + "\n")
+
+
+JOBS = {
+    "plot": plot_results,
+    "summary": write_summary,
+}
+
+
+def serve(stream=sys.stdin):
+    """
+    Run the jobs sent as JSON lines ({"job": name, "kwargs": {...}}) until the stream is closed.
+    A failing job is reported and skipped, it never affects the experiment.
+    """
+    for line in stream:
+        message = json.loads(line)
+        try:
+            JOBS[message["job"]](**message["kwargs"])
+        except Exception:
+            print(f"Report job {message['job']} failed:", file=sys.stderr)
+            traceback.print_exc()
+
+
+class Reporter:
+    """
+    Background reporting process. It is a fresh interpreter that does not import torch or the
+    dataset, so it neither inherits the experiment's memory nor competes for its interpreter.
+    """
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, REPORT_SCRIPT, "--serve"], stdin=subprocess.PIPE, text=True)
+
+    def submit(self, job, **kwargs):
+        assert job in JOBS
+        self.process.stdin.write(json.dumps({"job": job, "kwargs": kwargs}) + "\n")
+        self.process.stdin.flush()
+
+    def close(self, wait=False):
+        """
+        Without wait the process finishes the queued jobs on its own, also after the experiment exited
+        """
+        self.process.stdin.close()
+        if wait:
+            self.process.wait()
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
+import dgl
+from model.calibrator import TS, ETS, CaGCN, CaGCN_GETS
+from model.gats import GATS
+from model.GETS import DEGREES
+from dataset.features import MemmapFeatures
+
+# Online calibrated inference. main.py --save_models DIR leaves the graph structure (graph.bin) and
+# the node features (features.npy) next to the fitted calibrators of every run (run<id>.pt, with
+# their base model). serve.py loads them and answers "calibrated class probabilities of these
+# nodes" over HTTP, on a TCP port or a Unix socket: concurrent requests are coalesced into
+# micro-batches, and every batch runs the base model and the calibrator once, on the receptive
+# field of the union of its nodes.
+
+GRAPH_FILE = "graph.bin"
+FEATURES_FILE = "features.npy"
+
+
+def save_graph(directory, g, features):
+    """
+    Write the graph structure and the node features of a dataset to directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    src, dst = g.edges()
+    dgl.save_graphs(os.path.join(directory, GRAPH_FILE), [dgl.graph((src.cpu(), dst.cpu()), num_nodes=g.num_nodes(), idtype=g.idtype)])
+    path = os.path.join(directory, FEATURES_FILE)
+    if isinstance(features, MemmapFeatures):
+        shutil.copyfile(features.path, path)
+    else:
+        MemmapFeatures.create(path, features)
+
+
+def load_graph(directory, device=None, feature_cache_mb=1024):
+    """
+    Graph and memory-mapped node features written by save_graph
+    """
+    (g,), _ = dgl.load_graphs(os.path.join(directory, GRAPH_FILE))
+    features = MemmapFeatures(os.path.join(directory, FEATURES_FILE), device=device, cache_mb=feature_cache_mb)
+    return g.to(device or "cpu"), features
+
+
+def save_model(path, calibrator, base=None):
+    """
+    Pickle a fitted calibrator with its base model (or `base` instead, e.g. the trained network
+    behind cached logits), without its training state
+    """
+    state = {name: calibrator.__dict__.pop(name) for name in ("optimizer", "train_param") if name in calibrator.__dict__}
+    model = calibrator.model
+    try:
+        if base is not None:
+            calibrator.model = base
+        torch.save(calibrator, path)
+    finally:
+        calibrator.model = model
+        calibrator.__dict__.update(state)
+
+
+def load_model(path, device=None):
+    calibrator = torch.load(path, map_location=device or "cpu")
+    return calibrator.eval()
+
+
+def num_hops(calibrator):
+    """
+    Message-passing layers of the base model followed by the calibrator
+    """
+    hops = len(calibrator.model.layers)
+    if isinstance(calibrator, CaGCN_GETS):
+        return hops + max(len(expert.feature_list) - 1 for expert in calibrator.learner.experts)
+    if isinstance(calibrator, CaGCN):
+        return hops + len(calibrator.cagcn.feature_list) - 1
+    if isinstance(calibrator, GATS):
+        return hops + 1
+    if isinstance(calibrator, (TS, ETS)):
+        return hops
+    raise NotImplementedError(f"Serving {type(calibrator).__name__} is not supported, use GETS, CaGCN, GATS, TS or ETS")
+
+
+class SubgraphInference:
+    """
+    Calibrated class probabilities of a set of nodes, computed on their receptive field: the layers
+    of the base model and of the calibrator plus one hop, so that every aggregating node keeps its
+    full-graph degree normalisation (the graphs are symmetric), with the full-graph degrees for the
+    GETS degree experts. A receptive field of more than half the graph is replaced by the graph.
+    """
+    def __init__(self, calibrator, g, features, device=None):
+        self.calibrator = calibrator
+        self.g = g
+        self.features = features
+        self.device = torch.device(device or "cpu")
+        self.hops = num_hops(calibrator) + 1
+        self.degrees = g.in_degrees() + g.out_degrees()
+
+    @torch.no_grad()
+    def __call__(self, nodes):
+        """
+        nodes: unique node ids. Returns their probabilities [len(nodes), C] and the nodes computed on
+        """
+        sg, seeds = dgl.khop_in_subgraph(self.g, nodes.to(self.g.device, self.g.idtype), self.hops, store_ids=True)
+        if sg.num_nodes() > 0.5 * self.g.num_nodes():
+            sg, seeds, nid = self.g, nodes.to(self.g.device), None
+            features = self.features
+        else:
+            nid = sg.ndata[dgl.NID].long()
+            sg.ndata[DEGREES] = self.degrees[nid]
+            features = self.features[nid].to(self.device)
+        if isinstance(self.calibrator, GATS):
+            out = self.calibrator(sg, features, nid)
+        else:
+            out = self.calibrator(sg, features)
+        logits = out[0] if isinstance(out, tuple) else out
+        return F.softmax(logits[seeds.long()].float(), dim=1).cpu(), sg.num_nodes()
+
+
+class ServingStats:
+    """
+    Request latencies (arrival to response), queueing delays and per-batch sizes and inference
+    times over the last `window` requests and batches
+    """
+    def __init__(self, window=10000):
+        self.latency_ms = deque(maxlen=window)
+        self.queue_ms = deque(maxlen=window)
+        self.batch_requests = deque(maxlen=window)
+        self.batch_nodes = deque(maxlen=window)
+        self.subgraph_nodes = deque(maxlen=window)
+        self.inference_ms = deque(maxlen=window)
+        self.requests = self.batches = self.errors = 0
+        self.started = time.time()
+
+    @staticmethod
+    def _describe(values):
+        if not values:
+            return None
+        values = np.asarray(values, dtype=float)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {"mean": float(values.mean()), "p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "uptime_s": time.time() - self.started,
+            "latency_ms": self._describe(self.latency_ms),
+            "queue_ms": self._describe(self.queue_ms),
+            "inference_ms": self._describe(self.inference_ms),
+            "batch_requests": self._describe(self.batch_requests),
+            "batch_nodes": self._describe(self.batch_nodes),
+            "subgraph_nodes": self._describe(self.subgraph_nodes),
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests: a batch starts with the oldest waiting request and takes the
+    requests arriving within max_wait_ms, up to max_batch_nodes nodes. Batches run one at a time on
+    an inference thread, so the event loop keeps accepting requests, which form the next batch.
+    """
+    def __init__(self, infer, max_batch_nodes=1024, max_wait_ms=2.0, stats=None):
+        self.infer = infer
+        self.max_batch_nodes = max_batch_nodes
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or ServingStats()
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="inference")
+
+    async def submit(self, nodes):
+        """
+        Probabilities [len(nodes), C] of the node ids in the list nodes
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((nodes, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_nodes:
+            try:
+                if self.queue.empty():
+                    item = await asyncio.wait_for(self.queue.get(), deadline - loop.time())
+                else:
+                    item = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            start = time.perf_counter()
+            nodes = torch.tensor([n for item in batch for n in item[0]], dtype=torch.int64)
+            unique, inverse = torch.unique(nodes, return_inverse=True)
+            try:
+                probs, computed = await loop.run_in_executor(self.executor, self.infer, unique)
+            except Exception as e:
+                self.stats.errors += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            end = time.perf_counter()
+            stats = self.stats
+            stats.batches += 1
+            stats.batch_requests.append(len(batch))
+            stats.batch_nodes.append(len(unique))
+            stats.subgraph_nodes.append(computed)
+            stats.inference_ms.append((end - start) * 1000)
+            offset = 0
+            for requested, future, arrival in batch:
+                rows = inverse[offset:offset + len(requested)]
+                offset += len(requested)
+                stats.requests += 1
+                stats.queue_ms.append((start - arrival) * 1000)
+                stats.latency_ms.append((time.perf_counter() - arrival) * 1000)
+                if not future.done():
+                    future.set_result(probs[rows])
+
+
+class Server:
+    """
+    HTTP/1.1 with keep-alive on asyncio streams:
+      POST /predict {"nodes": [ids]} -> {"nodes", "probabilities", "predictions", "confidences"}
+      GET /metrics -> latency percentiles and batch sizes (ServingStats.summary)
+      GET /health
+    """
+    def __init__(self, batcher, num_nodes, max_request_nodes=10000):
+        self.batcher = batcher
+        self.num_nodes = num_nodes
+        self.max_request_nodes = max_request_nodes
+
+    async def predict(self, body):
+        try:
+            nodes = json.loads(body)["nodes"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": 'expected a JSON body {"nodes": [node ids]}'}
+        if not isinstance(nodes, list) or not nodes or len(nodes) > self.max_request_nodes:
+            return 400, {"error": f"nodes must be a list of 1 to {self.max_request_nodes} node ids"}
+        if not all(isinstance(n, int) and 0 <= n < self.num_nodes for n in nodes):
+            return 400, {"error": f"node ids must be integers in [0, {self.num_nodes})"}
+        probs = await self.batcher.submit(nodes)
+        confidences, predictions = probs.max(dim=1)
+        return 200, {"nodes": nodes, "probabilities": probs.tolist(), "predictions": predictions.tolist(),
+                     "confidences": confidences.tolist()}
+
+    async def route(self, method, path, body):
+        if method == "POST" and path == "/predict":
+            return await self.predict(body)
+        if method == "GET" and path == "/metrics":
+            return 200, self.batcher.stats.summary()
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "num_nodes": self.num_nodes}
+        return 404, {"error": f"no route {method} {path}"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {"error": repr(e)}
+                data = json.dumps(payload).encode()
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, socket=None, ready=None):
+        """
+        Listen on socket (a Unix socket path) if given, on host:port otherwise; calls ready() once listening
+        """
+        batching = asyncio.create_task(self.batcher.run())
+        if socket is not None:
+            if os.path.exists(socket):
+                os.remove(socket)
+            server = await asyncio.start_unix_server(self.handle, path=socket)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching.cancel()
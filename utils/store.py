@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import sqlite3
+import time
+
+# Append-only store of experiment runs in a local SQLite file, shared by every run and sweep that
+# points to it. Rows are only ever inserted; one row per (invocation, split/seed).
+
+COLUMNS = [
+    ("batch", "TEXT"),
+    ("created", "REAL"),
+    ("dataset", "TEXT"),
+    ("calibrator", "TEXT"),
+    ("backbone", "TEXT"),
+    ("config_hash", "TEXT"),
+    ("seed", "INTEGER"),
+    ("run", "INTEGER"),
+    ("uncalibrated_acc", "REAL"),
+    ("uncalibrated_ece", "REAL"),
+    ("calibrated_acc", "REAL"),
+    ("calibrated_ece", "REAL"),
+    ("uncalibrated_gaps", "TEXT"),
+    ("calibrated_gaps", "TEXT"),
+    ("fit_time", "REAL"),
+    ("calibration_time", "REAL"),
+    ("peak_memory_mb", "REAL"),
+    ("config", "TEXT"),
+]
+METRICS = ["uncalibrated_acc", "uncalibrated_ece", "calibrated_acc", "calibrated_ece", "fit_time", "calibration_time", "peak_memory_mb"]
+KEYS = ["dataset", "calibrator", "backbone", "config_hash", "batch", "seed", "run"]
+
+
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # concurrent sweep jobs append to the same file, wait for the writer lock instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, {', '.join(f'{n} {t}' for n, t in COLUMNS)})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS runs_key ON runs (dataset, calibrator, config_hash, seed)")
+        self.conn.commit()
+
+    def add(self, rows):
+        names = [name for name, _ in COLUMNS]
+        values = []
+        for row in rows:
+            row = dict(row, created=row.get("created", time.time()))
+            for name in ["uncalibrated_gaps", "calibrated_gaps", "config"]:
+                if name in row and not isinstance(row[name], str):
+                    row[name] = json.dumps(row[name])
+            values.append([row.get(name) for name in names])
+        with self.conn:
+            self.conn.executemany(f"INSERT INTO runs ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", values)
+
+    @staticmethod
+    def _where(filters, where):
+        clauses, params = [], []
+        for key, value in filters.items():
+            if key not in KEYS:
+                raise KeyError(f"Unknown filter {key}, choose from {KEYS}")
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                clauses.append(f"{key} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{key} = ?")
+                params.append(value)
+        if where:
+            clauses.append(f"({where})")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, where=None, **filters):
+        """
+        Rows matching the filters (e.g. dataset="cora", calibrator=["GETS", "TS"]) and an optional
+        raw SQL condition, oldest first
+        """
+        clause, params = self._where(filters, where)
+        rows = self.conn.execute(f"SELECT * FROM runs{clause} ORDER BY id", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def aggregate(self, by=("dataset", "calibrator", "backbone", "config_hash"), metrics=METRICS, where=None, **filters):
+        """
+        Mean and sample standard deviation of the metrics over the runs of every group
+        """
+        by = list(by)
+        clause, params = self._where(filters, where)
+        columns = ", ".join(f"AVG({m}), SUM({m} * {m}), COUNT({m})" for m in metrics)
+        select = f"SELECT {', '.join(by)}, COUNT(*), {columns} FROM runs{clause} GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}"
+        groups = []
+        for row in self.conn.execute(select, params).fetchall():
+            group = {key: row[i] for i, key in enumerate(by)}
+            group["runs"] = row[len(by)]
+            for j, metric in enumerate(metrics):
+                mean, sq, n = row[len(by) + 1 + 3 * j: len(by) + 4 + 3 * j]
+                std = math.sqrt(max(sq - n * mean * mean, 0.0) / (n - 1)) if n and n > 1 else float("nan")
+                group[metric] = (mean, std)
+            groups.append(group)
+        return groups
+
+    def close(self):
+        self.conn.close()
+
+
+def format_groups(groups, metrics=("uncalibrated_acc", "uncalibrated_ece", "calibrated_acc", "calibrated_ece")):
+    if not groups:
+        return "No runs"
+    keys = [k for k in groups[0] if k not in METRICS and k != "runs"]
+    lines = ["  ".join(f"{k:<14s}" for k in keys) + f"  {'runs':>4s}  " + "  ".join(f"{m:>18s}" for m in metrics)]
+    for group in groups:
+        cells = [f"{group[m][0]:>9.2f} ± {group[m][1]:<6.2f}" if group[m][0] is not None else f"{'-':>18s}" for m in metrics]
+        lines.append("  ".join(f"{str(group[k]):<14s}" for k in keys) + f"  {group['runs']:>4d}  " + "  ".join(cells))
+    return "\n".join(lines)
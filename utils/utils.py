@@ -1,5 +1,9 @@
 import os
 import shutil
+import contextlib
+import hashlib
+import json
+import time
 import dgl.random
 import torch
 import numpy as np
@@ -21,6 +25,33 @@ def set_seed(seed):
     torch.backends.cudnn.benchmark = False
 
 
+PRECISIONS = {None: None, 'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def autocast(device, precision=None):
+    """
+    Mixed-precision context for precision in [None, 'fp32', 'bf16', 'fp16']. Parameters stay fp32
+    (master weights), autocast runs matmuls in the low precision dtype; callers compute the
+    log-softmax/cross-entropy on .float() logits so calibration is measured in fp32.
+    """
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def grad_scaler(device, precision=None):
+    """
+    fp16 gradients underflow without loss scaling, bf16 has the fp32 exponent range and needs none
+    """
+    return torch.cuda.amp.GradScaler(enabled=device.type == 'cuda' and precision == 'fp16')
+
+
+def in_nni_trial():
+    # NNI exports NNI_PLATFORM to every trial it launches, so standalone runs never import nni
+    return os.environ.get("NNI_PLATFORM") is not None
+
+
 def setup_directories(root, calibrator, ds_name):
     if os.path.exists(os.path.join(root, calibrator, ds_name)):
         shutil.rmtree(os.path.join(root, calibrator, ds_name))
@@ -31,37 +62,125 @@ def setup_directories(root, calibrator, ds_name):
     # os.makedirs(os.path.join(root, calibrator, ds_name, "diff_diff"))
 
 
-def load_conf(path:str = None, dataset:str = None):
+def parse_overrides(items):
+    """
+    Parse ["calibration.calibrator_name=GETS", "train.lr=1e-2", ...] into a dict, values are read as YAML
+    """
+    overrides = {}
+    for item in items or []:
+        key, value = item.split("=", 1)
+        overrides[key] = yaml.load(value)
+    return overrides
+
+
+def apply_overrides(conf, overrides):
+    """
+    Set "section.key" (or top-level "key") entries of a configuration dict in place
+    """
+    for key, value in overrides.items():
+        if "." in key:
+            section, name = key.split(".", 1)
+            conf[section][name] = value
+        else:
+            conf[key] = value
+    return conf
+
+
+def apply_params(conf, par):
+    """
+    Set tuned parameters by name (the NNI convention): a name replaces the matching key of
+    every section, or the matching top-level entry
+    """
+    for i, dic in conf.items():
+        if type(dic) == type(dict()):
+            for a,b in dic.items():
+                for x,y in par.items():
+                    if x == a:
+                        conf[i][a] = y
+        for x,y in par.items():
+            if x == i:
+                conf[i] = y
+    return conf
+
+
+def conf_name(dataset:str):
+    """
+    All generated graphs (synthetic-<model>-<num_nodes>...) share config/synthetic.yaml
+    """
+    return "synthetic" if dataset.startswith("synthetic") else dataset
+
+
+def conf_path(dataset:str, calibrator_name:str = None):
+    """
+    Configuration file used for a dataset, GETS reads its own copy from gets_config
+    """
+    path = os.path.join("config", conf_name(dataset)+".yaml")
+    if calibrator_name == 'GETS':
+        path = "gets_"+path
+    return path
+
+
+def load_conf(path:str = None, dataset:str = None, overrides:dict = None):
+    overrides = overrides or {}
     if path == None:
         dir = "config"
-        path = os.path.join(dir, dataset+".yaml")
+        path = os.path.join(dir, conf_name(dataset)+".yaml")
         if os.path.exists(path) == False:
             raise KeyError("The configuration file is not provided.")
     
     conf = open(path, "r").read()
     conf = yaml.load(conf)
 
-    if conf['calibration']['calibrator_name'] == 'GETS':
+    calibrator_name = overrides.get('calibration.calibrator_name', conf['calibration']['calibrator_name'])
+    if calibrator_name == 'GETS':
         conf = open("gets_"+path, "r").read()
         conf = yaml.load(conf)
+    apply_overrides(conf, overrides)
 
-    import nni
-    if nni.get_trial_id()!="STANDALONE":
+    if in_nni_trial():
+        import nni
         par = nni.get_next_parameter()
-        for i, dic in conf.items():
-            if type(dic) == type(dict()):
-                for a,b in dic.items():
-                    for x,y in par.items():
-                        if x == a:
-                            conf[i][a] = y
-            for x,y in par.items():
-                if x == i:
-                    conf[i] = y
+        apply_params(conf, par)
                     
     conf = argparse.Namespace(**conf)
 
     return conf
 
+def inference_latency(model, g, features, repeat=10):
+    """
+    Median wall time in ms of an eval-mode forward pass, after one warm-up pass
+    """
+    model.eval()
+    timings = []
+    with torch.no_grad():
+        model(g, features)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(g, features)
+            if features.is_cuda:
+                torch.cuda.synchronize()
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def peak_memory_mb(device):
+    """
+    Peak memory of the process so far: allocated CUDA memory on a GPU, resident set size otherwise
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 ** 2
+    import resource
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def conf_hash(conf):
+    """
+    Short stable hash of a configuration, identifies runs of the same setting across sweeps
+    """
+    return hashlib.sha1(json.dumps(vars(conf), sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
 def accuracy(logits, labels):
     _, indices = torch.max(logits, dim=1)
     correct = torch.sum(indices == labels)
@@ -2,10 +2,10 @@ import argparse
 import networkx as nx
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
-import torch
 import os
 import random
 from dataset.dataset import Dataset
+from utils.columns import read_columns
 
 num_node = 1000
 figsize = (28, 20)
@@ -43,18 +43,23 @@ if __name__ == "__main__":
     parser.add_argument("--dataset", type=str, default="cora", help="Choose from: [cora, citeseer, pubmed, cora-full, computers, photo, cs, physics, ogbn-arxiv]")
     parser.add_argument("--gpu", type=int, default=0, help="Use which gpu")
     parser.add_argument("--no", type=int, default=1)
+    parser.add_argument("--backbone", type=str, default="gcn")
+    parser.add_argument("--run", type=int, default=0, help="Which run's node gates to draw")
+    parser.add_argument("--output", type=str, default="output")
     args = parser.parse_args()
     os.environ['CUDA_VISIBLE_DEVICES'] = str(args.gpu)
 
     dataset = Dataset(ds_name=args.dataset, n_runs=1)
     G = dataset.g.cpu().to_networkx().to_undirected()
     G.remove_edges_from(nx.selfloop_edges(G))
-    node_gates = torch.load(f"output/MoE/{args.dataset}/node_gates.pt")
+    root = f"{args.output}/GETS/{args.dataset}"
+    # the top-ranked expert of every node, memory-mapped from the columnar results
+    top_expert = read_columns(f"{root}/{args.backbone}_results/run{args.run}/gates", ["experts"])["experts"][:, 0]
 
     start_node = random.choice(list(G.nodes()))
     subgraph = bfs_subgraph(G, start_node, num_node)
     subgraph_nodes = list(subgraph.nodes())
-    subgraph_gates = torch.argmax(node_gates[subgraph_nodes], dim=1).tolist()
+    subgraph_gates = top_expert[subgraph_nodes].tolist()
     subgraph_colors = [predefined_colors[g] for g in subgraph_gates]
 
     plt.figure(figsize=figsize)
@@ -64,4 +69,4 @@ if __name__ == "__main__":
     legend_elements = [Patch(facecolor=color, edgecolor='gray', label=predefined_experts[i]) for i, color in enumerate(predefined_colors)]
     # plt.legend(handles=legend_elements, loc='upper right', prop={'size': lengend_size})
 
-    plt.savefig(f"output/MoE/{args.dataset}/subgraph_vis_{args.no}.png")
\ No newline at end of file
+    plt.savefig(f"{root}/subgraph_vis_{args.no}.png")
\ No newline at end of file